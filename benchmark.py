@@ -0,0 +1,514 @@
+import os
+import time
+import argparse
+os.environ["HF_HOME"] = r"./.cache"
+
+
+def print_results(title, header, rows):
+    """
+    Prints a simple aligned table of benchmark results.
+    """
+    print(f"\n{title}")
+    widths = [max(len(str(r[i])) for r in [header, *rows]) for i in range(len(header))]
+    for row in [header, *rows]:
+        print(" | ".join(f"{str(c):>{w}}" for c, w in zip(row, widths)))
+
+
+def benchmark_tokenization(args):
+    """
+    Rows/sec of the per-row and batched tokenization maps used by `EnJaDatasetMaker`.
+    """
+    from datasets import disable_progress_bar
+    from utils.dataset import EnJaDatasetMaker
+    from utils.dataset.dataset_base import EnJaDataset
+    from utils.model import EnJaModelLoader
+
+    disable_progress_bar()
+    data = EnJaDataset.load_processed(args.dataset)
+    data = data.select(range(min(args.nrows, len(data))))
+    trg_lang = "ja" if args.source_language == "en" else "en"
+    data = data.rename_columns({
+        f"{args.source_language}_sentence": "source",
+        f"{trg_lang}_sentence": "target"
+    })
+
+    if args.model_type == "mBART":
+        tokenizers = dict(tokenizer=EnJaModelLoader.get_tokenizers("mBART", args.source_language)["encoder_tokenizer"])
+        modes = {
+            "per-row": (EnJaDatasetMaker._get_map_compute_mBART_tokenization, False),
+            "batched": (EnJaDatasetMaker._get_batched_map_compute_mBART_tokenization, True),
+        }
+    else: # args.model_type == "BERT-GPT2"
+        tokenizers = EnJaModelLoader.get_tokenizers("BERT-GPT2-xattn", args.source_language)
+        modes = {
+            "per-row": (EnJaDatasetMaker._get_map_compute_BERT_GPT2_tokenization, False),
+            "batched": (EnJaDatasetMaker._get_batched_map_compute_BERT_GPT2_tokenization, True),
+        }
+
+    rows = []
+    for num_proc in args.num_proc:
+        rates = {}
+        for mode, (get_map, batched) in modes.items():
+            start = time.perf_counter()
+            data.map(
+                get_map(**tokenizers), batched=batched,
+                num_proc=num_proc, load_from_cache_file=False
+            )
+            rates[mode] = len(data) / (time.perf_counter() - start)
+        rows.append([
+            num_proc, f"{rates['per-row']:,.0f}", f"{rates['batched']:,.0f}",
+            f"x{rates['batched'] / rates['per-row']:.2f}"
+        ])
+    print_results(
+        f"Tokenization throughput ({args.model_type}, {len(data)} rows, rows/sec)",
+        ["num_proc", "per-row", "batched", "speedup"], rows
+    )
+
+
+def benchmark_load(args):
+    """
+    Cold load time of a processed dataset as csv (huggingface csv builder) and as arrow (memory-mapped).
+    """
+    import tempfile
+    from utils.dataset.dataset_base import EnJaDataset
+
+    data = EnJaDataset.load_processed(args.dataset)
+    name = os.path.splitext(os.path.basename(args.dataset))[0]
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for ext in ["csv", "arrow"]:
+            # freshly written files, the csv builder cannot reuse a previous conversion
+            path = f"{tmp_dir}/{name}.{ext}"
+            EnJaDataset._write_pairs(path, zip(data["en_sentence"], data["ja_sentence"]))
+            start = time.perf_counter()
+            loaded = EnJaDataset.load_processed(path)
+            loaded[len(loaded) - 1]
+            elapsed = time.perf_counter() - start
+            rows.append([ext, f"{os.path.getsize(path) / 1024**2:,.1f}MB", f"{elapsed:.3f}s"])
+    print_results(
+        f"Processed dataset load time ({len(data)} rows)", ["format", "size", "time"], rows
+    )
+
+
+def benchmark_near_dedup(args):
+    """
+    Wall time of MinHash signatures and LSH near duplicate detection with different number of workers.
+    """
+    import numpy as np
+    from utils.dataset.dataset_base import EnJaDataset
+    from utils.dataset.dataset_dedup import EnJaMinHashLSH
+
+    data = EnJaDataset.load_processed(args.dataset)
+    batches = [
+        (batch["en_sentence"], batch["ja_sentence"])
+        for batch in data.iter(batch_size=EnJaMinHashLSH.BATCH_SIZE)
+    ]
+    rows = []
+    for num_proc in args.num_proc:
+        start = time.perf_counter()
+        if num_proc > 1:
+            from multiprocessing import Pool
+            with Pool(num_proc) as pool:
+                signatures = np.concatenate(pool.map(EnJaMinHashLSH._compute_batch_signatures, batches))
+        else:
+            signatures = np.concatenate([EnJaMinHashLSH._compute_batch_signatures(batch) for batch in batches])
+        signing = time.perf_counter() - start
+        start = time.perf_counter()
+        duplicates = EnJaMinHashLSH.get_duplicates(signatures, args.threshold)
+        lsh = time.perf_counter() - start
+        rows.append([num_proc, f"{signing:.1f}s", f"{len(data) / signing:,.0f}", f"{lsh:.1f}s", duplicates.sum()])
+    print_results(
+        f"Near duplicate detection ({len(data)} rows, threshold {args.threshold})",
+        ["num_proc", "minhash", "rows/sec", "lsh", "duplicates"], rows
+    )
+
+
+def benchmark_bleu(args):
+    """
+    Time per evaluation of `SacreBleu` and `NgramMetrics` (BLEU, chrF and chrF++) compute_metrics
+    against the previous implementation (in place masking, references decoded and tokenized at every evaluation).
+    """
+    import numpy as np
+    import sacrebleu
+    from utils.dataset.dataset_base import EnJaDataset
+    from utils.metric import SacreBleu, NgramMetrics
+    from utils.model import EnJaModelLoader
+
+    trg_lang = "ja" if args.source_language == "en" else "en"
+    tokenizer = EnJaModelLoader.get_tokenizers("mBART", args.source_language)["decoder_tokenizer"]
+    targets = EnJaDataset.load_processed(args.dataset)[f"{trg_lang}_sentence"]
+    labels = tokenizer(text_target=targets)["input_ids"]
+    labels_ids = np.full((len(labels), max(map(len, labels))), -100)
+    for i, ids in enumerate(labels):
+        labels_ids[i, :len(ids)] = ids
+    # shifted references as predictions, a realistic mix of matches and misses
+    preds_ids = np.roll(labels_ids, 1, axis=0)
+
+    def previous_compute_metrics(preds):
+        preds_ids, labels_ids = preds
+        preds_ids[preds_ids == -100] = tokenizer.pad_token_id
+        labels_ids[labels_ids == -100] = tokenizer.pad_token_id
+        references = tokenizer.batch_decode(labels_ids, skip_special_tokens=True)
+        predictions = tokenizer.batch_decode(preds_ids, skip_special_tokens=True)
+        return sacrebleu.corpus_bleu(predictions, [references], tokenize=SacreBleu.TOKENIZE[trg_lang]).score
+
+    metric = SacreBleu.get_mBART_metric(tokenizer=tokenizer, target_language=trg_lang)
+    ngram_metrics = NgramMetrics.get_mBART_metric(tokenizer=tokenizer, target_language=trg_lang)
+    runs = {
+        "previous": lambda: previous_compute_metrics((preds_ids.copy(), labels_ids.copy())),
+        "SacreBleu": lambda: metric((preds_ids, labels_ids))["score"],
+        "NgramMetrics (+chrF, chrF++)": lambda: ngram_metrics((preds_ids, labels_ids))["score"],
+    }
+    rows = []
+    for name, run in runs.items():
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            score = run()
+            times.append(time.perf_counter() - start)
+        rows.append([name, f"{times[0] * 1000:,.0f}ms", f"{np.median(times[1:] or times) * 1000:,.0f}ms", f"{score:.2f}"])
+    print_results(
+        f"BLEU compute_metrics ({len(targets)} rows, target {trg_lang})",
+        ["implementation", "first eval", "next evals (median)", "BLEU"], rows
+    )
+
+
+def benchmark_padding(args):
+    """
+    Padding efficiency (real tokens / padded tokens) of the training batches of a packed dataset
+    with random batches, `group_by_length` batches (the trainer default) and token budget batches.
+    """
+    import numpy as np
+    import torch
+    from transformers.trainer_pt_utils import LengthGroupedSampler
+    from utils.dataset import EnJaDatasetMaker, EnJaTokenBudgetBatchSampler
+
+    data = EnJaDatasetMaker.load_packed_dataset(args.dataset_id)["train"]
+    source, target = data.lengths, data.label_lengths
+    generator = torch.Generator().manual_seed(0)
+    batch = lambda order: [order[i : i + args.batch_size] for i in range(0, len(order), args.batch_size)]
+    samplers = {
+        f"random ({args.batch_size} rows)": batch(torch.randperm(len(data), generator=generator).tolist()),
+        f"group_by_length ({args.batch_size} rows)": batch(list(LengthGroupedSampler(
+            args.batch_size, lengths=source.tolist(), generator=generator
+        ))),
+        f"token budget ({args.max_tokens} tokens)": EnJaTokenBudgetBatchSampler(
+            np.maximum(source, target), args.max_tokens, shuffle=True
+        ),
+    }
+    rows = []
+    for name, batches in samplers.items():
+        batches = list(batches)
+        rows.append([
+            name, len(batches), f"{len(data) / len(batches):.1f}",
+            f"{EnJaTokenBudgetBatchSampler.get_padding_efficiency(source, batches):.1%}",
+            f"{EnJaTokenBudgetBatchSampler.get_padding_efficiency(target, batches):.1%}",
+        ])
+    print_results(
+        f"Training batches padding efficiency ({len(data)} rows)",
+        ["batches", "count", "rows/batch", "source", "target"], rows
+    )
+
+
+def benchmark_server(args):
+    """
+    Throughput and latency of `EnJaTranslationServer` over HTTP with local concurrent clients (one sentence
+    per request) against translating one request at a time.
+    """
+    import asyncio
+    import numpy as np
+    import aiohttp
+    from aiohttp import web
+    from utils.dataset.dataset_base import EnJaDataset
+    from utils.evaluation import EnJaCheckpointEvaluator
+    from utils.inference import EnJaTranslator, EnJaTranslationServer
+
+    sentences = EnJaDataset.load_processed(args.dataset)[f"{args.source_language}_sentence"][:args.nrequests]
+    translator = EnJaTranslator(
+        args.model_type, args.source_language, args.run, args.step,
+        gen_config={**EnJaCheckpointEvaluator.GEN_CONFIG, "num_beams": args.num_beams}, device=args.device
+    )
+
+    def get_row(name, concurrency, elapsed, latency, batch_size):
+        latency = np.array(latency) * 1000
+        return [
+            name, concurrency, f"{len(sentences) / elapsed:,.1f}", f"{batch_size:.1f}",
+            *(f"{np.percentile(latency, q):,.0f}ms" for q in [50, 95, 99])
+        ]
+
+    # baseline, one request at a time
+    latency, start = [], time.perf_counter()
+    for sentence in sentences:
+        request_start = time.perf_counter()
+        translator.translate([sentence])
+        latency.append(time.perf_counter() - request_start)
+    rows = [get_row("one at a time", 1, time.perf_counter() - start, latency, 1.0)]
+
+    async def load_test(concurrency):
+        server = EnJaTranslationServer(translator, max_wait_ms=args.max_wait_ms, max_batch_size=args.max_batch_size)
+        runner = web.AppRunner(server.get_http_app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        host, port = runner.addresses[0][:2]
+        pending, latency = iter(sentences), []
+
+        async def client(session):
+            for sentence in pending:
+                request_start = time.perf_counter()
+                async with session.post(f"http://{host}:{port}/translate", json={"text": sentence}) as response:
+                    await response.json()
+                latency.append(time.perf_counter() - request_start)
+
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+            start = time.perf_counter()
+            await asyncio.gather(*(client(session) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+        batch_size = server.get_report()["mean_batch_size"]
+        await runner.cleanup()
+        return elapsed, latency, batch_size
+
+    for concurrency in args.concurrency:
+        rows.append(get_row("server", concurrency, *asyncio.run(load_test(concurrency))))
+    print_results(
+        f"Translation server ({len(sentences)} requests, wait window {args.max_wait_ms}ms, {translator.device})",
+        ["mode", "concurrency", "sentences/sec", "batch size", "p50", "p95", "p99"], rows
+    )
+
+
+def benchmark_merge(args):
+    """
+    CPU generation latency of a LoRA checkpoint with the adapters wrapped around the base model
+    (`PeftModel.from_pretrained`) and merged into it (`EnJaModelLoader.merge_adapters`).
+    """
+    import numpy as np
+    import torch
+    from peft import PeftModel
+    from utils.dataset.dataset_base import EnJaDataset
+    from utils.evaluation import EnJaCheckpointEvaluator
+    from utils.model import EnJaModelLoader
+
+    torch.set_num_threads(args.threads)
+    step = EnJaModelLoader.get_checkpoints(args.run)[-1] if args.step is None else args.step
+    sentences = EnJaDataset.load_processed(args.dataset)[f"{args.source_language}_sentence"][:args.nsentences]
+    tokenizers = EnJaModelLoader.get_tokenizers(args.model_type, args.source_language)
+    gen_config = {**EnJaCheckpointEvaluator.GEN_CONFIG, "num_beams": args.num_beams}
+    batches = [
+        tokenizers["encoder_tokenizer"](
+            sentences[i : i + args.batch_size], padding=True, truncation=True, return_token_type_ids=False, return_tensors="pt"
+        ) for i in range(0, len(sentences), args.batch_size)
+    ]
+
+    def generate(model):
+        latency, translations = [], []
+        with torch.inference_mode():
+            model.generate(**batches[0], **gen_config) # warm up
+            for batch in batches:
+                start = time.perf_counter()
+                outputs = model.generate(**batch, **gen_config)
+                latency.append(time.perf_counter() - start)
+                translations.extend(tokenizers["decoder_tokenizer"].batch_decode(outputs, skip_special_tokens=True))
+        return np.array(latency) * 1000, translations
+
+    start = time.perf_counter()
+    model = PeftModel.from_pretrained(
+        model=EnJaModelLoader.get_base_model(args.model_type, args.source_language),
+        model_id=EnJaModelLoader.get_checkpoint_path(args.run, step)
+    ).eval()
+    load_time = time.perf_counter() - start
+    adapter_latency, adapter_translations = generate(model)
+
+    # merged in place, the adapter model is not used afterwards
+    start = time.perf_counter()
+    model = EnJaModelLoader.merge_adapters(model).eval()
+    merge_time = time.perf_counter() - start
+    merged_latency, merged_translations = generate(model)
+
+    rows = []
+    for name, prepare_time, latency in [
+        ("LoRA adapters", f"{load_time:.2f}s (load)", adapter_latency),
+        ("merged", f"+{merge_time:.2f}s (merge)", merged_latency),
+    ]:
+        rows.append([
+            name, prepare_time, f"{latency.mean():,.0f}ms", f"{np.percentile(latency, 50):,.0f}ms",
+            f"{np.percentile(latency, 95):,.0f}ms", f"{len(sentences) / (latency.sum() / 1000):,.1f}",
+            f"{adapter_latency.mean() / latency.mean():.2f}x",
+        ])
+    print_results(
+        f"{args.run}/checkpoint-{step} generation on cpu ({len(sentences)} sentences, {len(batches)} batches "
+        f"of {args.batch_size}, {args.num_beams} beams, {args.threads} threads)",
+        ["model", "preparation", "batch mean", "p50", "p95", "sentences/sec", "speedup"], rows
+    )
+    same = sum(a == b for a, b in zip(adapter_translations, merged_translations))
+    print(f"identical translations: {same}/{len(sentences)}")
+
+
+def benchmark_vocabulary(args):
+    """
+    Size, CPU generation latency and training step time of the mBART-50 base model with the whole
+    vocabulary and with the en/ja vocabulary of `EnJaVocabularyTrimmer`.
+    """
+    import numpy as np
+    import torch
+    from utils.dataset.dataset_base import EnJaDataset
+    from utils.evaluation import EnJaCheckpointEvaluator
+    from utils.model import EnJaModelLoader
+
+    torch.set_num_threads(args.threads)
+    target_language = "ja" if args.source_language == "en" else "en"
+    data = EnJaDataset.load_processed(args.dataset)[:args.nsentences]
+    sources, targets = data[f"{args.source_language}_sentence"], data[f"{target_language}_sentence"]
+    gen_config = {**EnJaCheckpointEvaluator.GEN_CONFIG, "num_beams": args.num_beams}
+
+    rows, translations = [], {}
+    for model_type in ["mBART", "mBART-trimmed"]:
+        tokenizer = EnJaModelLoader.get_tokenizers(model_type, args.source_language)["encoder_tokenizer"]
+        model = EnJaModelLoader.get_base_model(model_type, args.source_language).eval()
+        batches = [
+            tokenizer(
+                sources[i : i + args.batch_size], text_target=targets[i : i + args.batch_size],
+                padding=True, truncation=True, return_tensors="pt"
+            ) for i in range(0, len(sources), args.batch_size)
+        ]
+        for batch in batches:
+            batch["labels"][batch["labels"] == tokenizer.pad_token_id] = -100
+
+        # training step (forward and backward with labels)
+        step_time = []
+        model.train()
+        for batch in batches[:args.train_steps + 1]:
+            start = time.perf_counter()
+            model(**batch).loss.backward()
+            step_time.append(time.perf_counter() - start)
+            model.zero_grad(set_to_none=True)
+        step_time = np.array(step_time[1:] if len(step_time) > 1 else step_time) * 1000 # first one warms up
+
+        latency, translations[model_type] = [], []
+        model.eval()
+        with torch.inference_mode():
+            for batch in batches:
+                start = time.perf_counter()
+                outputs = model.generate(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"], **gen_config)
+                latency.append(time.perf_counter() - start)
+                translations[model_type].extend(tokenizer.batch_decode(outputs, skip_special_tokens=True))
+        latency = np.array(latency) * 1000
+
+        embedding_bytes = model.get_input_embeddings().weight.numel() * model.get_input_embeddings().weight.element_size()
+        rows.append([
+            model_type, f"{model.config.vocab_size:,}", f"{sum(p.numel() for p in model.parameters()) / 1e6:,.1f}M",
+            f"{embedding_bytes / 1024**2:,.1f}MB", f"{step_time.mean():,.0f}ms", f"{latency.mean():,.0f}ms",
+            f"{np.percentile(latency, 95):,.0f}ms", f"{len(sources) / (latency.sum() / 1000):,.2f}",
+        ])
+        del model
+    print_results(
+        f"mBART-50 vocabulary trimming on cpu ({len(sources)} sentences, batches of {args.batch_size}, "
+        f"{args.num_beams} beams, {args.threads} threads)",
+        ["model", "vocabulary", "parameters", "embeddings", "train step", "generate mean", "p95", "sentences/sec"], rows
+    )
+    same = sum(a == b for a, b in zip(translations["mBART"], translations["mBART-trimmed"]))
+    print(f"identical translations: {same}/{len(sources)}")
+
+
+def benchmark_wiki_corpus(args):
+    """
+    Wall time of `WikiCorpus` xml parsing and writing with different number of workers.
+    """
+    import tempfile
+    from utils.dataset import WikiCorpus
+    from utils.dataset.dataset_base import EnJaDataset
+
+    WikiCorpus._download_raw()
+    rows, baseline = [], None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_proc in args.num_proc:
+            start = time.perf_counter()
+            nrows = EnJaDataset._write_pairs(
+                f"{tmp_dir}/{WikiCorpus.OUT_NAME}", WikiCorpus._iter_raw_pairs(num_proc=num_proc)
+            )
+            elapsed = time.perf_counter() - start
+            baseline = elapsed if baseline is None else baseline
+            rows.append([num_proc, f"{elapsed:.1f}s", f"{nrows / elapsed:,.0f}", f"x{baseline / elapsed:.2f}"])
+    print_results(
+        "WikiCorpus.create_csv (speedup relative to the first num_proc)",
+        ["num_proc", "time", "rows/sec", "speedup"], rows
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='benchmark',
+        description='Run throughput benchmarks of the data and generation pipelines',
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    tok_parser = subparsers.add_parser('tokenization', help='per-row vs batched tokenization in EnJaDatasetMaker')
+    tok_parser.add_argument('-d', '--dataset', required=True, type=str, help='processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns')
+    tok_parser.add_argument('-l', '--source-language', choices=["en", "ja"], default="en", type=str, help='source language')
+    tok_parser.add_argument('-m', '--model-type', choices=["mBART", "BERT-GPT2"], default="mBART", type=str, help='model type')
+    tok_parser.add_argument('-n', '--nrows', default=100_000, type=int, help='number of rows to tokenize (default: 100000)')
+    tok_parser.add_argument('--num-proc', default=[1, 4, 8], nargs="+", type=int, help='number of workers to test (default: 1 4 8)')
+    tok_parser.set_defaults(func=benchmark_tokenization)
+
+    load_parser = subparsers.add_parser('load', help='csv vs arrow processed dataset load time')
+    load_parser.add_argument('-d', '--dataset', required=True, type=str, help='processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns')
+    load_parser.set_defaults(func=benchmark_load)
+
+    near_parser = subparsers.add_parser('near-dedup', help='MinHash/LSH near duplicate detection')
+    near_parser.add_argument('-d', '--dataset', required=True, type=str, help='processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns')
+    near_parser.add_argument('-t', '--threshold', default=0.8, type=float, help='similarity threshold (default: 0.8)')
+    near_parser.add_argument('--num-proc', default=[1, 4, 8], nargs="+", type=int, help='number of workers to test (default: 1 4 8)')
+    near_parser.set_defaults(func=benchmark_near_dedup)
+
+    bleu_parser = subparsers.add_parser('bleu', help='SacreBleu and NgramMetrics compute_metrics time per evaluation')
+    bleu_parser.add_argument('-d', '--dataset', required=True, type=str, help='processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns, e.g. flores dev')
+    bleu_parser.add_argument('-l', '--source-language', choices=["en", "ja"], default="en", type=str, help='source language')
+    bleu_parser.add_argument('-r', '--repeat', default=5, type=int, help='number of evaluations (default: 5)')
+    bleu_parser.set_defaults(func=benchmark_bleu)
+
+    pad_parser = subparsers.add_parser('padding', help='padding efficiency of fixed size vs token budget training batches')
+    pad_parser.add_argument('-d', '--dataset-id', required=True, type=str, help='dataset id of EnJaDatasetMaker (packed on first use)')
+    pad_parser.add_argument('-b', '--batch-size', default=8, type=int, help='rows per batch of the fixed size batches (default: 8)')
+    pad_parser.add_argument('--max-tokens', default=1024, type=int, help='token budget of a batch, source and target side (default: 1024)')
+    pad_parser.set_defaults(func=benchmark_padding)
+
+    server_parser = subparsers.add_parser('server', help='translation server throughput and latency with concurrent clients')
+    server_parser.add_argument('-d', '--dataset', required=True, type=str, help='processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns')
+    server_parser.add_argument('-m', '--model-type', choices=["mBART", "mBART-trimmed", "BERT-GPT2-xattn", "BERT-GPT2-xattn-LoRA"], default="mBART", type=str, help='model type (default: mBART)')
+    server_parser.add_argument('-l', '--source-language', choices=["en", "ja"], default="en", type=str, help='source language')
+    server_parser.add_argument('-r', '--run', default=None, type=str, help='training run in ./.ckp (default: base model)')
+    server_parser.add_argument('-s', '--step', default=None, type=int, help='checkpoint step (default: last checkpoint of the run)')
+    server_parser.add_argument('-n', '--nrequests', default=256, type=int, help='number of requests (default: 256)')
+    server_parser.add_argument('--concurrency', default=[1, 4, 16, 64], nargs="+", type=int, help='number of concurrent clients to test (default: 1 4 16 64)')
+    server_parser.add_argument('--max-wait-ms', default=5.0, type=float, help='wait window of a batch (default: 5)')
+    server_parser.add_argument('--max-batch-size', default=64, type=int, help='number of sentences that closes a batch (default: 64)')
+    server_parser.add_argument('--num-beams', default=5, type=int, help='number of beams (default: 5)')
+    server_parser.add_argument('--device', default=None, type=str, help='torch device (default: cuda if available, else cpu)')
+    server_parser.set_defaults(func=benchmark_server)
+
+    merge_parser = subparsers.add_parser('merge', help='cpu generation latency of LoRA adapters vs adapters merged into the base model')
+    merge_parser.add_argument('-d', '--dataset', required=True, type=str, help='processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns')
+    merge_parser.add_argument('-m', '--model-type', choices=["mBART", "mBART-trimmed", "BERT-GPT2-xattn-LoRA"], default="mBART", type=str, help='model type (default: mBART)')
+    merge_parser.add_argument('-l', '--source-language', choices=["en", "ja"], default="en", type=str, help='source language')
+    merge_parser.add_argument('-r', '--run', required=True, type=str, help='training run in ./.ckp')
+    merge_parser.add_argument('-s', '--step', default=None, type=int, help='checkpoint step (default: last checkpoint of the run)')
+    merge_parser.add_argument('-n', '--nsentences', default=64, type=int, help='number of sentences (default: 64)')
+    merge_parser.add_argument('-b', '--batch-size', default=8, type=int, help='sentences per batch (default: 8)')
+    merge_parser.add_argument('--num-beams', default=5, type=int, help='number of beams (default: 5)')
+    merge_parser.add_argument('--threads', default=os.cpu_count(), type=int, help='torch cpu threads (default: all cores)')
+    merge_parser.set_defaults(func=benchmark_merge)
+
+    vocab_parser = subparsers.add_parser('vocabulary', help='size and cpu speed of mBART-50 with the whole vs the trimmed en/ja vocabulary')
+    vocab_parser.add_argument('-d', '--dataset', required=True, type=str, help='processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns')
+    vocab_parser.add_argument('-l', '--source-language', choices=["en", "ja"], default="en", type=str, help='source language')
+    vocab_parser.add_argument('-n', '--nsentences', default=64, type=int, help='number of sentences (default: 64)')
+    vocab_parser.add_argument('-b', '--batch-size', default=8, type=int, help='sentences per batch (default: 8)')
+    vocab_parser.add_argument('--num-beams', default=5, type=int, help='number of beams (default: 5)')
+    vocab_parser.add_argument('--train-steps', default=3, type=int, help='timed training steps (default: 3)')
+    vocab_parser.add_argument('--threads', default=os.cpu_count(), type=int, help='torch cpu threads (default: all cores)')
+    vocab_parser.set_defaults(func=benchmark_vocabulary)
+
+    wiki_parser = subparsers.add_parser('wiki-corpus', help='sequential vs parallel WikiCorpus xml parsing')
+    wiki_parser.add_argument('--num-proc', default=[1, 4, 8], nargs="+", type=int, help='number of workers to test (default: 1 4 8)')
+    wiki_parser.set_defaults(func=benchmark_wiki_corpus)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,22 @@
+import os
+import argparse
+os.environ["HF_HOME"] = r"./.cache"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='merge_lora',
+        description='Merge the LoRA adapters of checkpoints into the base model and save plain models for inference',
+    )
+    parser.add_argument('-m', '--model-type', choices=["mBART", "mBART-trimmed", "BERT-GPT2-xattn-LoRA"], default="mBART", type=str, help='model type (default: mBART)')
+    parser.add_argument('-l', '--source-language', choices=["en", "ja"], required=True, type=str, help='source language')
+    parser.add_argument('-r', '--run', required=True, type=str, help='training run in ./.ckp, e.g. en-ja-mixed-500k')
+    parser.add_argument('-s', '--step', default=None, nargs="+", type=int, help='checkpoint steps (default: last checkpoint of the run)')
+    args = parser.parse_args()
+
+    from utils.model import EnJaModelLoader
+
+    steps = args.step if args.step is not None else [EnJaModelLoader.get_checkpoints(args.run)[-1]]
+    for step in steps:
+        path = EnJaModelLoader.save_merged_checkpoint(args.model_type, args.source_language, args.run, step)
+        print(f"checkpoint-{step} merged: {path}")
@@ -0,0 +1,47 @@
+import os
+import asyncio
+import argparse
+os.environ["HF_HOME"] = r"./.cache"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='serve',
+        description='Serve translations of a trained checkpoint over HTTP or stdio, coalescing concurrent requests into batches',
+    )
+    parser.add_argument('-m', '--model-type', choices=["mBART", "mBART-trimmed", "BERT-GPT2-xattn", "BERT-GPT2-xattn-LoRA"], default="mBART", type=str, help='model type (default: mBART)')
+    parser.add_argument('-l', '--source-language', choices=["en", "ja"], required=True, type=str, help='source language')
+    parser.add_argument('-r', '--run', default=None, type=str, help='training run in ./.ckp, e.g. en-ja-mixed-500k (default: base model)')
+    parser.add_argument('-s', '--step', default=None, type=int, help='checkpoint step (default: last checkpoint of the run)')
+    parser.add_argument('--stdio', action="store_true", help='serve json lines on stdin/stdout instead of HTTP')
+    parser.add_argument('--host', default="127.0.0.1", type=str, help='HTTP host (default: 127.0.0.1)')
+    parser.add_argument('--port', default=8080, type=int, help='HTTP port (default: 8080)')
+    parser.add_argument('--max-wait-ms', default=5.0, type=float, help='time a batch waits for more requests (default: 5)')
+    parser.add_argument('--max-batch-size', default=64, type=int, help='number of sentences that closes a batch (default: 64)')
+    parser.add_argument('--max-queue-size', default=1024, type=int, help='waiting requests before new ones are refused (default: 1024)')
+    parser.add_argument('--num-beams', default=5, type=int, help='number of beams (default: 5)')
+    parser.add_argument('--max-batch-tokens', default=8192, type=int, help='token budget of a generation batch, beams included (default: 8192)')
+    parser.add_argument('--device', default=None, type=str, help='torch device (default: cuda if available, else cpu)')
+    parser.add_argument('--memory', default=None, type=str, help='translation memory database, e.g. ./.cache/translation-memory.sqlite (default: none)')
+    parser.add_argument('--memory-size', default=100_000, type=int, help='translations kept in RAM by the memory (default: 100000)')
+    args = parser.parse_args()
+
+    from utils.inference import EnJaTranslationMemory, EnJaTranslator, EnJaTranslationServer
+    from utils.evaluation import EnJaCheckpointEvaluator
+
+    memory = EnJaTranslationMemory(args.memory, capacity=args.memory_size) if args.memory is not None else None
+    translator = EnJaTranslator(
+        args.model_type, args.source_language, args.run, args.step,
+        gen_config={**EnJaCheckpointEvaluator.GEN_CONFIG, "num_beams": args.num_beams},
+        max_batch_tokens=args.max_batch_tokens, max_batch_size=args.max_batch_size, device=args.device, memory=memory
+    )
+    server = EnJaTranslationServer(
+        translator, max_wait_ms=args.max_wait_ms, max_batch_size=args.max_batch_size, max_queue_size=args.max_queue_size
+    )
+    try:
+        asyncio.run(server.serve_stdio() if args.stdio else server.serve_http(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if memory is not None:
+            memory.close()
@@ -0,0 +1,26 @@
+# external libraries
+import numpy as np
+
+# local libraries
+from utils.dataset.dataset_dedup import EnJaMinHashLSH
+
+
+def test_near_duplicates():
+    texts = [
+        EnJaMinHashLSH.normalize("I don't know.", "わかりません。"),
+        EnJaMinHashLSH.normalize("i don 't know", "わかりません"),
+        EnJaMinHashLSH.normalize("The weather is nice today.", "今日はいい天気です。"),
+    ]
+    duplicates = EnJaMinHashLSH.get_duplicates(EnJaMinHashLSH.compute_signatures(texts), 0.8)
+    assert duplicates.tolist() == [False, True, False]
+
+
+def test_empty_texts_are_not_near_duplicates():
+    # different pairs without any alphanumeric character, both empty once normalised
+    texts = [EnJaMinHashLSH.normalize("...", "。。。"), EnJaMinHashLSH.normalize("?!", "、")]
+    assert texts == ["", ""]
+    signatures = EnJaMinHashLSH.compute_signatures([*texts, "abcdefgh"])
+    assert (signatures[:2] == EnJaMinHashLSH.EMPTY_SIGNATURE).all()
+    duplicates = EnJaMinHashLSH.get_duplicates(signatures, 0.8)
+    assert not duplicates.any()
+    assert np.array_equal(EnJaMinHashLSH.get_duplicates(signatures[:2], 0.5), [False, False])
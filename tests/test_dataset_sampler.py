@@ -0,0 +1,81 @@
+# external libraries
+import numpy as np
+import torch
+from torch import nn
+from datasets import Dataset
+from transformers import Seq2SeqTrainingArguments
+
+# local libraries
+from utils.dataset import EnJaTokenBudgetBatchSampler, EnJaTokenBudgetTrainer
+
+
+LENGTHS = np.random.default_rng(0).integers(1, 40, 200)
+
+
+def test_batches_depend_on_seed_and_epoch():
+    sampler = EnJaTokenBudgetBatchSampler(LENGTHS, 128, shuffle=True, seed=1)
+    epochs = [list(sampler) for _ in range(3)]
+    assert all(sorted(i for batch in epoch for i in batch) == list(range(len(LENGTHS))) for epoch in epochs)
+    assert epochs[0] != epochs[1]
+
+    other = EnJaTokenBudgetBatchSampler(LENGTHS, 128, shuffle=True, seed=1)
+    other.set_epoch(2)
+    assert list(other) == epochs[2]
+    other.set_epoch(0)
+    assert list(other) == epochs[0]
+    assert list(EnJaTokenBudgetBatchSampler(LENGTHS, 128, shuffle=True, seed=2)) != epochs[0]
+
+
+class _RecordingModel(nn.Module):
+    # the first token of each row is its index, the batches seen are recorded
+    def __init__(self):
+        super().__init__()
+        self.linear = nn.Linear(1, 1)
+        self.batches = []
+
+    def forward(self, input_ids, labels=None):
+        self.batches.append(sorted(input_ids[:, 0].tolist()))
+        return {"loss": self.linear(input_ids[:, :1].float()).pow(2).mean()}
+
+
+def _collate(rows):
+    input_ids = [torch.as_tensor(row["input_ids"]) for row in rows]
+    return {
+        "input_ids": nn.utils.rnn.pad_sequence(input_ids, batch_first=True),
+        "labels": nn.utils.rnn.pad_sequence([torch.as_tensor(row["labels"]) for row in rows], batch_first=True),
+    }
+
+
+def _train(output_dir, *, resume_from_checkpoint=None):
+    data = Dataset.from_dict({
+        "input_ids": [[i] * int(length) for i, length in enumerate(LENGTHS)],
+        "labels": [[1] * int(length) for length in LENGTHS],
+    })
+    model = _RecordingModel()
+    trainer = EnJaTokenBudgetTrainer(
+        model,
+        args=Seq2SeqTrainingArguments(
+            output_dir=output_dir, num_train_epochs=2, save_strategy="steps", save_steps=5,
+            seed=3, report_to=[], no_cuda=True, disable_tqdm=True,
+        ),
+        data_collator=_collate,
+        train_dataset=data,
+        max_tokens=256,
+    )
+    trainer.train(resume_from_checkpoint=resume_from_checkpoint)
+    return model.batches, len(trainer.get_train_sampler())
+
+
+def test_resumed_training_keeps_the_batch_order(tmp_path):
+    batches, nbatches = _train(str(tmp_path / "full"))
+    assert len(batches) == 2 * nbatches
+    assert batches[:nbatches] != batches[nbatches:]
+
+    # interrupted inside the second epoch, then resumed. The order does not
+    # depend on the global random state, it is not restored
+    _train(str(tmp_path / "resumed"))
+    step = (nbatches // 5 + 1) * 5
+    checkpoint = tmp_path / "resumed" / f"checkpoint-{step}"
+    (checkpoint / "rng_state.pth").unlink()
+    resumed, _ = _train(str(tmp_path / "resumed"), resume_from_checkpoint=str(checkpoint))
+    assert resumed == batches[step:]
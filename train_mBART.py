@@ -30,26 +30,28 @@ if __name__ == "__main__":
     parser.add_argument('-l', '--source-language', choices=["en", "ja"], type=str, help='source language')
     parser.add_argument('-d', '--dataset-name', choices=["mixed-500k", "mixed-250k+bt-250k", "news-250k", "ckp-25000-bt-500k"], type=str, help='dataset name')
     parser.add_argument('--resume', default=True, action=argparse.BooleanOptionalAction, help="resume training from checkpoint (default: True)")
+    parser.add_argument('--max-tokens', default=1024, type=int, help="token budget of a training batch, source and target side (default: 1024)")
+    parser.add_argument('--trimmed', action="store_true", help="train the en/ja vocabulary mBART of trim_vocabulary.py, on the '<dataset>-trimmed' dataset made by 'trim_vocabulary.py -d <source>-<target>-<dataset> -l <source>'")
     args = parser.parse_args()
     
     SOURCE_LANG = args.source_language
     TARGET_LANG = "ja" if SOURCE_LANG == "en" else "en"
     DATASET_NAME = args.dataset_name
     RESUME = args.resume
+    MAX_TOKENS = args.max_tokens
+    MODEL_TYPE = "mBART-trimmed" if args.trimmed else "mBART"
+    # trimmed vocabulary ids, datasets and checkpoints are kept apart
+    SUFFIX = "-trimmed" if args.trimmed else ""
     
-    from utils.dataset import EnJaDatasetMaker
+    from utils.dataset import EnJaDatasetMaker, EnJaPackedCollator, EnJaTokenBudgetTrainer
     from utils.metric import SacreBleu
+    from utils.model import EnJaModelLoader
 
-    from transformers import MBartForConditionalGeneration, MBart50TokenizerFast, \
-        GenerationConfig, Seq2SeqTrainer, Seq2SeqTrainingArguments, DataCollatorForSeq2Seq
+    from transformers import GenerationConfig, Seq2SeqTrainingArguments
     from peft import LoraConfig, get_peft_model, TaskType
     
-    model = MBartForConditionalGeneration.from_pretrained("facebook/mbart-large-50")
-
-    if SOURCE_LANG == "en":
-        tokenizer = MBart50TokenizerFast.from_pretrained("facebook/mbart-large-50", src_lang="en_XX", tgt_lang="ja_XX")
-    else:
-        tokenizer = MBart50TokenizerFast.from_pretrained("facebook/mbart-large-50", src_lang="ja_XX", tgt_lang="en_XX")
+    model = EnJaModelLoader.get_base_model(MODEL_TYPE, SOURCE_LANG)
+    tokenizer = EnJaModelLoader.get_tokenizers(MODEL_TYPE, SOURCE_LANG)["encoder_tokenizer"]
       
 
     modules_to_save = ["final_layer_norm", "self_attn_layer_norm", "layer_norm", "layernorm_embedding", "embed_positions"]
@@ -66,11 +68,18 @@ if __name__ == "__main__":
     lora_model = get_peft_model(model, config)
     print_trainable_parameters(lora_model)
 
-    data_collator = DataCollatorForSeq2Seq(tokenizer, model=lora_model)
+    # attention masks are rebuilt from the row lengths, they are not stored
+    data_collator = EnJaPackedCollator(tokenizer.pad_token_id, model=lora_model)
     
-    dataset = EnJaDatasetMaker.load_dataset(f"{SOURCE_LANG}-{TARGET_LANG}-{DATASET_NAME}")
-    train_data = dataset["train"].remove_columns(["source", "target"])
-    valid_data = dataset["valid"].remove_columns(["source", "target"])
+    # memory-mapped token buffers (packed on first use)
+    try:
+        dataset = EnJaDatasetMaker.load_packed_dataset(f"{SOURCE_LANG}-{TARGET_LANG}-{DATASET_NAME}{SUFFIX}")
+    except ValueError as e:
+        if args.trimmed:
+            parser.error(f"{e} Run 'trim_vocabulary.py -d {SOURCE_LANG}-{TARGET_LANG}-{DATASET_NAME} -l {SOURCE_LANG}' first.")
+        raise
+    train_data = dataset["train"]
+    valid_data = dataset["valid"]
     
     
     compute_metrics = SacreBleu.get_mBART_metric(tokenizer=tokenizer, target_language=TARGET_LANG)
@@ -94,7 +103,7 @@ if __name__ == "__main__":
     
     train_args = Seq2SeqTrainingArguments(
         report_to="wandb",
-        run_name=f"{SOURCE_LANG}-{TARGET_LANG}-{DATASET_NAME}",
+        run_name=f"{SOURCE_LANG}-{TARGET_LANG}-{DATASET_NAME}{SUFFIX}",
         num_train_epochs=3,
 
         logging_strategy="steps",
@@ -106,7 +115,7 @@ if __name__ == "__main__":
         predict_with_generate=True,
         generation_config=gen_config,
 
-        output_dir=f"./.ckp/{SOURCE_LANG}-{TARGET_LANG}-{DATASET_NAME}/",
+        output_dir=f"./.ckp/{SOURCE_LANG}-{TARGET_LANG}-{DATASET_NAME}{SUFFIX}/",
         save_strategy="steps",
         save_steps=2500, # 1250, 2500
         save_total_limit=100,
@@ -119,25 +128,26 @@ if __name__ == "__main__":
         learning_rate=3e-5, # 3e-5, 5e-5
         bf16=True,
         
-        group_by_length=True,
-        length_column_name="length",
-
         # torch_compile=True,
         label_smoothing_factor=0.2,
         
+        # training batches are filled up to MAX_TOKENS (see EnJaTokenBudgetTrainer)
         per_device_train_batch_size=8,
         per_device_eval_batch_size=8,
         gradient_accumulation_steps=4,
         gradient_checkpointing=True,
     )
     
-    trainer = Seq2SeqTrainer(
+    # rows of similar length batched up to MAX_TOKENS padded tokens per side (the
+    # size of a worst case batch of 8 rows of 128 tokens), shuffled at each epoch
+    trainer = EnJaTokenBudgetTrainer(
         lora_model,
         args=train_args,
         data_collator=data_collator,
         train_dataset=train_data,
         eval_dataset=valid_data,
-        compute_metrics=compute_metrics
+        compute_metrics=compute_metrics,
+        max_tokens=MAX_TOKENS
     )
 
     lora_model.train()
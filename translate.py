@@ -0,0 +1,83 @@
+import os
+import sys
+import argparse
+os.environ["HF_HOME"] = r"./.cache"
+
+
+def iter_lines(paths):
+    """
+    Yields the lines of the given files (stdin if empty), without line terminators.
+    """
+    if not paths:
+        yield from (line.rstrip("\n") for line in sys.stdin)
+        return
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as fp:
+            yield from (line.rstrip("\n") for line in fp)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='translate',
+        description='Translate sentences (arguments, files or stdin, one per line) with a trained checkpoint',
+    )
+    parser.add_argument('sentences', nargs="*", type=str, help='sentences to translate (default: read --input files or stdin)')
+    parser.add_argument('-m', '--model-type', choices=["mBART", "mBART-trimmed", "BERT-GPT2-xattn", "BERT-GPT2-xattn-LoRA"], default="mBART", type=str, help='model type (default: mBART)')
+    parser.add_argument('-l', '--source-language', choices=["en", "ja"], required=True, type=str, help='source language')
+    parser.add_argument('-r', '--run', default=None, type=str, help='training run in ./.ckp, e.g. en-ja-mixed-500k (default: base model)')
+    parser.add_argument('-s', '--step', default=None, type=int, help='checkpoint step (default: last checkpoint of the run)')
+    parser.add_argument('-i', '--input', default=[], nargs="+", type=str, help='input files, one sentence per line')
+    parser.add_argument('-o', '--output', default=None, type=str, help='output file (default: stdout)')
+    parser.add_argument('--num-beams', default=5, type=int, help='number of beams (default: 5)')
+    parser.add_argument('--max-batch-tokens', default=8192, type=int, help='token budget of a batch, beams included (default: 8192)')
+    parser.add_argument('--max-batch-size', default=64, type=int, help='maximum number of sentences per batch (default: 64)')
+    parser.add_argument('--chunk-size', default=512, type=int, help='number of lines read and sorted by length at once (default: 512)')
+    parser.add_argument('--device', default=None, type=str, help='torch device (default: cuda if available, else cpu)')
+    parser.add_argument('--memory', default=None, type=str, help='translation memory database, e.g. ./.cache/translation-memory.sqlite (default: none)')
+    parser.add_argument('--memory-size', default=100_000, type=int, help='translations kept in RAM by the memory (default: 100000)')
+    parser.add_argument('-v', '--verbose', action="store_true", help='report the latency of every batch')
+    args = parser.parse_args()
+
+    from utils.inference import EnJaTranslationMemory, EnJaTranslator
+    from utils.evaluation import EnJaCheckpointEvaluator
+
+    memory = EnJaTranslationMemory(args.memory, capacity=args.memory_size) if args.memory is not None else None
+    translator = EnJaTranslator(
+        args.model_type, args.source_language, args.run, args.step,
+        gen_config={**EnJaCheckpointEvaluator.GEN_CONFIG, "num_beams": args.num_beams},
+        max_batch_tokens=args.max_batch_tokens, max_batch_size=args.max_batch_size, device=args.device, memory=memory
+    )
+    sentences = args.sentences if args.sentences else iter_lines(args.input)
+    output = open(args.output, "w", encoding="utf-8") if args.output is not None else sys.stdout
+    try:
+        for translation in translator.translate_iter(sentences, chunk_size=args.chunk_size):
+            output.write(translation.replace("\n", " ") + "\n")
+            output.flush()
+    finally:
+        if args.output is not None:
+            output.close()
+
+    # reported on stderr, stdout only holds the translations
+    if args.verbose:
+        for i, batch in enumerate(translator.stats):
+            print(
+                f"batch {i}: {batch['rows']} sentences, {batch['tokens']} tokens, {batch['latency'] * 1000:,.0f}ms",
+                file=sys.stderr
+            )
+    if translator.stats:
+        report = translator.get_report()
+        print(
+            f"translated {report['sentences']} sentences in {report['batches']} batches ({report['time']:.1f}s, "
+            f"{report['sentences_per_sec']:,.1f} sentences/s) | batch latency mean {report['latency_mean_ms']:,.0f}ms, "
+            f"p50 {report['latency_p50_ms']:,.0f}ms, p95 {report['latency_p95_ms']:,.0f}ms, max {report['latency_max_ms']:,.0f}ms "
+            f"on {translator.device}",
+            file=sys.stderr
+        )
+    if memory is not None:
+        report = memory.get_report()
+        print(
+            f"translation memory: {report['hits'] + report['disk_hits']} of {report['lookups']} sentences found "
+            f"({report['hit_rate']:.1%}, {report['disk_hits']} on disk)",
+            file=sys.stderr
+        )
+        memory.close()
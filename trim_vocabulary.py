@@ -0,0 +1,35 @@
+import os
+import argparse
+os.environ["HF_HOME"] = r"./.cache"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog='trim_vocabulary',
+        description='Trim the mBART-50 model and tokenizer to the tokens used by the en/ja corpora and evaluation sets',
+    )
+    parser.add_argument('-i', '--input', default=None, nargs="+", type=str, help='processed files to scan (default: every .csv/.arrow file in ./data-csv)')
+    parser.add_argument('-o', '--output', default=r"./.models/mbart-large-50-en-ja", type=str, help='output directory, loaded by the "mBART-trimmed" model type (default: ./.models/mbart-large-50-en-ja)')
+    parser.add_argument('--min-count', default=1, type=int, help='occurrences for a token to be kept (default: 1)')
+    parser.add_argument('-d', '--datasets', default=None, nargs="+", type=str, help='instead of trimming the model, tokenize these mBART datasets of ./data-fin (e.g. en-ja-mixed-500k) again with the trimmed tokenizer, saved as "<dataset>-trimmed" for train_mBART.py --trimmed')
+    parser.add_argument('-l', '--source-language', choices=["en", "ja"], default=None, type=str, help='source language of --datasets')
+    parser.add_argument('--num-proc', default=4, type=int, help='number of workers tokenizing --datasets (default: 4)')
+    args = parser.parse_args()
+    if args.datasets is not None and args.source_language is None:
+        parser.error("--datasets requires --source-language")
+
+    from utils.model import EnJaVocabularyTrimmer
+
+    if args.datasets is not None:
+        for dataset_id in args.datasets:
+            trimmed_id = EnJaVocabularyTrimmer.save_trimmed_dataset(dataset_id, args.source_language, num_proc=args.num_proc)
+            print(f"saved: {trimmed_id}")
+    else:
+        report = EnJaVocabularyTrimmer.save_trimmed_model(args.input, args.output, min_count=args.min_count)
+        print(f"saved: {args.output}")
+        print(
+            f"vocabulary: {report['vocab_size']:,} -> {report['trimmed_vocab_size']:,} tokens | "
+            f"parameters: {report['parameters']:,} -> {report['trimmed_parameters']:,} | "
+            f"embeddings: {report['embedding_bytes'] / 1024**2:,.1f}MB -> {report['trimmed_embedding_bytes'] / 1024**2:,.1f}MB "
+            f"({(report['embedding_bytes'] - report['trimmed_embedding_bytes']) / 1024**2:,.1f}MB saved in float32)"
+        )
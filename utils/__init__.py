@@ -1 +1 @@
-__all__ = ["dataset", "metric"]
\ No newline at end of file
+__all__ = ["dataset", "metric", "model", "evaluation", "inference"]
\ No newline at end of file
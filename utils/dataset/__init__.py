@@ -8,6 +8,10 @@ from .opus100 import OPUS100
 from .flores import Flores
 from .wmt_vat import WMTvat
 from .dataset_combiner import EnJaDatasetSample, EnJaDatasetMaker
+from .dataset_cache import EnJaTokenizationCache
+from .dataset_dedup import EnJaDedupIndex
+from .dataset_sampler import EnJaTokenBudgetBatchSampler, EnJaTokenBudgetTrainer
+from .dataset_packed import EnJaPackedDataset, EnJaPackedCollator
 from .dataset_backtranslation import EnJaBackTranslation
 
 __all__ = [
@@ -24,6 +28,12 @@ __all__ = [
     
     "EnJaDatasetSample",
     "EnJaDatasetMaker",
+    "EnJaTokenizationCache",
+    "EnJaDedupIndex",
+    "EnJaTokenBudgetBatchSampler",
+    "EnJaTokenBudgetTrainer",
+    "EnJaPackedDataset",
+    "EnJaPackedCollator",
     
     "EnJaBackTranslation"
 ]
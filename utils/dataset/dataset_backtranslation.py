@@ -1,18 +1,24 @@
 # python libraries
 from typing import Callable
-import os, re, warnings
+from queue import Queue
+from threading import Thread
+import os, io, re, csv, json, time, warnings
 from tqdm import TqdmExperimentalWarning
 
 warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
 from tqdm.autonotebook import tqdm
 
 # external libraries
+import numpy as np
 import pandas as pd
 from datasets import Dataset
 from transformers import Seq2SeqTrainer
 
+# local libraries
+from .dataset_sampler import EnJaTokenBudgetBatchSampler
+
 class EnJaBackTranslation:    
-    def create_mBART_backtranslation(trainer : Seq2SeqTrainer, data: Dataset, src_lang: str, tokenizer: Callable, *, chunk_size=1000, gen_config : dict = {}, out_dir="./data-bt", out_name="bt.csv", resume=True):
+    def create_mBART_backtranslation(trainer : Seq2SeqTrainer, data: Dataset, src_lang: str, tokenizer: Callable, *, chunk_size=1000, gen_config : dict = {}, out_dir="./data-bt", out_name="bt.csv", resume=True, pipelined=True, queue_size=2, max_batch_tokens=None, memory=None, memory_namespace=None):
         """Creates backtranslation from an *ordered* (ideally by lenght) dataset.
         Can resume from previous iteration in case of interruptions.
 
@@ -32,11 +38,28 @@ class EnJaBackTranslation:
         gen_config : dict, optional
             generation config for the trainer, by default {}
         out_dir : str, optional
-            file output directory (both for chunks and file), by default "."
+            file output directory, by default "./data-bt". While running it also
+            holds `out_name`.part (the completed chunks) and `out_name`.manifest.json
         out_name : str, optional
             final csv file name (should end with '.csv'), by default "bt.csv"
         resume : bool, optional
             whenever to resume from previous chuck or not, by default True
+        pipelined : bool, optional
+            whenever to decode and write chunks on a background thread while the
+            next chunk is generating, by default True
+        queue_size : int, optional
+            maximum number of generated chunks waiting to be written when
+            `pipelined`, by default 2
+        max_batch_tokens : int, optional
+            if given, chunks are generated in batches of at most `max_batch_tokens`
+            source tokens times beams (see `EnJaTokenBudgetBatchSampler`) instead
+            of `per_device_eval_batch_size` rows, by default None
+        memory : EnJaTranslationMemory, optional
+            if given, sentences found in the translation memory are not generated
+            again and generated ones are added to it, by default None
+        memory_namespace : str, optional
+            namespace of the translations of `trainer.model` and `gen_config` in
+            `memory` (see `EnJaTranslationMemory.get_namespace`), required with `memory`
         """
         assert src_lang in ["en", "ja"], "Invalid language : should be 'en' or 'ja'"
         trg_lang = "en" if src_lang == "ja" else "ja"
@@ -44,66 +67,138 @@ class EnJaBackTranslation:
         assert isinstance(data, Dataset), "Invalid data passed!"
         assert tokenizer is not None and hasattr(tokenizer, "__call__"), "Object passed is not a valid tokenizer!"
         assert chunk_size > 0, "Invalid chunk size passed!"
+        assert queue_size > 0, "Invalid queue size passed!"
+        assert max_batch_tokens is None or max_batch_tokens > 0, "Invalid token budget passed!"
         assert out_name.endswith(".csv"), "Invalid file name!"
+        assert memory is None or memory_namespace is not None, "Invalid memory namespace passed!"
         if os.path.exists(f"{out_dir}/{out_name}"):
             print(f"dataset [{out_dir}/{out_name}] already exists!")
             return
         
-        # create directories if missing
-        chunk_dir = f"{out_dir}/{out_name[:-4]}"
-        if not os.path.exists(chunk_dir):
-            os.makedirs(chunk_dir)
-        # resume from last chunk, we restart from the last
-        # to avoid bad writes in the last interrupted interation
-        last_chunk = 0
-        if resume:
-            # check existing chunks to obtain last one
+        # append-only output: a single .part file and a manifest with the byte 
+        # offset at the end of each completed chunk, updated once the chunk is on disk
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        part_path = f"{out_dir}/{out_name}.part"
+        manifest_path = f"{out_dir}/{out_name}.manifest.json"
+        manifest = {"chunk_size": chunk_size, "offsets": []}
+        if resume and os.path.exists(manifest_path) and os.path.exists(part_path):
+            with open(manifest_path, "r") as fp:
+                manifest = json.load(fp)
+            assert manifest["chunk_size"] == chunk_size, f"Invalid chunk size: previous run used {manifest['chunk_size']}"
+        out_fh = open(part_path, "r+b" if len(manifest["offsets"]) > 0 else "wb")
+        # anything after the last completed chunk is an interrupted write
+        out_fh.truncate(manifest["offsets"][-1] if len(manifest["offsets"]) > 0 else 0)
+        out_fh.seek(0, os.SEEK_END)
+        if len(manifest["offsets"]) == 0:
+            out_fh.write(f"{src_lang}_sentence,{trg_lang}_sentence\n".encode("utf-8"))
+        
+        def append_chunk(rows):
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator="\n").writerows(rows)
+            out_fh.write(buffer.getvalue().encode("utf-8"))
+            out_fh.flush()
+            os.fsync(out_fh.fileno())
+            manifest["offsets"].append(out_fh.tell())
+            EnJaBackTranslation._write_manifest(manifest_path, manifest)
+        
+        # chunk.{i}.csv files of previous versions, the last one is generated again
+        legacy_dir = f"{out_dir}/{out_name[:-4]}"
+        if resume and len(manifest["offsets"]) == 0 and os.path.isdir(legacy_dir):
             pattern = re.compile(r"chunk.(\d+).csv")
-            chunk_names = os.listdir(chunk_dir)
-            chunk_nums = []
-            for cname in chunk_names:
-                chunk_nums.append(int(re.match(pattern, cname).groups()[0]))
-            last_chunk = max(chunk_nums) if len(chunk_nums) > 0 else 0
-
-            # check existing chunks to obtain last to ensure all previous ones exist
-            for i in range(last_chunk):
-                assert os.path.exists(f"{chunk_dir}/chunk.{i}.csv"), f"chunk #{i} is missing"
+            nlegacy = len([name for name in os.listdir(legacy_dir) if pattern.match(name)])
+            for i in range(nlegacy - 1):
+                append_chunk(pd.read_csv(f"{legacy_dir}/chunk.{i}.csv", keep_default_na=False).values.tolist())
+        
+        last_chunk = len(manifest["offsets"])
+        if resume:
             print(f"Resuming from chunck #{last_chunk}")
-            del chunk_names, chunk_nums
         # create backtranslation in chunks
         offset, total = last_chunk*chunk_size, len(data)
-        nchunks, rem = divmod(total, chunk_size)
-        nchunks += (1 if rem > 0 else 0)
         pbar = tqdm(
-            desc="Generating Dataset", unit="chunks", 
-            unit_scale=True, unit_divisor=1000, 
-            total=int(nchunks), initial=last_chunk
+            desc="Generating Dataset", unit=" sentences", 
+            unit_scale=True, total=total, initial=min(offset, total)
         )
-        while offset < total:
-            # backtranslation target (== source sentence)
-            if offset+chunk_size > total:
-                gen_chunk = data.select(range(offset,total))
-            else:
-                gen_chunk = data.select(range(offset,offset+chunk_size))
-            
+        ntokens, start = 0, time.perf_counter()
+        
+        def save_chunk(sources, predictions, known):
+            nonlocal ntokens
             # backtranslation source (== model generation)
-            gen_out = trainer.predict(gen_chunk, **gen_config)
-            gen_out.predictions[gen_out.predictions == -100] = tokenizer.pad_token_id
-            gen_chunk_target = tokenizer.batch_decode(gen_out.predictions, skip_special_tokens=True)
-            # create new chuck and append to existing csv
-            new_chuck = pd.DataFrame({
-                f"{src_lang}_sentence" : gen_chunk["source"],
-                f"{trg_lang}_sentence" : gen_chunk_target
-            })
-            new_chuck.to_csv(f"{chunk_dir}/chunk.{last_chunk}.csv", index=False)
-            offset += chunk_size
-            last_chunk += 1
-            pbar.update(1)
-        pbar.close()
-        # merge chunks into a single csv file
-        for i in range(nchunks):
-            df = pd.read_csv(f"{chunk_dir}/chunk.{i}.csv")
-            if i == 0:
-                df.to_csv(f"{out_dir}/{out_name}", header=True, index=False)
-            df.to_csv(f"{out_dir}/{out_name}", mode="a", header=False, index=False)
-        return
\ No newline at end of file
+            generated = []
+            if predictions is not None:
+                predictions[predictions == -100] = tokenizer.pad_token_id
+                generated = tokenizer.batch_decode(predictions, skip_special_tokens=True)
+                ntokens += np.count_nonzero(predictions != tokenizer.pad_token_id)
+            targets = generated
+            if known is not None:
+                # generated translations fill the sentences missing from the memory
+                missing = [i for i, target in enumerate(known) if target is None]
+                memory.put_many(memory_namespace, [sources[i] for i in missing], generated)
+                targets = list(known)
+                for i, target in zip(missing, generated):
+                    targets[i] = target
+            # chunks are appended in order
+            append_chunk(zip(sources, targets))
+            pbar.set_postfix_str(f"{ntokens / (time.perf_counter() - start):,.0f} tokens/s", refresh=False)
+            pbar.update(len(sources))
+        
+        # decoding and writing overlap with the generation of the next chunk,
+        # the bounded queue stops generation from running ahead of the writer
+        chunks, errors = Queue(maxsize=queue_size), []
+        def consume_chunks():
+            while (chunk := chunks.get()) is not None:
+                if len(errors) > 0:
+                    continue
+                try:
+                    save_chunk(*chunk)
+                except BaseException as e:
+                    errors.append(e)
+        writer = Thread(target=consume_chunks, daemon=True)
+        if pipelined:
+            writer.start()
+        try:
+            while offset < total and len(errors) == 0:
+                # backtranslation target (== source sentence)
+                gen_chunk = data.select(range(offset, min(offset + chunk_size, total)))
+                sources, known = gen_chunk["source"], None
+                if memory is not None:
+                    # only the sentences missing from the memory are generated
+                    known = memory.get_many(memory_namespace, sources)
+                    gen_chunk = gen_chunk.select([i for i, target in enumerate(known) if target is None])
+                predictions = None
+                if len(gen_chunk) > 0 and max_batch_tokens is None:
+                    predictions = trainer.predict(gen_chunk, **gen_config).predictions
+                elif len(gen_chunk) > 0: # predictions are in chunk order, aligned with "source"
+                    predictions = EnJaTokenBudgetBatchSampler.predict(
+                        trainer, gen_chunk, max_tokens=max_batch_tokens, **gen_config
+                    ).predictions
+                chunk = (sources, predictions, known)
+                if pipelined:
+                    chunks.put(chunk)
+                else:
+                    save_chunk(*chunk)
+                offset += chunk_size
+        finally:
+            # pending chunks are still written on interruptions
+            if pipelined:
+                chunks.put(None)
+                writer.join()
+            out_fh.close()
+            pbar.close()
+        if len(errors) > 0:
+            raise errors[0]
+        # the complete file needs no merge
+        os.replace(part_path, f"{out_dir}/{out_name}")
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return
+    
+    @staticmethod
+    def _write_manifest(path, manifest):
+        # write then rename, the manifest never points past a missing chunk
+        with open(f"{path}.tmp", "w") as fp:
+            json.dump(manifest, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(f"{path}.tmp", path)
+        return
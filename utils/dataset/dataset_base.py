@@ -1,9 +1,17 @@
 # python libraries
 from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, List, Optional, Tuple
+from itertools import islice
+import os, csv, time, warnings
 
 # external libraries
-from datasets import Dataset
+from datasets import Dataset, load_dataset, enable_progress_bar, disable_progress_bar
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from tqdm import TqdmExperimentalWarning
 
+warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
+from tqdm.autonotebook import tqdm
 
 
 # listed datasets are all very high quality
@@ -11,19 +19,24 @@ class EnJaDataset(ABC):
     """Template Class for datasets"""
 
     CSV_HEADER_STR = "en_sentence,ja_sentence\n"
+    ARROW_SCHEMA = pa.schema([("en_sentence", pa.string()), ("ja_sentence", pa.string())])
     SKIPPED_MSG_FORMAT = "skipped: {file} file already exists!"
-    MISSING_FILE_FORMAT = "warning: {file} not found, creating csv first ..."
+    MISSING_FILE_FORMAT = "warning: {file} not found, creating it first ..."
     LOAD_FROM_CACHE_FORMAT = 'skipped: loaded dataset with id="{id}" from existing cache.'
     LOAD_INVALID_ID_FORMAT = 'dataset with id="{id}" was not found.'
+    WRITTEN_MSG_FORMAT = "written: {nrows} rows to {file} in {time:.1f}s ({rate:,.0f} rows/s)"
     NUM_PROC = 4
+    WRITE_BUFFER_SIZE = 10_000
+    CSV_BLOCK_SIZE = 4 * 1024**2
 
     DATASET_RAW_DIR = r"./data-raw"
+    # the directory name predates arrow files, csv files of earlier versions stay readable there
     DATASET_PROCESSED_DIR = r"./data-csv"
     DATASET_FINAL_DIR = r"./data-fin"
 
     @abstractmethod
     def create_csv():
-        """Creates a single csv file of the dataset"""
+        """Creates the processed file of the dataset (arrow, optionally exported to csv)"""
         pass
     
     @abstractmethod
@@ -36,3 +49,163 @@ class EnJaDataset(ABC):
         """Returns a DataFrame of the dataset"""
         pass
 
+    @staticmethod
+    def get_processed_path(name : str) -> str:
+        """Returns the path of the processed file `name` (an .arrow file) in
+        `DATASET_PROCESSED_DIR`. If it is missing but a csv file with the same
+        name was written by an earlier version, the csv file is returned so it
+        is read instead of built again."""
+        path = f"{EnJaDataset.DATASET_PROCESSED_DIR}/{name}"
+        legacy_path = f"{os.path.splitext(path)[0]}.csv"
+        if not os.path.exists(path) and os.path.exists(legacy_path):
+            return legacy_path
+        return path
+
+    @staticmethod
+    def load_processed(path : str) -> Dataset:
+        """Opens a processed file with ["en_sentence", "ja_sentence"] columns.
+
+        Arrow files are memory-mapped as they are, csv files go through the
+        huggingface csv builder (and its cache).
+
+        Parameters
+        ----------
+        path : str
+            path to an .arrow or .csv file
+
+        Returns
+        -------
+        Dataset
+            the processed dataset
+        """
+        if path.endswith(".arrow"):
+            return Dataset.from_file(path)
+        disable_progress_bar()
+        data = load_dataset("csv", data_files=path, split="train")
+        enable_progress_bar()
+        return data
+
+    @staticmethod
+    def iter_processed(path : str, batches : Optional[List[int]] = None) -> Iterator[Tuple[int, pa.RecordBatch]]:
+        """Reads a processed file one row group at a time, without loading it.
+
+        Arrow files are memory-mapped and yield their record batches (the bulks
+        written by `_write_pairs`), csv files are parsed in blocks of about
+        `CSV_BLOCK_SIZE` bytes.
+
+        Parameters
+        ----------
+        path : str
+            path to an .arrow or .csv file
+        batches : List[int], optional
+            record batches to read, in this order (arrow files only), by default all
+
+        Returns
+        -------
+        Iterator[Tuple[int, pa.RecordBatch]]
+            the index of the first row and the ["en_sentence", "ja_sentence"] rows of each group
+        """
+        if path.endswith(".arrow"):
+            with pa.memory_map(path, "r") as source:
+                # zero-copy views of the mapped file, nothing is read until accessed
+                record_batches = list(pa.ipc.open_stream(source))
+                offsets = [0]
+                for record_batch in record_batches:
+                    offsets.append(offsets[-1] + record_batch.num_rows)
+                for i in (range(len(record_batches)) if batches is None else batches):
+                    yield offsets[i], record_batches[i]
+            return
+        assert batches is None, "Invalid batches: csv files are read in order."
+        reader = pa_csv.open_csv(
+            path,
+            read_options=pa_csv.ReadOptions(block_size=EnJaDataset.CSV_BLOCK_SIZE),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(column_types=EnJaDataset.ARROW_SCHEMA),
+        )
+        offset = 0
+        for record_batch in reader:
+            yield offset, record_batch
+            offset += record_batch.num_rows
+
+    @staticmethod
+    def export_csv(path : str, output_path : Optional[str] = None) -> str:
+        """Exports a processed arrow file to csv, by default next to it.
+
+        Parameters
+        ----------
+        path : str
+            path to the processed .arrow file
+        output_path : str, optional
+            path of the csv file to (over)write, default is `path` with a .csv extension
+
+        Returns
+        -------
+        str
+            the path of the csv file
+        """
+        output_path = output_path or f"{os.path.splitext(path)[0]}.csv"
+        data = EnJaDataset.load_processed(path)
+        pairs = (
+            pair
+            for batch in data.iter(batch_size=EnJaDataset.WRITE_BUFFER_SIZE)
+            for pair in zip(batch["en_sentence"], batch["ja_sentence"])
+        )
+        EnJaDataset._write_pairs(output_path, pairs)
+        return output_path
+
+    @staticmethod
+    def _write_pairs(output_path : str, pairs : Iterable[Tuple[str, str]]) -> int:
+        """Writes (en, ja) sentence pairs to an arrow or csv file in constant memory.
+
+        Pairs are consumed lazily and written in bulk every `WRITE_BUFFER_SIZE`
+        rows. The format follows the file extension: ".arrow" files are written
+        as an arrow IPC stream (one record batch per bulk, the layout
+        `Dataset.from_file` memory-maps), anything else as csv with quoting
+        handled by the csv module.
+
+        Parameters
+        ----------
+        output_path : str
+            path of the .arrow or .csv file to (over)write
+        pairs : Iterable[Tuple[str, str]]
+            (en_sentence, ja_sentence) pairs
+
+        Returns
+        -------
+        int
+            the number of rows written
+        """
+        pairs, nrows, start = iter(pairs), 0, time.perf_counter()
+        file = os.path.basename(output_path)
+        progress_bar = tqdm(desc=f"Writing {file}", unit=" rows", unit_scale=True)
+        if output_path.endswith(".arrow"):
+            with pa.OSFile(output_path, "wb") as sink, pa.ipc.new_stream(sink, EnJaDataset.ARROW_SCHEMA) as writer:
+                while rows := list(islice(pairs, EnJaDataset.WRITE_BUFFER_SIZE)):
+                    en, ja = zip(*rows)
+                    writer.write_batch(pa.record_batch(
+                        [pa.array(en, pa.string()), pa.array(ja, pa.string())],
+                        schema=EnJaDataset.ARROW_SCHEMA
+                    ))
+                    nrows += len(rows)
+                    progress_bar.update(len(rows))
+        else:
+            with open(output_path, "w", encoding="utf-8", newline="", buffering=1024**2) as csv_file:
+                csv_file.write(EnJaDataset.CSV_HEADER_STR)
+                writer = csv.writer(csv_file, lineterminator="\n")
+                while rows := list(islice(pairs, EnJaDataset.WRITE_BUFFER_SIZE)):
+                    writer.writerows(rows)
+                    nrows += len(rows)
+                    progress_bar.update(len(rows))
+        progress_bar.close()
+        elapsed = time.perf_counter() - start
+        print(EnJaDataset.WRITTEN_MSG_FORMAT.format(
+            nrows=nrows, file=file, time=elapsed, rate=nrows / max(elapsed, 1e-9)
+        ))
+        return nrows
+
+    @staticmethod
+    def _iter_translation_pairs(dataset : Dataset) -> Iterator[Tuple[str, str]]:
+        """Yields (en, ja) pairs of a huggingface dataset with a "translation" column."""
+        for batch in dataset.iter(batch_size=EnJaDataset.WRITE_BUFFER_SIZE):
+            for pair in batch["translation"]:
+                yield pair["en"], pair["ja"]
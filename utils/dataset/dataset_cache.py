@@ -0,0 +1,177 @@
+# python libraries
+from typing import Callable, List, Optional
+import os, json, time, shutil, hashlib
+
+# external libraries
+from datasets import load_from_disk, Dataset
+from datasets.fingerprint import Hasher
+
+# local libraries
+from .dataset_base import EnJaDataset
+
+
+class EnJaTokenizationCache:
+    """Persistent cache of tokenized source datasets.
+
+    Each entry is a whole source file (arrow or csv) tokenized for a given model type and
+    language direction, stored as arrow tables under `DATASET_FINAL_DIR`.
+    Entries are keyed by the content hash of the source file, the tokenizers'
+    fingerprint, the model type and the source language, and are evicted in
+    least recently used order once the cache grows over `MAX_SIZE` bytes.
+    """
+
+    CACHE_DIR_NAME = r".tokenization-cache"
+    MANIFEST_NAME = r"manifest.json"
+    MAX_SIZE = 50 * 1024**3
+    HASH_BLOCK_SIZE = 1024**2
+
+    @staticmethod
+    def get_key(dataset : str, *, model_type : str, source_language : str, tokenizers : List[Callable]) -> str:
+        """Returns the cache key of `dataset` tokenized with the given configuration.
+
+        Parameters
+        ----------
+        dataset : str
+            path to the source file
+        model_type : str
+            the model type used (either "BERT-GPT2" or "mBART")
+        source_language : str
+            the source language (either "en" or "ja")
+        tokenizers : List[Callable]
+            the huggingface tokenizers used, in order
+
+        Returns
+        -------
+        str
+            a hex digest identifying the tokenized dataset
+        """
+        key = hashlib.blake2b(digest_size=16)
+        key.update(EnJaTokenizationCache.get_file_hash(dataset).encode())
+        key.update(model_type.encode())
+        key.update(source_language.encode())
+        for tokenizer in tokenizers:
+            key.update(EnJaTokenizationCache.get_tokenizer_fingerprint(tokenizer).encode())
+        return key.hexdigest()
+
+    @staticmethod
+    def get_file_hash(path : str) -> str:
+        """Returns the content hash of a file, reusing the last one computed if the
+        file size and modification time did not change."""
+        stat = os.stat(path)
+        manifest = EnJaTokenizationCache._read_manifest()
+        known = manifest["files"].get(os.path.abspath(path))
+        if known is not None and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["hash"]
+
+        file_hash = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as fh:
+            while block := fh.read(EnJaTokenizationCache.HASH_BLOCK_SIZE):
+                file_hash.update(block)
+        file_hash = file_hash.hexdigest()
+
+        manifest["files"][os.path.abspath(path)] = {
+            "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": file_hash
+        }
+        EnJaTokenizationCache._write_manifest(manifest)
+        return file_hash
+
+    @staticmethod
+    def get_tokenizer_fingerprint(tokenizer : Callable) -> str:
+        """Returns a fingerprint of the tokenizer vocabulary and configuration."""
+        if not hasattr(tokenizer, "backend_tokenizer"):
+            # slow tokenizers: hash the whole object
+            return Hasher.hash(tokenizer)
+        fingerprint = hashlib.blake2b(digest_size=16)
+        # vocabulary, normalizer, pre-tokenizer and post-processor
+        fingerprint.update(tokenizer.backend_tokenizer.to_str().encode())
+        fingerprint.update(json.dumps({
+            "class": type(tokenizer).__name__,
+            "special_tokens": tokenizer.special_tokens_map_extended,
+            "src_lang": getattr(tokenizer, "src_lang", None),
+            "tgt_lang": getattr(tokenizer, "tgt_lang", None),
+        }, sort_keys=True, default=str).encode())
+        return fingerprint.hexdigest()
+
+    @staticmethod
+    def load(key : str) -> Optional[Dataset]:
+        """Returns the cached dataset with the given key, or None if missing."""
+        manifest = EnJaTokenizationCache._read_manifest()
+        entry_dir = f"{EnJaTokenizationCache._get_cache_dir()}/{key}"
+        if key not in manifest["entries"] or not os.path.exists(entry_dir):
+            return None
+        manifest["entries"][key]["last_used"] = time.time()
+        EnJaTokenizationCache._write_manifest(manifest)
+        return load_from_disk(entry_dir)
+
+    @staticmethod
+    def store(key : str, data : Dataset, *, dataset : str, keep : Optional[List[str]] = None) -> Dataset:
+        """Saves `data` in the cache under the given key, evicting least recently
+        used entries (except the ones in `keep`, still in use) if needed, and
+        returns the stored (memory-mapped) dataset."""
+        entry_dir = f"{EnJaTokenizationCache._get_cache_dir()}/{key}"
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir)
+        data.save_to_disk(entry_dir)
+
+        manifest = EnJaTokenizationCache._read_manifest()
+        manifest["entries"][key] = {
+            "dataset": os.path.abspath(dataset),
+            "size": EnJaTokenizationCache._get_dir_size(entry_dir),
+            "last_used": time.time(),
+        }
+        EnJaTokenizationCache._evict(manifest, keep=[key, *(keep or [])])
+        EnJaTokenizationCache._write_manifest(manifest)
+        return load_from_disk(entry_dir)
+
+    @staticmethod
+    def clear():
+        """Removes every cached entry."""
+        cache_dir = EnJaTokenizationCache._get_cache_dir()
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        return
+
+    @staticmethod
+    def _evict(manifest : dict, *, keep : List[str]):
+        entries = manifest["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= EnJaTokenizationCache.MAX_SIZE:
+                break
+            if key in keep:
+                continue
+            print(f"evicting: tokenized {entries[key]['dataset']} ({key})")
+            shutil.rmtree(f"{EnJaTokenizationCache._get_cache_dir()}/{key}", ignore_errors=True)
+            total -= entries.pop(key)["size"]
+        return
+
+    @staticmethod
+    def _get_cache_dir() -> str:
+        return f"{EnJaDataset.DATASET_FINAL_DIR}/{EnJaTokenizationCache.CACHE_DIR_NAME}"
+
+    @staticmethod
+    def _get_dir_size(path : str) -> int:
+        return sum(
+            os.path.getsize(os.path.join(root, f))
+            for root, _, files in os.walk(path) for f in files
+        )
+
+    @staticmethod
+    def _read_manifest() -> dict:
+        path = f"{EnJaTokenizationCache._get_cache_dir()}/{EnJaTokenizationCache.MANIFEST_NAME}"
+        if not os.path.exists(path):
+            return {"entries": {}, "files": {}}
+        with open(path, "r") as fp:
+            return json.load(fp)
+
+    @staticmethod
+    def _write_manifest(manifest : dict):
+        cache_dir = EnJaTokenizationCache._get_cache_dir()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        # write then rename, an interrupted write never corrupts the manifest
+        path = f"{cache_dir}/{EnJaTokenizationCache.MANIFEST_NAME}"
+        with open(f"{path}.tmp", "w") as fp:
+            json.dump(manifest, fp)
+        os.replace(f"{path}.tmp", path)
+        return
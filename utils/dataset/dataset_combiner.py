@@ -1,13 +1,21 @@
 # python libraries
-from typing import List, Tuple, Callable, NewType, Union, Optional
-from dataclasses import dataclass
-import os, random
+from typing import Dict, List, Tuple, Callable, NewType, Union, Optional
+from dataclasses import dataclass, astuple
+import os, math
 
 # external libraries
-from datasets import load_dataset, concatenate_datasets, load_from_disk, Dataset, DatasetDict
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import concatenate_datasets, load_from_disk, Dataset, DatasetDict, IterableDataset, Features, Sequence, Value
+from datasets.fingerprint import Hasher
+from datasets.iterable_dataset import ExamplesIterable
 
 # local libraries
 from .dataset_base import EnJaDataset
+from .dataset_cache import EnJaTokenizationCache
+from .dataset_dedup import EnJaDedupIndex, EnJaMinHashLSH
+from .dataset_packed import EnJaPackedDataset
 
 DatasetID = NewType('DatasetID', str)
 
@@ -18,7 +26,7 @@ class EnJaDatasetSample:
     Parameters
     ----------
     dataset : str
-        a path to a csv file with ["en_sentence", "ja_sentence"] as columns
+        a path to a processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] as columns
     nsample : int
         #samples to take from this dataset
     ntokens : Tuple[int, int]
@@ -33,6 +41,14 @@ class EnJaDatasetSample:
 class EnJaDatasetMaker():
     """Prepares a dataset for training from various sources."""
     
+    # conservative (min, max) #tokens per character of a source sentence, used to
+    # discard rows that cannot fit `ntokens` before tokenizing them
+    TOKENS_PER_CHAR = {"en": (1/32, 2.0), "ja": (1/16, 3.0)}
+    # room for special tokens (bos, eos, language codes) added by the tokenizers
+    TOKENS_SPECIAL_SLACK = 4
+    # directory suffix of the packed version of a dataset
+    PACKED_SUFFIX = r".packed"
+    
     @staticmethod
     def load_dataset(dataset_id : DatasetID) -> Union[Dataset, DatasetDict]:
         """Returns the dataset with given id if it exists."""
@@ -44,6 +60,21 @@ class EnJaDatasetMaker():
         else:
             raise ValueError(EnJaDataset.LOAD_INVALID_ID_FORMAT.format(id=dataset_id))
     
+    @staticmethod
+    def load_packed_dataset(dataset_id : DatasetID) -> Union[EnJaPackedDataset, Dict[str, EnJaPackedDataset]]:
+        """Returns the dataset with given id in packed format (see `EnJaPackedDataset`),
+        packing it first if only the huggingface version exists."""
+        save_dir = (
+            f"{EnJaDataset.DATASET_FINAL_DIR}/{dataset_id}"
+        )
+        if os.path.exists(f"{save_dir}{EnJaDatasetMaker.PACKED_SUFFIX}"):
+            return EnJaPackedDataset.load(f"{save_dir}{EnJaDatasetMaker.PACKED_SUFFIX}")
+        elif os.path.exists(save_dir):
+            print(f"packing: {save_dir} to {save_dir}{EnJaDatasetMaker.PACKED_SUFFIX}")
+            return EnJaPackedDataset.save(load_from_disk(save_dir), f"{save_dir}{EnJaDatasetMaker.PACKED_SUFFIX}")
+        else:
+            raise ValueError(EnJaDataset.LOAD_INVALID_ID_FORMAT.format(id=dataset_id))
+    
     @staticmethod
     def prepare_dataset(
         dataset_id  : DatasetID,
@@ -56,8 +87,16 @@ class EnJaDatasetMaker():
         decoder_tokenizer : Callable = None,
         num_proc : int = 4,
         seed : int = 42,
-        splits : Optional[Union[Tuple[float, float], Tuple[float, float, float]]] = None
-    ) -> Union[Dataset, DatasetDict]:
+        splits : Optional[Union[Tuple[float, float], Tuple[float, float, float]]] = None,
+        batched : bool = True,
+        batch_size : int = 1000,
+        margin : float = 0.1,
+        tokenization_cache : bool = False,
+        deduplicate : bool = True,
+        near_dedup_threshold : Optional[float] = None,
+        eval_datasets : Optional[List[str]] = None,
+        packed : bool = False
+    ) -> Union[Dataset, DatasetDict, EnJaPackedDataset, Dict[str, EnJaPackedDataset]]:
         """Create a new dataset with given specifics. Or if it exists
         loads it from cache.
 
@@ -73,7 +112,9 @@ class EnJaDatasetMaker():
         model_type : str
             the model type used (either "BERT-GPT2" or "mBART"), required
         tokenizer : Callable
-            a mBART huggingface tokenizer, required if model_type == "mBART"
+            a mBART huggingface tokenizer, required if model_type == "mBART". The
+            "mBART-trimmed" tokenizer of `EnJaModelLoader` gives the ids of the
+            trimmed vocabulary (see `EnJaVocabularyTrimmer`)
         encoder_tokenizer : Callable
             a BERT huggingface tokenizer, required if model_type == "BERT-GPT2"
         decoder_tokenizer : Callable
@@ -81,47 +122,92 @@ class EnJaDatasetMaker():
         num_proc : int
             number of workers for multithreading, by default 4
         seed : int
-            seed used for sampling, by default 42
+            seed used for sampling, splitting and shuffling, by default 42. The
+            output only depends on the seed and the arguments, not on `num_proc`,
+            `margin` or the state of the caches
         splits : None | Tuple[float, float] | Tuple[float, float, float]
             train/valid or train/valid/test split ratios, by default None
             The values are rescaled so that sum(splits) = 1.0
+        batched : bool
+            whenever to tokenize whole batches with the (fast) tokenizers instead
+            of one sentence at a time, by default True
+        batch_size : int
+            number of rows per batch when `batched` is True, by default 1000
+        margin : float
+            fraction of extra candidates tokenized on top of `nsample` to account
+            for rows rejected by `ntokens`, by default 0.1
+        tokenization_cache : bool
+            whenever to tokenize each source file once and reuse it through 
+            `EnJaTokenizationCache`, by default False: only the sampled rows (plus
+            `margin`) are tokenized. Worth it when the same sources are sampled
+            again with other token ranges or seeds, the first build tokenizes
+            whole files
+        deduplicate : bool
+            whenever to drop exact duplicate pairs (see `EnJaDedupIndex`) repeated 
+            inside a source, already sampled from a previous source or present in 
+            `eval_datasets`, by default True
+        near_dedup_threshold : float, optional
+            if given, MinHash similarity threshold in (0, 1] above which pairs of
+            the combined sources are near duplicates (see `EnJaMinHashLSH`), only
+            the first one (in `dataset_splits` order) can be sampled. Pairs near 
+            `eval_datasets` are dropped as well. By default None (disabled)
+        eval_datasets : List[str], optional
+            processed files that must not leak into the dataset, by default the 
+            `Flores` and `WMTvat` files already created
+        packed : bool
+            whenever to save the dataset in packed format only (flat memory-mapped
+            token buffers, see `EnJaPackedDataset`), by default False. Load it
+            with `EnJaDatasetMaker.load_packed_dataset`
             
         Returns
         -------
         Dataset
-            a hugging face dataset
+            a hugging face dataset (a packed dataset if `packed`), memory-mapped
+            from the saved files
         """
         # argument checking
         assert num_proc > 0, "Invalid number of workers."
-        assert source_language in ["en", "ja"], "Invalid language."
-        assert model_type in ["BERT-GPT2", "mBART"], "Invalid model type."
-        if model_type == "BERT-GPT2":
-            assert encoder_tokenizer is not None and hasattr(encoder_tokenizer, "__call__"), "Object passed is not a valid tokenizer!"
-            assert decoder_tokenizer is not None and hasattr(decoder_tokenizer, "__call__"), "Object passed is not a valid tokenizer!"
-            assert tokenizer is None, "Invalid arguments passed to function call!"
-        else:
-            assert tokenizer is not None and hasattr(tokenizer, "__call__"), "Object passed is not a valid tokenizer!"
-            assert encoder_tokenizer is None and decoder_tokenizer is None, "Invalid arguments passed to function call!"
+        assert batch_size > 0, "Invalid batch size."
+        assert margin >= 0, "Invalid margin."
+        assert near_dedup_threshold is None or 0 < near_dedup_threshold <= 1, "Invalid near duplicate threshold."
+        EnJaDatasetMaker._check_arguments(
+            dataset_splits, source_language=source_language, model_type=model_type, tokenizer=tokenizer,
+            encoder_tokenizer=encoder_tokenizer, decoder_tokenizer=decoder_tokenizer
+        )
         if splits is not None:
             assert (len(splits) == 2 or len(splits) == 3), "Invalid splits."
             splits = tuple(split/sum(splits) for split in splits)
-        assert all(isinstance(dss, EnJaDatasetSample) for dss in dataset_splits), "Invalid split object!"
-        for i, dss in enumerate(dataset_splits):
-            assert os.path.exists(dss.dataset), f"Invalid dataset: dataset_splits[{i}] = {dss.dataset.__name__} not found"
-            assert isinstance(dss.nsample, int) and dss.nsample > 0, f"Invalid number of samples: dataset_splits[{i}] = {dss.nsample}"
-            assert isinstance(dss.ntokens, tuple) and len(dss.ntokens) == 2 and 0 <= dss.ntokens[0] <= dss.ntokens[1], f"Invalid number of samples: dataset_splits[{i}] = {dss.ntokens}"
         
         save_dir = (
             f"{EnJaDataset.DATASET_FINAL_DIR}/{dataset_id}"
         )
+        if packed and os.path.exists(f"{save_dir}{EnJaDatasetMaker.PACKED_SUFFIX}"):
+            print(EnJaDataset.LOAD_FROM_CACHE_FORMAT.format(id=dataset_id))
+            return EnJaPackedDataset.load(f"{save_dir}{EnJaDatasetMaker.PACKED_SUFFIX}")
         if os.path.exists(save_dir):
             print(EnJaDataset.LOAD_FROM_CACHE_FORMAT.format(id=dataset_id))
-            return load_from_disk(save_dir)
+            return EnJaDatasetMaker.load_packed_dataset(dataset_id) if packed else load_from_disk(save_dir)
 
-        random.seed(seed)
-        data_list = []
-        for ds_split in dataset_splits:
-            data = load_dataset("csv", data_files=ds_split.dataset, split="train")
+        # independent random streams, one per source and one for the final shuffle
+        seeds = np.random.SeedSequence(seed).spawn(len(dataset_splits) + 1)
+        data_list, cache_keys, mask = [], [], None
+        if (deduplicate or near_dedup_threshold is not None) and eval_datasets is None:
+            eval_datasets = EnJaDedupIndex.get_eval_paths()
+        if deduplicate:
+            in_mix = EnJaDedupIndex()
+            in_eval = EnJaDedupIndex.from_datasets(eval_datasets)
+        if near_dedup_threshold is not None:
+            near_dedup_masks = EnJaDatasetMaker._get_near_dedup_masks(
+                [dss.dataset for dss in dataset_splits], eval_datasets,
+                threshold=near_dedup_threshold, num_proc=num_proc
+            )
+        for ds_split, sample_seed in zip(dataset_splits, seeds):
+            data = EnJaDataset.load_processed(ds_split.dataset)
+            if deduplicate:
+                mask = EnJaDatasetMaker._get_dedup_mask(ds_split.dataset, in_mix=in_mix, in_eval=in_eval)
+            if near_dedup_threshold is not None:
+                near_mask = near_dedup_masks[ds_split.dataset]
+                mask = near_mask if mask is None else mask & near_mask
             
             if source_language == "en":
                 data = data.rename_columns({
@@ -134,46 +220,35 @@ class EnJaDatasetMaker():
                     "en_sentence": "target"
                 })
             
-            if model_type == "BERT-GPT2":
-                data = data.map(
-                    EnJaDatasetMaker._get_map_compute_BERT_GPT2_tokenization(
-                        encoder_tokenizer=encoder_tokenizer, 
-                        decoder_tokenizer=decoder_tokenizer
-                    ), 
-                    num_proc=num_proc,
-                )
-            else: # model_type == "mBART"
-                data = data.map(
-                    EnJaDatasetMaker._get_map_compute_mBART_tokenization(
-                        tokenizer=tokenizer
-                    ), 
-                    num_proc=num_proc,
-                )
-  
-            data = data.filter(
-                EnJaDatasetMaker._get_filter_is_inside_boundaries(ds_split.ntokens),
-                num_proc=num_proc,
+            tokenize = lambda candidates, ntokens: EnJaDatasetMaker._tokenize(
+                candidates, ntokens, model_type=model_type, tokenizer=tokenizer, 
+                encoder_tokenizer=encoder_tokenizer, decoder_tokenizer=decoder_tokenizer, 
+                num_proc=num_proc, batched=batched, batch_size=batch_size
             )
-            
-            data = data.shuffle(seed=seed)
-            if ds_split.nsample < len(data):
-                print(f"sampling: {ds_split.nsample} out of {len(data)}")
-                data = data.select(range(ds_split.nsample))
+            if tokenization_cache:
+                cache_key = EnJaTokenizationCache.get_key(
+                    ds_split.dataset, model_type=model_type, source_language=source_language,
+                    tokenizers=[tokenizer] if model_type == "mBART" else [encoder_tokenizer, decoder_tokenizer]
+                )
+                tokenized = EnJaTokenizationCache.load(cache_key)
+                if tokenized is None:
+                    print(f"caching: tokenizing all of {ds_split.dataset}")
+                    tokenized = EnJaTokenizationCache.store(
+                        cache_key, tokenize(data, None), dataset=ds_split.dataset, keep=cache_keys
+                    )
+                cache_keys.append(cache_key)
+                data = EnJaDatasetMaker._sample_cached(tokenized, ds_split, seed=sample_seed, mask=mask)
             else:
-                print(f"sampling: using all data ({len(data)})")
+                data = EnJaDatasetMaker._sample_tokenized(
+                    data, ds_split, tokenize=tokenize, source_language=source_language, 
+                    seed=sample_seed, margin=margin, mask=mask
+                )
+            if deduplicate:
+                en, ja = ("source", "target") if source_language == "en" else ("target", "source")
+                in_mix.add(EnJaDedupIndex.hash_pairs(data[en], data[ja]))
             
             if splits is not None:
-                # train / (valid + test)
-                data = data.train_test_split(train_size=splits[0])
-                if len(splits) == 3:
-                    valid_test = data["test"].train_test_split(train_size=(splits[1] / (splits[1] + splits[2])))
-                    data = DatasetDict({
-                        'train': data['train'],
-                        'valid': valid_test['train'],
-                        'test' : valid_test['test']
-                    })
-
-            data.set_format(type="torch")
+                data = EnJaDatasetMaker._split(data, splits)
             data_list.append(data)
         
         if splits is None:
@@ -190,11 +265,383 @@ class EnJaDatasetMaker():
                 "test"  : concatenate_datasets([d["test"]  for d in data_list]),
             })
         
+        # shuffle across sources, rows are gathered once when saving
+        fingerprint = Hasher.hash([
+            dataset_id, [astuple(dss) for dss in dataset_splits], source_language, model_type,
+            [EnJaTokenizationCache.get_tokenizer_fingerprint(tok) for tok in [tokenizer, encoder_tokenizer, decoder_tokenizer] if tok is not None],
+            seed, splits, deduplicate, near_dedup_threshold, eval_datasets
+        ])
+        rng = np.random.default_rng(seeds[-1])
+        if isinstance(dataset, DatasetDict):
+            dataset = DatasetDict({
+                split: data.select(rng.permutation(len(data)), new_fingerprint=Hasher.hash([fingerprint, split]))
+                for split, data in dataset.items()
+            })
+        else:
+            dataset = dataset.select(rng.permutation(len(dataset)), new_fingerprint=fingerprint)
+        dataset.set_format(type="torch")
+        
         # save dataset to cache
-        dataset.shuffle(seed)
+        if packed:
+            return EnJaPackedDataset.save(dataset, f"{save_dir}{EnJaDatasetMaker.PACKED_SUFFIX}")
         dataset.save_to_disk(save_dir)
         
-        return dataset
+        return load_from_disk(save_dir)
+    
+    @staticmethod
+    def stream_dataset(
+        dataset_splits: List[EnJaDatasetSample],
+        *,
+        source_language : str = None,
+        model_type : str = None,
+        tokenizer : Callable = None,
+        encoder_tokenizer : Callable = None,
+        decoder_tokenizer : Callable = None,
+        num_proc : int = 4,
+        seed : int = 42,
+        batch_size : int = 1000,
+        shuffle_buffer_size : int = 10_000,
+        deduplicate : bool = True,
+        near_dedup_threshold : Optional[float] = None,
+        eval_datasets : Optional[List[str]] = None
+    ) -> IterableDataset:
+        """Streaming variant of `prepare_dataset`, nothing is tokenized or saved in advance.
+
+        Each source is read one row group at a time (`EnJaDataset.iter_processed`,
+        the record batches of arrow files are visited in random order), rows that
+        cannot fit `ntokens` or are duplicates are skipped, the others are tokenized
+        lazily in batches of `batch_size`, filtered by `ntokens` and shuffled with a
+        buffer of `shuffle_buffer_size` rows. Sources are interleaved at random
+        until each one yields its `nsample` rows, so at any point of the stream
+        the mix follows the `nsample` proportions. Memory is bounded by the buffers,
+        training can start right away.
+
+        Parameters
+        ----------
+        dataset_splits : List[EnJaDatasetSample]
+            the sources and how many rows to take from each, see `EnJaDatasetSample`
+        source_language, model_type, tokenizer, encoder_tokenizer, decoder_tokenizer
+            as in `prepare_dataset`
+        num_proc : int
+            number of workers used to compute near duplicates, by default 4
+        seed : int
+            seed of the shuffling and of the interleaving, by default 42
+        batch_size : int
+            number of rows tokenized at once, by default 1000
+        shuffle_buffer_size : int
+            size of the shuffle buffer of each source, by default 10000
+        deduplicate : bool
+            whenever to skip pairs repeated inside a source, present in a previous
+            source or in `eval_datasets`, by default True. Unlike `prepare_dataset`
+            every row of a previous source counts, not only the sampled ones
+        near_dedup_threshold : float, optional
+            as in `prepare_dataset`, by default None (disabled)
+        eval_datasets : List[str], optional
+            as in `prepare_dataset`
+
+        Returns
+        -------
+        IterableDataset
+            a hugging face iterable dataset with the columns of `prepare_dataset`
+            (its length is unknown, set `max_steps` when training)
+        """
+        # argument checking
+        assert num_proc > 0, "Invalid number of workers."
+        assert batch_size > 0, "Invalid batch size."
+        assert shuffle_buffer_size > 0, "Invalid shuffle buffer size."
+        assert near_dedup_threshold is None or 0 < near_dedup_threshold <= 1, "Invalid near duplicate threshold."
+        EnJaDatasetMaker._check_arguments(
+            dataset_splits, source_language=source_language, model_type=model_type, tokenizer=tokenizer,
+            encoder_tokenizer=encoder_tokenizer, decoder_tokenizer=decoder_tokenizer
+        )
+        
+        # one seed per source and one for the interleaving
+        seeds = np.random.SeedSequence(seed).spawn(len(dataset_splits) + 1)
+        masks = [None] * len(dataset_splits)
+        if (deduplicate or near_dedup_threshold is not None) and eval_datasets is None:
+            eval_datasets = EnJaDedupIndex.get_eval_paths()
+        if deduplicate:
+            in_mix = EnJaDedupIndex()
+            in_eval = EnJaDedupIndex.from_datasets(eval_datasets)
+            for i, dss in enumerate(dataset_splits):
+                masks[i] = EnJaDatasetMaker._get_dedup_mask(dss.dataset, in_mix=in_mix, in_eval=in_eval)
+                in_mix.add(EnJaDedupIndex.get_hashes(dss.dataset)[masks[i]])
+        if near_dedup_threshold is not None:
+            near_dedup_masks = EnJaDatasetMaker._get_near_dedup_masks(
+                [dss.dataset for dss in dataset_splits], eval_datasets,
+                threshold=near_dedup_threshold, num_proc=num_proc
+            )
+            masks = [
+                near_dedup_masks[dss.dataset] if mask is None else mask & near_dedup_masks[dss.dataset]
+                for dss, mask in zip(dataset_splits, masks)
+            ]
+        
+        sources = []
+        for ds_split, mask, source_seed in zip(dataset_splits, masks, seeds):
+            # record batches are the shards of arrow files, their order is shuffled too
+            shards = [[i] for i, _ in enumerate(EnJaDataset.iter_processed(ds_split.dataset))] if ds_split.dataset.endswith(".arrow") else [None]
+            data = IterableDataset.from_generator(
+                EnJaDatasetMaker._generate_pairs,
+                features=Features({"source": Value("string"), "target": Value("string")}),
+                gen_kwargs={
+                    "shards": shards, "path": ds_split.dataset, "source_language": source_language,
+                    "ntokens": ds_split.ntokens, "mask": mask
+                }
+            )
+            if model_type == "BERT-GPT2":
+                tokenize = EnJaDatasetMaker._get_batched_map_compute_BERT_GPT2_tokenization(
+                    encoder_tokenizer=encoder_tokenizer, decoder_tokenizer=decoder_tokenizer, ntokens=ds_split.ntokens
+                )
+            else: # model_type == "mBART"
+                tokenize = EnJaDatasetMaker._get_batched_map_compute_mBART_tokenization(
+                    tokenizer=tokenizer, ntokens=ds_split.ntokens
+                )
+            data = data.map(tokenize, batched=True, batch_size=batch_size)
+            sources.append(data.shuffle(seed=int(source_seed.generate_state(1)[0]), buffer_size=shuffle_buffer_size))
+        
+        return IterableDataset(ExamplesIterable(EnJaDatasetMaker._interleave, {
+            # tuples, lists would be split into shards
+            "sources": tuple(sources),
+            "nsamples": tuple(dss.nsample for dss in dataset_splits),
+            "seed": seeds[-1],
+        })).with_format("torch")
+    
+    @staticmethod
+    def _generate_pairs(shards : List[Optional[List[int]]], *, path : str, source_language : str, ntokens : Tuple[int, int], mask : Optional[np.ndarray]):
+        """Yields the rows of `path` (record batches `shards`) as source/target pairs,
+        skipping rows outside `mask` or unable to fit `ntokens`."""
+        source, target = ("en_sentence", "ja_sentence") if source_language == "en" else ("ja_sentence", "en_sentence")
+        for shard in shards:
+            for offset, batch in EnJaDataset.iter_processed(path, shard):
+                keep = EnJaDatasetMaker._get_length_prescreen(batch.column(source), ntokens, source_language)
+                if mask is not None:
+                    keep &= mask[offset:offset + batch.num_rows]
+                batch = batch.filter(pa.array(keep))
+                yield from (
+                    {"source": s, "target": t}
+                    for s, t in zip(batch.column(source).to_pylist(), batch.column(target).to_pylist())
+                )
+    
+    @staticmethod
+    def _interleave(sources : Tuple[IterableDataset], nsamples : Tuple[int], seed : np.random.SeedSequence):
+        """Yields `nsamples[i]` rows of each source (fewer if it runs out), picking the
+        next source with probability proportional to its remaining rows."""
+        rng = np.random.default_rng(seed)
+        iterators = [iter(source) for source in sources]
+        remaining = np.array(nsamples, dtype=np.float64)
+        nrows = 0
+        while remaining.sum() > 0:
+            i = rng.choice(len(iterators), p=remaining / remaining.sum())
+            row = next(iterators[i], None)
+            if row is None:
+                remaining[i] = 0
+                continue
+            remaining[i] -= 1
+            yield nrows, row
+            nrows += 1
+    
+    @staticmethod
+    def _check_arguments(dataset_splits : List[EnJaDatasetSample], *, source_language, model_type, tokenizer, encoder_tokenizer, decoder_tokenizer):
+        assert source_language in ["en", "ja"], "Invalid language."
+        assert model_type in ["BERT-GPT2", "mBART"], "Invalid model type."
+        if model_type == "BERT-GPT2":
+            assert encoder_tokenizer is not None and hasattr(encoder_tokenizer, "__call__"), "Object passed is not a valid tokenizer!"
+            assert decoder_tokenizer is not None and hasattr(decoder_tokenizer, "__call__"), "Object passed is not a valid tokenizer!"
+            assert tokenizer is None, "Invalid arguments passed to function call!"
+        else:
+            assert tokenizer is not None and hasattr(tokenizer, "__call__"), "Object passed is not a valid tokenizer!"
+            assert encoder_tokenizer is None and decoder_tokenizer is None, "Invalid arguments passed to function call!"
+        assert all(isinstance(dss, EnJaDatasetSample) for dss in dataset_splits), "Invalid split object!"
+        for i, dss in enumerate(dataset_splits):
+            assert os.path.exists(dss.dataset), f"Invalid dataset: dataset_splits[{i}] = {dss.dataset.__name__} not found"
+            assert isinstance(dss.nsample, int) and dss.nsample > 0, f"Invalid number of samples: dataset_splits[{i}] = {dss.nsample}"
+            assert isinstance(dss.ntokens, tuple) and len(dss.ntokens) == 2 and 0 <= dss.ntokens[0] <= dss.ntokens[1], f"Invalid number of samples: dataset_splits[{i}] = {dss.ntokens}"
+    
+    @staticmethod
+    def _split(data : Dataset, splits : Union[Tuple[float, float], Tuple[float, float, float]]) -> DatasetDict:
+        """Splits sampled rows into train/test or train/valid/test (ratios summing to 1).
+        Rows are sampled in random order, so consecutive ranges are random splits."""
+        ntrain = int(splits[0] * len(data))
+        if len(splits) == 2:
+            return DatasetDict({
+                "train" : data.select(range(ntrain)),
+                "test"  : data.select(range(ntrain, len(data))),
+            })
+        nvalid = int(splits[1] / (splits[1] + splits[2]) * (len(data) - ntrain))
+        return DatasetDict({
+            "train" : data.select(range(ntrain)),
+            "valid" : data.select(range(ntrain, ntrain + nvalid)),
+            "test"  : data.select(range(ntrain + nvalid, len(data))),
+        })
+            
+    @staticmethod
+    def _sample_tokenized(data : Dataset, ds_split : EnJaDatasetSample, *, tokenize : Callable, source_language : str, seed : Union[int, np.random.SeedSequence], margin : float, mask : Optional[np.ndarray] = None) -> Dataset:
+        """Samples `ds_split.nsample` rows of `data` inside `ds_split.ntokens` while
+        tokenizing as few rows as possible.
+
+        Rows are visited in a seeded random order and the first `nsample` rows that
+        pass the exact token filter are kept. A conservative character length
+        pre-screen discards rows that cannot possibly fit `ntokens`, then candidates
+        are tokenized in pools of `nsample * (1 + margin)` rows until enough survive.
+        The output only depends on the seed, not on the margin or pool sizes.
+        Rows outside the optional boolean `mask` are never sampled.
+        """
+        order = np.random.default_rng(seed).permutation(len(data))
+        keep = EnJaDatasetMaker._get_length_prescreen(data.data.column("source"), ds_split.ntokens, source_language)
+        if mask is not None:
+            keep &= mask
+        order = order[keep[order]]
+        
+        nsample, offset, chunks, nselected = ds_split.nsample, 0, [], 0
+        pool_size = math.ceil(nsample * (1 + margin))
+        while offset < len(order) and nselected < nsample:
+            candidates = data.select(order[offset:offset + pool_size])
+            chunk = tokenize(candidates, ds_split.ntokens)
+            offset += len(candidates)
+            chunks.append(chunk)
+            nselected += len(chunk)
+            # resize the next pool with the acceptance rate observed so far
+            acceptance = max(nselected, 1) / offset
+            pool_size = math.ceil((nsample - nselected) / acceptance * (1 + margin))
+        if len(chunks) == 0:
+            # no candidate left by the pre-screen or the mask, `map` needs a row to add the tokenized features
+            chunks.append(tokenize(data.select(range(min(len(data), 1))), None).select([]))
+        
+        data = concatenate_datasets(chunks) if len(chunks) > 1 else chunks[0]
+        if nsample < len(data):
+            print(f"sampling: {nsample} out of {len(order)} (tokenized {offset})")
+            data = data.select(range(nsample))
+        else:
+            print(f"sampling: using all data ({len(data)})")
+        return data
+    
+    @staticmethod
+    def _sample_cached(data : Dataset, ds_split : EnJaDatasetSample, *, seed : Union[int, np.random.SeedSequence], mask : Optional[np.ndarray] = None) -> Dataset:
+        """Samples `ds_split.nsample` rows of an already tokenized `data` inside
+        `ds_split.ntokens`. Selects the same rows as `_sample_tokenized`."""
+        order = np.random.default_rng(seed).permutation(len(data))
+        length = data.data.column("length").to_numpy()
+        keep = (ds_split.ntokens[0] <= length) & (length < ds_split.ntokens[1])
+        if mask is not None:
+            keep &= mask
+        order = order[keep[order]]
+        
+        if ds_split.nsample < len(order):
+            print(f"sampling: {ds_split.nsample} out of {len(order)}")
+            order = order[:ds_split.nsample]
+        else:
+            print(f"sampling: using all data ({len(order)})")
+        return data.select(order)
+    
+    @staticmethod
+    def _get_dedup_mask(path : str, *, in_mix : EnJaDedupIndex, in_eval : EnJaDedupIndex) -> np.ndarray:
+        """Returns a boolean mask of the rows of `path` that are neither repeated,
+        already in the mix nor evaluation pairs, and reports the counts."""
+        hashes = EnJaDedupIndex.get_hashes(path)
+        first = EnJaDedupIndex.get_first_occurrences(hashes)
+        leaked = first & in_eval.contains(hashes)
+        mixed = first & ~leaked & in_mix.contains(hashes)
+        print(
+            f"deduplicating: {path} drops {np.count_nonzero(~first)} repeated, "
+            f"{np.count_nonzero(mixed)} already in the mix and {np.count_nonzero(leaked)} evaluation pairs"
+        )
+        return first & ~leaked & ~mixed
+    
+    @staticmethod
+    def _get_near_dedup_masks(paths : List[str], eval_paths : List[str], *, threshold : float, num_proc : int) -> dict:
+        """Returns, for each source in `paths`, a boolean mask of the rows that are
+        neither near duplicates of a previous row (in `paths` order) nor of an 
+        evaluation pair, and reports the counts. Sources that are evaluation sets
+        are dropped entirely (all False)."""
+        eval_paths = list(dict.fromkeys(eval_paths))
+        sources = [path for path in dict.fromkeys(paths) if path not in eval_paths]
+        signatures = [EnJaMinHashLSH.get_signatures(path, num_proc=num_proc) for path in [*eval_paths, *sources]]
+        duplicates = EnJaMinHashLSH.get_duplicates(np.concatenate(signatures), threshold)
+        
+        masks, offset = {}, sum(len(signature) for signature in signatures[:len(eval_paths)])
+        for path, signature in zip(sources, signatures[len(eval_paths):]):
+            masks[path] = ~duplicates[offset:offset + len(signature)]
+            offset += len(signature)
+            print(f"near-deduplicating: {path} drops {np.count_nonzero(~masks[path])} near duplicates")
+        for path, signature in zip(eval_paths, signatures):
+            if path in paths:
+                masks[path] = np.zeros(len(signature), dtype=bool)
+                print(f"near-deduplicating: {path} drops {len(signature)} evaluation pairs")
+        return masks
+    
+    @staticmethod
+    def _get_length_prescreen(source : Union[pa.Array, pa.ChunkedArray], ntokens : Tuple[int, int], source_language : str) -> np.ndarray:
+        """Returns a boolean mask of the source sentences whose character length could
+        fit `ntokens`, using the bounds in `EnJaDatasetMaker.TOKENS_PER_CHAR`."""
+        min_ratio, max_ratio = EnJaDatasetMaker.TOKENS_PER_CHAR[source_language]
+        nchars = pc.utf8_length(source)
+        nchars = pc.fill_null(nchars, 0).to_numpy()
+        min_tokens = nchars * min_ratio
+        max_tokens = nchars * max_ratio + EnJaDatasetMaker.TOKENS_SPECIAL_SLACK
+        return (max_tokens >= ntokens[0]) & (min_tokens < ntokens[1])
+    
+    @staticmethod
+    def _tokenize(data : Dataset, ntokens : Tuple[int, int], *, model_type, tokenizer, encoder_tokenizer, decoder_tokenizer, num_proc, batched, batch_size) -> Dataset:
+        """Tokenizes `data` and drops rows outside `ntokens`, in a single pass when `batched`."""
+        num_proc = max(1, min(num_proc, len(data) // batch_size))
+        if model_type == "BERT-GPT2" and batched:
+            return data.map(
+                EnJaDatasetMaker._get_batched_map_compute_BERT_GPT2_tokenization(
+                    encoder_tokenizer=encoder_tokenizer, 
+                    decoder_tokenizer=decoder_tokenizer,
+                    ntokens=ntokens
+                ), 
+                batched=True,
+                batch_size=batch_size,
+                remove_columns=data.column_names,
+                features=EnJaDatasetMaker._get_tokenized_features(data),
+                num_proc=num_proc,
+            )
+        elif batched: # model_type == "mBART"
+            return data.map(
+                EnJaDatasetMaker._get_batched_map_compute_mBART_tokenization(
+                    tokenizer=tokenizer,
+                    ntokens=ntokens
+                ), 
+                batched=True,
+                batch_size=batch_size,
+                remove_columns=data.column_names,
+                features=EnJaDatasetMaker._get_tokenized_features(data),
+                num_proc=num_proc,
+            )
+        
+        if model_type == "BERT-GPT2":
+            data = data.map(
+                EnJaDatasetMaker._get_map_compute_BERT_GPT2_tokenization(
+                    encoder_tokenizer=encoder_tokenizer, 
+                    decoder_tokenizer=decoder_tokenizer
+                ), 
+                num_proc=num_proc,
+            )
+        else: # model_type == "mBART"
+            data = data.map(
+                EnJaDatasetMaker._get_map_compute_mBART_tokenization(
+                    tokenizer=tokenizer
+                ), 
+                num_proc=num_proc,
+            )
+        if ntokens is None:
+            return data
+        return data.filter(
+            EnJaDatasetMaker._get_filter_is_inside_boundaries(ntokens),
+            num_proc=num_proc,
+        )
+            
+    @staticmethod
+    def _get_tokenized_features(data : Dataset) -> Features:
+        # explicit features, batches may be emptied by the `ntokens` boundaries
+        return Features({
+            **data.features,
+            "length"         : Value("int64"),
+            "input_ids"      : Sequence(Value("int64")),
+            "attention_mask" : Sequence(Value("int64")),
+            "labels"         : Sequence(Value("int64")),
+        })
             
     @staticmethod
     def _get_map_compute_BERT_GPT2_tokenization(*, encoder_tokenizer=None, decoder_tokenizer=None):  
@@ -225,6 +672,50 @@ class EnJaDatasetMaker():
         
         return compute_tokenization
 
+    @staticmethod
+    def _get_batched_map_compute_BERT_GPT2_tokenization(*, encoder_tokenizer=None, decoder_tokenizer=None, ntokens=None):
+        def compute_tokenization(batch):
+            # plain python lists are written straight to arrow, no tensors involved
+            src_tokens = encoder_tokenizer(batch["source"], return_token_type_ids=False)
+            trg_tokens = decoder_tokenizer(
+                batch["target"], return_attention_mask=False, return_token_type_ids=False
+            )
+            
+            return EnJaDatasetMaker._select_inside_boundaries(batch, {
+                "length"         : [len(ids) for ids in src_tokens["input_ids"]],
+                "input_ids"      : src_tokens["input_ids"],
+                "attention_mask" : src_tokens["attention_mask"],
+                "labels"         : trg_tokens["input_ids"],
+            }, ntokens)
+        
+        return compute_tokenization
+    
+    @staticmethod
+    def _get_batched_map_compute_mBART_tokenization(*, tokenizer=None, ntokens=None):
+        def compute_tokenization(batch):
+            # plain python lists are written straight to arrow, no tensors involved
+            tokens = tokenizer(batch["source"], text_target=batch["target"], return_token_type_ids=False)
+            
+            return EnJaDatasetMaker._select_inside_boundaries(batch, {
+                "length"         : [len(ids) for ids in tokens["input_ids"]],
+                "input_ids"      : tokens["input_ids"],
+                "attention_mask" : tokens["attention_mask"],
+                "labels"         : tokens["labels"],
+            }, ntokens)
+        
+        return compute_tokenization
+    
+    @staticmethod
+    def _select_inside_boundaries(batch, tokens, ntokens):
+        # every column is returned since `map` is allowed to drop rows
+        if ntokens is None:
+            return {**batch, **tokens}
+        keep = [i for i, length in enumerate(tokens["length"]) if ntokens[0] <= length < ntokens[1]]
+        return {
+            column : [values[i] for i in keep] 
+            for column, values in {**batch, **tokens}.items()
+        }
+
     @staticmethod
     def _get_filter_is_inside_boundaries(splice):
         def is_inside_boundaries(sample):
@@ -0,0 +1,341 @@
+# python libraries
+from typing import Iterable, List, Optional
+from multiprocessing import Pool
+import os, unicodedata, warnings
+
+# external libraries
+import numpy as np
+import xxhash
+from tqdm import TqdmExperimentalWarning
+
+warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
+from tqdm.autonotebook import tqdm
+
+# local libraries
+from .dataset_base import EnJaDataset
+from .dataset_cache import EnJaTokenizationCache
+from .flores import Flores
+from .wmt_vat import WMTvat
+
+
+class EnJaDedupIndex:
+    """Compact set of hashed (en, ja) sentence pairs.
+
+    Pairs are normalised (NFKC, case folded, collapsed whitespace) and hashed
+    to 64 bit integers with xxh3, the set is a sorted numpy array so membership
+    of a whole source is a single vectorised `searchsorted`. The per-row hashes
+    of each source file are computed once and stored under `DATASET_FINAL_DIR`,
+    keyed by the file content hash.
+    """
+
+    INDEX_DIR_NAME = r".dedup-index"
+    EVAL_OUT_NAMES = (*Flores.OUT_NAMES, *WMTvat.OUT_NAMES)
+
+    def __init__(self, hashes : Optional[np.ndarray] = None):
+        self.hashes = np.unique(np.asarray(hashes if hashes is not None else [], dtype=np.uint64))
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def add(self, hashes : np.ndarray):
+        """Adds the given pair hashes to the set."""
+        self.hashes = np.union1d(self.hashes, np.asarray(hashes, dtype=np.uint64))
+        return
+
+    def contains(self, hashes : np.ndarray) -> np.ndarray:
+        """Returns a boolean mask of the given pair hashes already in the set."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if len(self.hashes) == 0:
+            return np.zeros(len(hashes), dtype=bool)
+        pos = np.searchsorted(self.hashes, hashes).clip(max=len(self.hashes) - 1)
+        return self.hashes[pos] == hashes
+
+    @staticmethod
+    def from_datasets(paths : List[str]) -> "EnJaDedupIndex":
+        """Returns the set of pairs of the given processed files."""
+        index = EnJaDedupIndex()
+        for path in paths:
+            index.add(EnJaDedupIndex.get_hashes(path))
+        return index
+
+    @staticmethod
+    def get_eval_paths() -> List[str]:
+        """Returns the paths of the evaluation datasets (`Flores` and `WMTvat`)
+        already processed, missing ones are reported and skipped."""
+        paths = []
+        for name in EnJaDedupIndex.EVAL_OUT_NAMES:
+            path = EnJaDataset.get_processed_path(name)
+            if os.path.exists(path):
+                paths.append(path)
+            else:
+                print(f"warning: {name} not found, training data is not checked against it.")
+        return paths
+
+    @staticmethod
+    def get_hashes(path : str) -> np.ndarray:
+        """Returns the pair hashes of a processed file, in row order.
+
+        Parameters
+        ----------
+        path : str
+            path to a processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns
+
+        Returns
+        -------
+        np.ndarray
+            an uint64 array with one hash per row
+        """
+        index_dir = f"{EnJaDataset.DATASET_FINAL_DIR}/{EnJaDedupIndex.INDEX_DIR_NAME}"
+        index_path = f"{index_dir}/{EnJaTokenizationCache.get_file_hash(path)}.npy"
+        if os.path.exists(index_path):
+            return np.load(index_path)
+
+        data = EnJaDataset.load_processed(path)
+        hashes = np.concatenate([np.zeros(0, dtype=np.uint64), *(
+            EnJaDedupIndex.hash_pairs(batch["en_sentence"], batch["ja_sentence"])
+            for batch in data.iter(batch_size=EnJaDataset.WRITE_BUFFER_SIZE)
+        )])
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        # write then rename, an interrupted write never leaves a truncated index
+        np.save(f"{index_path}.tmp.npy", hashes)
+        os.replace(f"{index_path}.tmp.npy", index_path)
+        return hashes
+
+    @staticmethod
+    def hash_pairs(en_sentences : Iterable[str], ja_sentences : Iterable[str]) -> np.ndarray:
+        """Returns the uint64 hashes of the normalised (en, ja) pairs."""
+        normalize = EnJaDedupIndex.normalize
+        return np.fromiter((
+            xxhash.xxh3_64_intdigest(f"{normalize(en)}\t{normalize(ja)}".encode())
+            for en, ja in zip(en_sentences, ja_sentences)
+        ), dtype=np.uint64)
+
+    @staticmethod
+    def normalize(text : Optional[str]) -> str:
+        """NFKC normalisation, case folding and whitespace collapsing (tabs included)."""
+        return " ".join(unicodedata.normalize("NFKC", text or "").casefold().split())
+
+    @staticmethod
+    def get_first_occurrences(hashes : np.ndarray) -> np.ndarray:
+        """Returns a boolean mask keeping the first occurrence of each hash."""
+        _, first = np.unique(hashes, return_index=True)
+        mask = np.zeros(len(hashes), dtype=bool)
+        mask[first] = True
+        return mask
+
+
+class EnJaMinHashLSH:
+    """Near duplicate detection of (en, ja) sentence pairs with MinHash and LSH.
+
+    Pairs are reduced to their case folded alphanumeric characters, so that
+    punctuation, spacing and casing variants ("i don 't" / "I don't") share the
+    same character n-grams. Each pair gets a `NUM_PERM` MinHash signature,
+    computed with numpy over whole batches, and stored under `DATASET_FINAL_DIR`
+    once per source file. Signatures are then split into LSH bands, pairs
+    sharing a band are verified against the similarity threshold and grouped
+    in clusters, only the first row of each cluster is kept. Pairs without any
+    alphanumeric character have no n-gram, their signature is `EMPTY_SIGNATURE`
+    and they are never near duplicates (exact duplicates are `EnJaDedupIndex`'s).
+    """
+
+    NUM_PERM = 64
+    SHINGLE_SIZE = 5
+    HASH_SEED = 42
+    BATCH_SIZE = 10_000
+    PERM_CHUNK_SIZE = 8
+    EDGE_CHUNK_SIZE = 1_000_000
+    MIN_RECALL = 0.9
+    # bumped when signatures change, stored signatures of other versions are computed again
+    SIGNATURE_VERSION = 2
+    EMPTY_SIGNATURE = np.iinfo(np.uint32).max
+
+    @staticmethod
+    def get_signatures(path : str, num_proc : int = EnJaDataset.NUM_PROC) -> np.ndarray:
+        """Returns the MinHash signatures of a processed file, in row order.
+
+        Parameters
+        ----------
+        path : str
+            path to a processed file (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns
+        num_proc : int
+            number of worker processes, by default `EnJaDataset.NUM_PROC`
+
+        Returns
+        -------
+        np.ndarray
+            an uint32 array of shape (#rows, `NUM_PERM`)
+        """
+        index_dir = f"{EnJaDataset.DATASET_FINAL_DIR}/{EnJaDedupIndex.INDEX_DIR_NAME}"
+        index_path = (
+            f"{index_dir}/{EnJaTokenizationCache.get_file_hash(path)}"
+            f".minhash-v{EnJaMinHashLSH.SIGNATURE_VERSION}-{EnJaMinHashLSH.NUM_PERM}-{EnJaMinHashLSH.SHINGLE_SIZE}.npy"
+        )
+        if os.path.exists(index_path):
+            return np.load(index_path)
+
+        data = EnJaDataset.load_processed(path)
+        batches = (
+            (batch["en_sentence"], batch["ja_sentence"])
+            for batch in data.iter(batch_size=EnJaMinHashLSH.BATCH_SIZE)
+        )
+        progress_bar = tqdm(desc=f"MinHash {os.path.basename(path)}", unit=" rows", unit_scale=True, total=len(data))
+        signatures = [np.zeros((0, EnJaMinHashLSH.NUM_PERM), dtype=np.uint32)]
+        if num_proc > 1:
+            with Pool(num_proc) as pool:
+                for signature in pool.imap(EnJaMinHashLSH._compute_batch_signatures, batches):
+                    signatures.append(signature)
+                    progress_bar.update(len(signature))
+        else:
+            for batch in batches:
+                signatures.append(EnJaMinHashLSH._compute_batch_signatures(batch))
+                progress_bar.update(len(signatures[-1]))
+        progress_bar.close()
+        signatures = np.concatenate(signatures)
+
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+        np.save(f"{index_path}.tmp.npy", signatures)
+        os.replace(f"{index_path}.tmp.npy", index_path)
+        return signatures
+
+    @staticmethod
+    def compute_signatures(texts : List[str]) -> np.ndarray:
+        """Returns the MinHash signatures of the given (already normalised) texts.
+
+        Parameters
+        ----------
+        texts : List[str]
+            texts to sign, see `EnJaMinHashLSH.normalize`
+
+        Returns
+        -------
+        np.ndarray
+            an uint32 array of shape (len(texts), `NUM_PERM`), `EMPTY_SIGNATURE`
+            everywhere for empty texts
+        """
+        n = EnJaMinHashLSH.SHINGLE_SIZE
+        if len(texts) == 0:
+            return np.zeros((0, EnJaMinHashLSH.NUM_PERM), dtype=np.uint32)
+        # code points of every text, back to back, padded for the last n-gram
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        chars = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32)
+        chars = np.concatenate([chars, np.zeros(n, dtype=np.uint32)]).astype(np.uint64) + 1
+        # one n-gram per start position, texts shorter than n are a single n-gram
+        counts = np.maximum(lengths - n + 1, 1)
+        first_shingle = np.cumsum(counts) - counts
+        starts = (
+            np.repeat(np.cumsum(lengths) - lengths - first_shingle, counts) 
+            + np.arange(counts.sum())
+        )
+        sizes = np.repeat(np.minimum(lengths, n), counts)
+        shingles = np.zeros(len(starts), dtype=np.uint64)
+        for k in range(n):
+            shingles = np.where(k < sizes, shingles * np.uint64(0x100000001B3) + chars[starts + k], shingles)
+        shingles ^= shingles >> np.uint64(31)
+
+        # universal hashing (multiply-shift) as random permutations, min per text
+        a, b = EnJaMinHashLSH._get_permutations()
+        signatures = np.empty((len(texts), EnJaMinHashLSH.NUM_PERM), dtype=np.uint32)
+        for i in range(0, EnJaMinHashLSH.NUM_PERM, EnJaMinHashLSH.PERM_CHUNK_SIZE):
+            j = i + EnJaMinHashLSH.PERM_CHUNK_SIZE
+            permuted = ((shingles[:, None] ^ b[i:j]) * a[i:j]) >> np.uint64(32)
+            signatures[:, i:j] = np.minimum.reduceat(permuted, first_shingle, axis=0)
+        # the padding n-gram of empty texts would make them all identical
+        signatures[lengths == 0] = EnJaMinHashLSH.EMPTY_SIGNATURE
+        return signatures
+
+    @staticmethod
+    def get_duplicates(signatures : np.ndarray, threshold : float) -> np.ndarray:
+        """Returns a boolean mask of the near duplicate rows.
+
+        Rows whose estimated Jaccard similarity is at least `threshold` are
+        clustered, every row of a cluster but the first one is a duplicate.
+        Rows of empty texts (`EMPTY_SIGNATURE`) are never duplicates.
+
+        Parameters
+        ----------
+        signatures : np.ndarray
+            MinHash signatures, see `EnJaMinHashLSH.get_signatures`
+        threshold : float
+            the similarity threshold, in (0, 1]
+
+        Returns
+        -------
+        np.ndarray
+            a boolean mask, True on the rows to drop
+        """
+        assert 0 < threshold <= 1, "Invalid threshold."
+        nbands, nrows = EnJaMinHashLSH._get_bands(threshold)
+        sources, targets = [], []
+        for band in range(nbands):
+            columns = signatures[:, band * nrows : (band + 1) * nrows].astype(np.uint64)
+            keys = np.zeros(len(signatures), dtype=np.uint64)
+            for column in columns.T:
+                keys = keys * np.uint64(0x100000001B3) + column
+            # rows sharing a bucket are compared to the first and previous rows of
+            # the bucket, linear in the bucket size instead of quadratic
+            order = np.argsort(keys, kind="stable")
+            keys = keys[order]
+            is_first = np.r_[True, keys[1:] != keys[:-1]]
+            first = order[np.maximum.accumulate(np.where(is_first, np.arange(len(order)), 0))]
+            previous = np.r_[order[:1], order[:-1]]
+            sources.extend([order[~is_first], order[~is_first]])
+            targets.extend([first[~is_first], previous[~is_first]])
+        sources, targets = np.concatenate(sources), np.concatenate(targets)
+        empty = (signatures == EnJaMinHashLSH.EMPTY_SIGNATURE).all(axis=1)
+        candidates = ~empty[sources] & ~empty[targets]
+        sources, targets = sources[candidates], targets[candidates]
+
+        # verify the candidates on the whole signature
+        similar = np.zeros(len(sources), dtype=bool)
+        for i in range(0, len(sources), EnJaMinHashLSH.EDGE_CHUNK_SIZE):
+            j = i + EnJaMinHashLSH.EDGE_CHUNK_SIZE
+            similar[i:j] = (signatures[sources[i:j]] == signatures[targets[i:j]]).mean(axis=1) >= threshold
+        labels = EnJaMinHashLSH._get_components(len(signatures), sources[similar], targets[similar])
+        return labels != np.arange(len(signatures))
+
+    @staticmethod
+    def normalize(en : Optional[str], ja : Optional[str]) -> str:
+        """Case folded alphanumeric characters of a NFKC normalised pair."""
+        text = unicodedata.normalize("NFKC", f"{en or ''}{ja or ''}").casefold()
+        return "".join(c for c in text if c.isalnum())
+
+    @staticmethod
+    def _compute_batch_signatures(batch):
+        en_sentences, ja_sentences = batch
+        return EnJaMinHashLSH.compute_signatures([
+            EnJaMinHashLSH.normalize(en, ja) for en, ja in zip(en_sentences, ja_sentences)
+        ])
+
+    @staticmethod
+    def _get_permutations():
+        rng = np.random.default_rng(EnJaMinHashLSH.HASH_SEED)
+        a = rng.integers(0, 2**64, EnJaMinHashLSH.NUM_PERM, dtype=np.uint64, endpoint=False) | np.uint64(1)
+        b = rng.integers(0, 2**64, EnJaMinHashLSH.NUM_PERM, dtype=np.uint64, endpoint=False)
+        return a, b
+
+    @staticmethod
+    def _get_bands(threshold):
+        # fewest bands (least candidates to verify) that find a pair right at the
+        # threshold with probability `MIN_RECALL`, false positives are verified away
+        for nbands in range(1, EnJaMinHashLSH.NUM_PERM + 1):
+            nrows = EnJaMinHashLSH.NUM_PERM // nbands
+            if EnJaMinHashLSH.NUM_PERM % nbands == 0 and 1 - (1 - threshold**nrows)**nbands >= EnJaMinHashLSH.MIN_RECALL:
+                return nbands, nrows
+        return EnJaMinHashLSH.NUM_PERM, 1
+
+    @staticmethod
+    def _get_components(nrows, sources, targets):
+        # min label propagation with pointer jumping, labels end up as the
+        # smallest row index of each connected component
+        labels = np.arange(nrows)
+        while True:
+            smallest = np.minimum(labels[sources], labels[targets])
+            updated = labels.copy()
+            np.minimum.at(updated, sources, smallest)
+            np.minimum.at(updated, targets, smallest)
+            updated = updated[updated]
+            if np.array_equal(updated, labels):
+                return labels
+            labels = updated
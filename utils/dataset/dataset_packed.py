@@ -0,0 +1,186 @@
+# python libraries
+from typing import Dict, List, Optional, Union
+import os, json, shutil
+
+# external libraries
+import numpy as np
+import pyarrow.compute as pc
+import torch
+from datasets import Dataset, DatasetDict
+from torch.utils.data import Dataset as TorchDataset
+
+
+class EnJaPackedDataset(TorchDataset):
+    """Tokenized pairs stored as flat token buffers plus offsets, memory-mapped.
+
+    A (split of a) dataset is a directory with, for "input_ids" and "labels", a
+    `<column>.npy` buffer holding the tokens of every row back to back (uint16 if
+    all the ids fit, int32 otherwise) and a `<column>.offsets.npy` array (int64,
+    row i is `buffer[offsets[i]:offsets[i + 1]]`). Attention masks are all ones
+    before padding and are not stored, `EnJaPackedCollator` rebuilds them. Text
+    columns are dropped. Files are opened with `np.load(mmap_mode="r")`, loading is
+    immediate and rows are read (without copies) only when accessed.
+
+    Parameters
+    ----------
+    path : str
+        directory written by `EnJaPackedDataset.save` (a single split)
+    """
+
+    COLUMNS = ["input_ids", "labels"]
+    SPLITS_NAME = r"splits.json"
+    BATCH_SIZE = 10_000
+
+    def __init__(self, path : str):
+        assert os.path.isfile(f"{path}/input_ids.npy"), f"Invalid packed dataset: {path} not found"
+        self.path = path
+        self.buffers = {column: np.load(f"{path}/{column}.npy", mmap_mode="r") for column in EnJaPackedDataset.COLUMNS}
+        self.offsets = {column: np.load(f"{path}/{column}.offsets.npy", mmap_mode="r") for column in EnJaPackedDataset.COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.offsets["input_ids"]) - 1
+
+    def __getitem__(self, key : Union[int, str]) -> Union[Dict[str, np.ndarray], np.ndarray]:
+        """Returns row `key` ({"input_ids", "labels"} views of the buffers), or the
+        number of source tokens of every row if `key == "length"` (as the "length"
+        column of the huggingface datasets)."""
+        if isinstance(key, str):
+            assert key == "length", f"Invalid column: {key}"
+            return self.lengths
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(f"Index {key} out of range for a dataset of {len(self)} rows")
+        return {
+            column: self.buffers[column][self.offsets[column][key]:self.offsets[column][key + 1]]
+            for column in EnJaPackedDataset.COLUMNS
+        }
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """Number of source tokens of every row."""
+        return np.diff(self.offsets["input_ids"])
+
+    @property
+    def label_lengths(self) -> np.ndarray:
+        """Number of target tokens of every row."""
+        return np.diff(self.offsets["labels"])
+
+    @staticmethod
+    def save(data : Union[Dataset, DatasetDict], path : str) -> Union["EnJaPackedDataset", Dict[str, "EnJaPackedDataset"]]:
+        """Writes a tokenized dataset (or each split of a `DatasetDict`) in packed
+        format and returns it loaded.
+
+        Parameters
+        ----------
+        data : Dataset | DatasetDict
+            a dataset with "input_ids" and "labels" columns (see `EnJaDatasetMaker`)
+        path : str
+            output directory, replaced if it exists
+
+        Returns
+        -------
+        EnJaPackedDataset | Dict[str, EnJaPackedDataset]
+            the packed dataset, or a dictionary split -> packed dataset
+        """
+        # written aside and renamed, an interrupted write leaves no partial dataset
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        if isinstance(data, DatasetDict):
+            for split, split_data in data.items():
+                EnJaPackedDataset._save_split(split_data, f"{tmp_path}/{split}")
+            with open(f"{tmp_path}/{EnJaPackedDataset.SPLITS_NAME}", "w") as fp:
+                json.dump({"splits": list(data.keys())}, fp)
+        else:
+            EnJaPackedDataset._save_split(data, tmp_path)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        return EnJaPackedDataset.load(path)
+
+    @staticmethod
+    def load(path : str) -> Union["EnJaPackedDataset", Dict[str, "EnJaPackedDataset"]]:
+        """Opens a packed dataset written by `EnJaPackedDataset.save`."""
+        splits_path = f"{path}/{EnJaPackedDataset.SPLITS_NAME}"
+        if not os.path.isfile(splits_path):
+            return EnJaPackedDataset(path)
+        with open(splits_path, "r") as fp:
+            splits = json.load(fp)["splits"]
+        return {split: EnJaPackedDataset(f"{path}/{split}") for split in splits}
+
+    @staticmethod
+    def _save_split(data : Dataset, path : str):
+        os.makedirs(path)
+        # arrow batches follow any indices mapping (select / shuffle) of `data`
+        batches = lambda: data.with_format("arrow").iter(batch_size=EnJaPackedDataset.BATCH_SIZE)
+        for column in EnJaPackedDataset.COLUMNS:
+            # first pass, row lengths and largest id
+            lengths, max_id = [], 0
+            for batch in batches():
+                lengths.append(pc.list_value_length(batch[column]).to_numpy())
+                batch_max = pc.max(pc.list_flatten(batch[column])).as_py()
+                max_id = max(max_id, batch_max if batch_max is not None else 0)
+            lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            np.save(f"{path}/{column}.offsets.npy", offsets)
+
+            # second pass, tokens written straight to the memory-mapped buffer
+            dtype = np.uint16 if max_id <= np.iinfo(np.uint16).max else np.int32
+            buffer = np.lib.format.open_memmap(f"{path}/{column}.npy", mode="w+", dtype=dtype, shape=(int(offsets[-1]),))
+            start = 0
+            for batch in batches():
+                values = pc.list_flatten(batch[column]).to_numpy()
+                buffer[start:start + len(values)] = values
+                start += len(values)
+            buffer.flush()
+            del buffer
+        return
+
+
+class EnJaPackedCollator:
+    """Pads rows of an `EnJaPackedDataset` into a batch of tensors.
+
+    The output matches `DataCollatorForSeq2Seq(tokenizer, model=model)` (right
+    padding): "input_ids" padded with `pad_token_id`, "attention_mask" rebuilt from
+    the row lengths, "labels" padded with `label_pad_token_id` and, if the model
+    can build them, "decoder_input_ids".
+
+    Parameters
+    ----------
+    pad_token_id : int
+        padding id of the source tokens
+    label_pad_token_id : int, optional
+        padding id of the labels, by default -100 (ignored by the loss)
+    model : PreTrainedModel, optional
+        the model, used to build "decoder_input_ids" from the labels
+    pad_to_multiple_of : int, optional
+        if given, padded lengths are rounded up to a multiple of this value
+    """
+
+    def __init__(self, pad_token_id : int, *, label_pad_token_id : int = -100, model=None, pad_to_multiple_of : Optional[int] = None):
+        self.pad_token_id = pad_token_id
+        self.label_pad_token_id = label_pad_token_id
+        self.model = model
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features : List[Dict[str, np.ndarray]]) -> Dict[str, torch.Tensor]:
+        input_ids, attention_mask = self._pad([feature["input_ids"] for feature in features], self.pad_token_id)
+        batch = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "labels" in features[0]:
+            batch["labels"], _ = self._pad([feature["labels"] for feature in features], self.label_pad_token_id)
+            if self.model is not None and hasattr(self.model, "prepare_decoder_input_ids_from_labels"):
+                batch["decoder_input_ids"] = self.model.prepare_decoder_input_ids_from_labels(labels=batch["labels"])
+        return batch
+
+    def _pad(self, rows, pad_id):
+        lengths = np.fromiter(map(len, rows), dtype=np.int64, count=len(rows))
+        width = int(lengths.max(initial=0))
+        if self.pad_to_multiple_of is not None:
+            width = -(-width // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        ids = np.full((len(rows), width), pad_id, dtype=np.int64)
+        for i, row in enumerate(rows):
+            ids[i, :len(row)] = row
+        mask = (np.arange(width) < lengths[:, None]).astype(np.int64)
+        return torch.from_numpy(ids), torch.from_numpy(mask)
@@ -0,0 +1,273 @@
+# python libraries
+from typing import Iterable, Iterator, List, Optional, Sequence, Union
+
+# external libraries
+import numpy as np
+import pyarrow.compute as pc
+from datasets import Dataset
+from torch.utils.data import DataLoader, Sampler
+from transformers import Seq2SeqTrainer, TrainerCallback
+from transformers.trainer_utils import PredictionOutput, seed_worker
+
+# local libraries
+from .dataset_packed import EnJaPackedDataset
+
+
+class EnJaTokenBudgetBatchSampler(Sampler):
+    """Batch sampler filling each batch up to a token budget instead of a fixed size.
+
+    Rows are visited by increasing length (stable, so ties keep their order) and
+    grouped in consecutive batches while `batch_size * max_length * num_beams`,
+    the padded size of the batch during beam search, fits in `max_tokens`. Rows
+    longer than the budget get a batch of their own.
+
+    For training (`shuffle=True`) rows of equal length are permuted and batches are
+    visited in random order, with a new permutation at each iteration (epoch).
+    Batch boundaries only depend on the sorted lengths, so the number of batches
+    and their padded sizes do not change between epochs. Pass the longest of the
+    source and target lengths of each row (`get_pair_lengths`) to bound the padded
+    size of both sides.
+
+    Parameters
+    ----------
+    lengths : Sequence[int]
+        number of source tokens of each row (the "length" column)
+    max_tokens : int
+        token budget of a batch, beams included
+    num_beams : int, optional
+        number of beams used for generation, by default 1
+    max_batch_size : int, optional
+        upper bound on the number of rows of a batch, by default None
+    sort : bool, optional
+        whenever to sort rows by length first, by default True. Set it to False
+        if rows are already sorted
+    shuffle : bool, optional
+        whenever to shuffle rows of equal length and batches at each epoch, by
+        default False
+    seed : int, optional
+        seed of the shuffling, by default 0
+    """
+
+    def __init__(self, lengths : Sequence[int], max_tokens : int, *, num_beams : int = 1, max_batch_size : Optional[int] = None, sort : bool = True, shuffle : bool = False, seed : int = 0):
+        assert max_tokens > 0, "Invalid token budget."
+        assert num_beams > 0, "Invalid number of beams."
+        assert max_batch_size is None or max_batch_size > 0, "Invalid batch size."
+        assert sort or not shuffle, "Shuffling requires sorting."
+        lengths = np.asarray(lengths)
+        self.lengths = lengths
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.order = np.argsort(lengths, kind="stable") if sort else np.arange(len(lengths))
+        self.batches = []
+        start, longest = 0, 0
+        for end, length in enumerate(lengths[self.order].tolist()):
+            longest = max(longest, length)
+            nrows = end - start + 1
+            too_large = nrows * longest * num_beams > max_tokens or (max_batch_size is not None and nrows > max_batch_size)
+            if too_large and nrows > 1:
+                self.batches.append((start, end))
+                start, longest = end, length
+        if start < len(lengths):
+            self.batches.append((start, len(lengths)))
+
+    def __iter__(self) -> Iterator[List[int]]:
+        if not self.shuffle:
+            for start, end in self.batches:
+                yield self.order[start:end].tolist()
+            return
+        rng = np.random.default_rng([self.seed, self.epoch])
+        self.epoch += 1
+        # sorted by length, random among equal lengths: same lengths at the same positions
+        order = np.lexsort((rng.random(len(self.lengths)), self.lengths))
+        for i in rng.permutation(len(self.batches)).tolist():
+            start, end = self.batches[i]
+            yield order[start:end].tolist()
+
+    def __len__(self) -> int:
+        return len(self.batches)
+
+    def set_epoch(self, epoch : int) -> None:
+        """Sets the epoch of the next iteration (the shuffling of the batches)."""
+        self.epoch = epoch
+
+    @staticmethod
+    def get_pair_lengths(data : Union[Dataset, EnJaPackedDataset]) -> np.ndarray:
+        """The longest of the source ("input_ids") and target ("labels") lengths of each row.
+
+        Parameters
+        ----------
+        data : Dataset | EnJaPackedDataset
+            a tokenized dataset (see `EnJaDatasetMaker`)
+
+        Returns
+        -------
+        np.ndarray
+            the length of each row
+        """
+        if isinstance(data, EnJaPackedDataset):
+            return np.maximum(data.lengths, data.label_lengths)
+        lengths = [
+            np.maximum(
+                pc.list_value_length(batch["input_ids"]).to_numpy(),
+                pc.list_value_length(batch["labels"]).to_numpy()
+            )
+            for batch in data.select_columns(["input_ids", "labels"]).with_format("arrow").iter(batch_size=EnJaPackedDataset.BATCH_SIZE)
+        ]
+        return np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+
+    @staticmethod
+    def get_padding_efficiency(lengths : Sequence[int], batches : Iterable[List[int]]) -> float:
+        """Fraction of real tokens in the padded batches, `sum(lengths) / sum(batch_size * max_length)`.
+
+        Parameters
+        ----------
+        lengths : Sequence[int]
+            number of tokens of each row
+        batches : Iterable[List[int]]
+            row indices of each batch (e.g. a batch sampler)
+
+        Returns
+        -------
+        float
+            the padding efficiency, 1.0 without padding
+        """
+        lengths = np.asarray(lengths)
+        tokens, padded = 0, 0
+        for batch in batches:
+            batch_lengths = lengths[batch]
+            tokens += int(batch_lengths.sum())
+            padded += len(batch_lengths) * int(batch_lengths.max(initial=0))
+        return tokens / padded if padded > 0 else 1.0
+
+    @staticmethod
+    def get_train_dataloader(trainer : Seq2SeqTrainer, data : Union[Dataset, EnJaPackedDataset], sampler : "EnJaTokenBudgetBatchSampler") -> DataLoader:
+        """The train dataloader of `trainer` with the batches of `sampler` (see
+        `EnJaTokenBudgetTrainer`)."""
+        if isinstance(data, Dataset):
+            data = trainer._remove_unused_columns(data, description="training")
+        return trainer.accelerator.prepare(DataLoader(
+            data,
+            batch_sampler=sampler,
+            collate_fn=trainer.data_collator,
+            num_workers=trainer.args.dataloader_num_workers,
+            pin_memory=trainer.args.dataloader_pin_memory,
+            worker_init_fn=seed_worker,
+        ))
+
+    @staticmethod
+    def predict(trainer : Seq2SeqTrainer, data : Dataset, *, max_tokens : int, max_batch_size : Optional[int] = None, **gen_kwargs) -> PredictionOutput:
+        """`trainer.predict` with token budget batches, predictions (and labels) are
+        returned in the row order of `data`.
+
+        Parameters
+        ----------
+        trainer : Seq2SeqTrainer
+            a huggingface seq2seq trainer (single process)
+        data : Dataset
+            a huggingface dataset with a "length" column
+        max_tokens : int
+            token budget of a batch, beams included
+        max_batch_size : int, optional
+            upper bound on the number of rows of a batch, by default None
+        **gen_kwargs
+            generation config passed to `trainer.predict`
+
+        Returns
+        -------
+        PredictionOutput
+            the predictions, labels and metrics
+        """
+        sampler = EnJaTokenBudgetBatchSampler(
+            data["length"], max_tokens,
+            num_beams=EnJaTokenBudgetBatchSampler.get_num_beams(trainer, gen_kwargs), max_batch_size=max_batch_size
+        )
+
+        def get_test_dataloader(test_dataset):
+            return EnJaTokenBudgetBatchSampler.get_test_dataloader(trainer, test_dataset, sampler)
+
+        # swapped for this call only, the trainer is left untouched
+        trainer.get_test_dataloader = get_test_dataloader
+        try:
+            output = trainer.predict(data, **gen_kwargs)
+        finally:
+            del trainer.get_test_dataloader
+
+        # predictions follow the sampler order, map them back to the rows
+        inverse = np.empty_like(sampler.order)
+        inverse[sampler.order] = np.arange(len(sampler.order))
+        return PredictionOutput(
+            predictions=output.predictions[inverse],
+            label_ids=output.label_ids[inverse] if output.label_ids is not None else None,
+            metrics=output.metrics,
+        )
+
+    @staticmethod
+    def get_test_dataloader(trainer : Seq2SeqTrainer, data : Dataset, sampler : "EnJaTokenBudgetBatchSampler") -> DataLoader:
+        """The test dataloader of `trainer` with the batches of `sampler`."""
+        data = trainer._remove_unused_columns(data, description="test")
+        return trainer.accelerator.prepare(DataLoader(
+            data,
+            batch_sampler=sampler,
+            collate_fn=trainer.data_collator,
+            num_workers=trainer.args.dataloader_num_workers,
+            pin_memory=trainer.args.dataloader_pin_memory,
+        ))
+
+    @staticmethod
+    def get_num_beams(trainer : Seq2SeqTrainer, gen_kwargs : dict) -> int:
+        """The number of beams `trainer` generates with, given the generation config of the call."""
+        return (
+            gen_kwargs.get("num_beams") or trainer.args.generation_num_beams
+            or getattr(getattr(trainer.model, "generation_config", None), "num_beams", None) or 1
+        )
+
+
+class EnJaTokenBudgetTrainer(Seq2SeqTrainer):
+    """`Seq2SeqTrainer` training on token budget batches (see `EnJaTokenBudgetBatchSampler`).
+
+    Training rows of similar length are batched up to `max_tokens` padded tokens
+    per side (the longest of the source and target lengths, `get_pair_lengths`),
+    batches are shuffled with `args.seed`. The sampler epoch is set from the
+    trainer state at the beginning of each epoch, so the batches of an epoch
+    only depend on the seed and the epoch: resuming from a checkpoint (the
+    batches already seen are skipped) follows the data order of an
+    uninterrupted run. `per_device_train_batch_size` is not used for training.
+
+    Parameters
+    ----------
+    *args, **kwargs
+        arguments of `Seq2SeqTrainer`
+    max_tokens : int
+        token budget of a training batch, per side
+    """
+
+    def __init__(self, *args, max_tokens : int, **kwargs):
+        assert max_tokens > 0, "Invalid token budget."
+        super().__init__(*args, **kwargs)
+        self.max_tokens = max_tokens
+        self.train_sampler = None
+        self.add_callback(_EnJaSamplerEpochCallback(self))
+
+    def get_train_sampler(self) -> EnJaTokenBudgetBatchSampler:
+        """The batch sampler of the training set, built on first use."""
+        if self.train_sampler is None:
+            self.train_sampler = EnJaTokenBudgetBatchSampler(
+                EnJaTokenBudgetBatchSampler.get_pair_lengths(self.train_dataset), self.max_tokens,
+                shuffle=True, seed=self.args.seed
+            )
+        return self.train_sampler
+
+    def get_train_dataloader(self) -> DataLoader:
+        assert self.train_dataset is not None, "Trainer: training requires a train_dataset."
+        return EnJaTokenBudgetBatchSampler.get_train_dataloader(self, self.train_dataset, self.get_train_sampler())
+
+
+class _EnJaSamplerEpochCallback(TrainerCallback):
+    def __init__(self, trainer):
+        self.trainer = trainer
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        # state.epoch is fractional when resuming inside an epoch
+        if self.trainer.train_sampler is not None:
+            self.trainer.train_sampler.set_epoch(int(state.epoch or 0))
@@ -3,7 +3,6 @@ import tarfile, os, warnings
 from urllib.request import urlretrieve
 
 # external libraries
-from datasets import load_dataset, enable_progress_bar, disable_progress_bar, Dataset
 from tqdm import TqdmExperimentalWarning
 
 warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
@@ -15,7 +14,7 @@ from .dataset_base import EnJaDataset
 
 class Flores(EnJaDataset):
     DOWNLOAD_URL = r"https://dl.fbaipublicfiles.com/nllb/flores200_dataset.tar.gz"
-    OUT_NAMES = (r"flores.dev.csv", r"flores.devtest.csv")
+    OUT_NAMES = (r"flores.dev.arrow", r"flores.devtest.arrow")
     INFO = (
         "Webpage: https://github.com/facebookresearch/flores/tree/main/flores200\n"
         "Paper  : https://arxiv.org/abs/2207.04672\n"
@@ -32,7 +31,7 @@ class Flores(EnJaDataset):
         output_path2 = (
             f"{EnJaDataset.DATASET_PROCESSED_DIR}/{Flores.OUT_NAMES[1]}"
         )
-        if not force_override and os.path.exists(output_path1) and os.path.exists(output_path2):
+        if not force_override and all(os.path.exists(EnJaDataset.get_processed_path(name)) for name in Flores.OUT_NAMES):
             print(
                 EnJaDataset.SKIPPED_MSG_FORMAT.format(
                     file=Flores.OUT_NAMES
@@ -45,7 +44,7 @@ class Flores(EnJaDataset):
         if not os.path.exists(EnJaDataset.DATASET_PROCESSED_DIR):
             os.makedirs(EnJaDataset.DATASET_PROCESSED_DIR)
             
-        # create csv file
+        # create processed file
         with tarfile.open(
         "./data-raw/flores/flores200_dataset.tar.gz", mode="r"
         ) as tfh:
@@ -59,19 +58,8 @@ class Flores(EnJaDataset):
             # devtest_meta = tfh.extractfile("./flores200_dataset/metadata_devtest.tsv")
             # devtest_meta = pd.read_csv(devtest_meta, sep="\t")
             
-            dev_list = []
-            for ja_l, en_l in zip(dev_ja.readlines(), dev_en.readlines()):
-                dev_list.append({"ja": ja_l.decode("utf-8")[:-1], "en": en_l.decode("utf-8")[:-1]})
-            
-            devtest_list = []
-            for ja_l, en_l in zip(devtest_ja.readlines(), devtest_en.readlines()):
-                devtest_list.append({"ja": ja_l.decode("utf-8")[:-1], "en": en_l.decode("utf-8")[:-1]})
-
-        test = Dataset.from_list(dev_list).rename_columns({"en": "en_sentence", "ja": "ja_sentence"})
-        test.to_csv(output_path1)
-        
-        devtest = Dataset.from_list(devtest_list).rename_columns({"en": "en_sentence", "ja": "ja_sentence"})
-        devtest.to_csv(output_path2)
+            EnJaDataset._write_pairs(output_path1, Flores._iter_pairs(dev_en, dev_ja))
+            EnJaDataset._write_pairs(output_path2, Flores._iter_pairs(devtest_en, devtest_ja))
         return
 
     @staticmethod
@@ -83,19 +71,18 @@ class Flores(EnJaDataset):
     def load(which="devtest"):
         assert which in ["dev", "devtest"], "Invalid sub-dataset"
         outname = Flores.OUT_NAMES[0] if which == "dev" else Flores.OUT_NAMES[1]
-        csv_path = (
-            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{outname}"
-        )
-        if not os.path.exists(csv_path):
+        path = EnJaDataset.get_processed_path(outname)
+        if not os.path.exists(path):
             print(EnJaDataset.MISSING_FILE_FORMAT.format(file=outname))
             Flores.create_csv()
             
-        disable_progress_bar()
-        data = load_dataset("csv", data_files=csv_path, split="train")
-        enable_progress_bar()
-        
-        return data
+        return EnJaDataset.load_processed(path)
+
 
+    @staticmethod
+    def _iter_pairs(en_fh, ja_fh):
+        for en_l, ja_l in zip(en_fh, ja_fh):
+            yield en_l.decode("utf-8")[:-1], ja_l.decode("utf-8")[:-1]
 
     @staticmethod
     def _download_raw(force_download=False):
@@ -1,15 +1,16 @@
 # python libraries
+from itertools import chain
 import os
 
 # external libraries
-from datasets import load_dataset, enable_progress_bar, disable_progress_bar, concatenate_datasets
+from datasets import load_dataset
 
 # local libraries
 from .dataset_base import EnJaDataset
 
 
 class IWSLT2017(EnJaDataset):
-    OUT_NAME = r"iwslt2017.csv"
+    OUT_NAME = r"iwslt2017.arrow"
     INFO = (
         "Webpage    : https://sites.google.com/site/iwsltevaluation2017/TED-tasks\n"
         "Webpage(HF): https://huggingface.co/datasets/iwslt2017\n"
@@ -20,7 +21,7 @@ class IWSLT2017(EnJaDataset):
     @staticmethod
     def create_csv(force_override=False):
         output_path = f"{EnJaDataset.DATASET_PROCESSED_DIR}/{IWSLT2017.OUT_NAME}"
-        if not force_override and os.path.exists(output_path):
+        if not force_override and os.path.exists(EnJaDataset.get_processed_path(IWSLT2017.OUT_NAME)):
             print(
                 EnJaDataset.SKIPPED_MSG_FORMAT.format(
                     file=IWSLT2017.OUT_NAME
@@ -31,17 +32,10 @@ class IWSLT2017(EnJaDataset):
         if not os.path.exists(EnJaDataset.DATASET_PROCESSED_DIR):
             os.makedirs(EnJaDataset.DATASET_PROCESSED_DIR)
         
-        dataset = concatenate_datasets([dataset["train"], dataset["validation"], dataset["test"]])
-        
-        disable_progress_bar()
-        def rearrange(batch):
-            batch["en_sentence"] = batch["translation"]["en"]
-            batch["ja_sentence"] = batch["translation"]["ja"]
-            return batch
-        dataset = dataset.map(rearrange, remove_columns=["translation"], num_proc=EnJaDataset.NUM_PROC)
-        
-        dataset.to_csv(output_path)
-        enable_progress_bar()
+        EnJaDataset._write_pairs(output_path, chain.from_iterable(
+            EnJaDataset._iter_translation_pairs(dataset[split]) 
+            for split in ["train", "validation", "test"]
+        ))
         return
         
 
@@ -52,15 +46,9 @@ class IWSLT2017(EnJaDataset):
     
     @staticmethod
     def load():
-        csv_path = (
-            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{IWSLT2017.OUT_NAME}"
-        )
-        if not os.path.exists(csv_path):
+        path = EnJaDataset.get_processed_path(IWSLT2017.OUT_NAME)
+        if not os.path.exists(path):
             print(EnJaDataset.MISSING_FILE_FORMAT.format(file=IWSLT2017.OUT_NAME))
             IWSLT2017.create_csv()
 
-        disable_progress_bar()
-        data = load_dataset("csv", data_files=csv_path, split="train")
-        enable_progress_bar()
-        
-        return data
\ No newline at end of file
+        return EnJaDataset.load_processed(path)
\ No newline at end of file
@@ -3,7 +3,6 @@ import tarfile, os, warnings
 from urllib.request import urlretrieve
 
 # external libraries
-from datasets import load_dataset, enable_progress_bar, disable_progress_bar
 from tqdm import TqdmExperimentalWarning
 
 warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
@@ -15,7 +14,7 @@ from .dataset_base import EnJaDataset
 
 class JESC(EnJaDataset):
     DOWNLOAD_URL = r"https://nlp.stanford.edu/projects/jesc/data/raw.tar.gz"
-    OUT_NAME = r"jesc.csv"
+    OUT_NAME = r"jesc.arrow"
     INFO = (
         "Webpage: https://nlp.stanford.edu/projects/jesc/\n"
         "Paper  : https://arxiv.org/abs/1710.10639\n"
@@ -28,7 +27,7 @@ class JESC(EnJaDataset):
         output_path = (
             f"{EnJaDataset.DATASET_PROCESSED_DIR}/{JESC.OUT_NAME}"
         )
-        if not force_override and os.path.exists(output_path):
+        if not force_override and os.path.exists(EnJaDataset.get_processed_path(JESC.OUT_NAME)):
             print(
                 EnJaDataset.SKIPPED_MSG_FORMAT.format(
                     file=JESC.OUT_NAME
@@ -38,20 +37,8 @@ class JESC(EnJaDataset):
         JESC._download_raw()
         if not os.path.exists(EnJaDataset.DATASET_PROCESSED_DIR):
             os.makedirs(EnJaDataset.DATASET_PROCESSED_DIR)
-        # create csv file
-        with open(output_path, "wb+") as csv_file:
-            header_str = EnJaDataset.CSV_HEADER_STR
-            csv_file.write(header_str.encode("utf-8"))
-            with tarfile.open(
-                f"{EnJaDataset.DATASET_RAW_DIR}/JESC/raw.tar.gz", mode="r"
-            ) as tfh:
-                with tfh.extractfile("raw/raw") as fh:
-                    while line := fh.readline():
-                        line = line.decode().replace('"', '""')
-                        sep = line.find("\t")
-                        en_s, jp_s = line[:sep], line[sep + 1 : -1]
-                        out_line = f'"{en_s}","{jp_s}"\n'
-                        csv_file.write(out_line.encode("utf-8"))
+        # create processed file
+        EnJaDataset._write_pairs(output_path, JESC._iter_raw_pairs())
         return
 
     @staticmethod
@@ -61,20 +48,25 @@ class JESC(EnJaDataset):
     
     @staticmethod
     def load():
-        csv_path = (
-            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{JESC.OUT_NAME}"
-        )
-        if not os.path.exists(csv_path):
+        path = EnJaDataset.get_processed_path(JESC.OUT_NAME)
+        if not os.path.exists(path):
             print(EnJaDataset.MISSING_FILE_FORMAT.format(file=JESC.OUT_NAME))
             JESC.create_csv()
             
-        disable_progress_bar()
-        data = load_dataset("csv", data_files=csv_path, split="train")
-        enable_progress_bar()
-        
-        return data
+        return EnJaDataset.load_processed(path)
 
 
+    @staticmethod
+    def _iter_raw_pairs():
+        with tarfile.open(
+            f"{EnJaDataset.DATASET_RAW_DIR}/JESC/raw.tar.gz", mode="r"
+        ) as tfh:
+            with tfh.extractfile("raw/raw") as fh:
+                for line in fh:
+                    line = line.decode().rstrip("\n")
+                    sep = line.find("\t")
+                    yield line[:sep], line[sep + 1 :]
+
     @staticmethod
     def _download_raw(force_download=False):
         # check raw file presence
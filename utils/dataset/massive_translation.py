@@ -1,15 +1,16 @@
 # python libraries
+from itertools import chain
 import os
 
 # external libraries
-from datasets import load_dataset, enable_progress_bar, disable_progress_bar, concatenate_datasets
+from datasets import load_dataset
 
 # local libraries
 from .dataset_base import EnJaDataset
 
 
 class MassiveTranslation(EnJaDataset):
-    OUT_NAME = r"massive_translation.csv"
+    OUT_NAME = r"massive_translation.arrow"
     INFO = (
         "Webpage: https://huggingface.co/datasets/Amani27/massive_translation_dataset\n"
         "Summary: dataset derived from AmazonScience/MASSIVE for translation\n"
@@ -19,7 +20,7 @@ class MassiveTranslation(EnJaDataset):
     @staticmethod
     def create_csv(force_override=False):
         output_path = f"{EnJaDataset.DATASET_PROCESSED_DIR}/{MassiveTranslation.OUT_NAME}"
-        if not force_override and os.path.exists(output_path):
+        if not force_override and os.path.exists(EnJaDataset.get_processed_path(MassiveTranslation.OUT_NAME)):
             print(
                 EnJaDataset.SKIPPED_MSG_FORMAT.format(
                     file=MassiveTranslation.OUT_NAME
@@ -31,13 +32,13 @@ class MassiveTranslation(EnJaDataset):
             cache_dir=EnJaDataset.DATASET_RAW_DIR,
         )
         
-        dataset = concatenate_datasets([dataset["train"], dataset["validation"], dataset["test"]])
+        if not os.path.exists(EnJaDataset.DATASET_PROCESSED_DIR):
+            os.makedirs(EnJaDataset.DATASET_PROCESSED_DIR)
         
-        disable_progress_bar()
-        dataset = dataset.remove_columns(["id","split","de_DE","hi_IN","es_ES","fr_FR","it_IT","ar_SA","nl_NL","pt_PT"])
-        dataset = dataset.rename_columns({"en_US" : "en_sentence", "ja_JP" : "ja_sentence"})
-        dataset.to_csv(output_path)
-        enable_progress_bar()
+        EnJaDataset._write_pairs(output_path, chain.from_iterable(
+            MassiveTranslation._iter_pairs(dataset[split]) 
+            for split in ["train", "validation", "test"]
+        ))
         return
 
     @staticmethod
@@ -47,15 +48,14 @@ class MassiveTranslation(EnJaDataset):
 
     @staticmethod
     def load():
-        csv_path = (
-            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{MassiveTranslation.OUT_NAME}"
-        )
-        if not os.path.exists(csv_path):
+        path = EnJaDataset.get_processed_path(MassiveTranslation.OUT_NAME)
+        if not os.path.exists(path):
             print(EnJaDataset.MISSING_FILE_FORMAT.format(file=MassiveTranslation.OUT_NAME))
             MassiveTranslation.create_csv()
             
-        disable_progress_bar()
-        data = load_dataset("csv", data_files=csv_path, split="train")
-        enable_progress_bar()
-        
-        return data
+        return EnJaDataset.load_processed(path)
+
+    @staticmethod
+    def _iter_pairs(dataset):
+        for batch in dataset.iter(batch_size=EnJaDataset.WRITE_BUFFER_SIZE):
+            yield from zip(batch["en_US"], batch["ja_JP"])
@@ -1,15 +1,16 @@
 # python libraries
+from itertools import chain
 import os
 
 # external libraries
-from datasets import load_dataset, enable_progress_bar, disable_progress_bar, concatenate_datasets
+from datasets import load_dataset
 
 # local libraries
 from .dataset_base import EnJaDataset
 
 
 class OPUS100(EnJaDataset):
-    OUT_NAME = r"opus100.csv"
+    OUT_NAME = r"opus100.arrow"
     INFO = (
         "Webpage    : https://github.com/EdinburghNLP/opus-100-corpus\n"
         "Webpage(HF): https://huggingface.co/datasets/opus100\n"
@@ -20,7 +21,7 @@ class OPUS100(EnJaDataset):
     @staticmethod
     def create_csv(force_override=False):
         output_path = f"{EnJaDataset.DATASET_PROCESSED_DIR}/{OPUS100.OUT_NAME}"
-        if not force_override and os.path.exists(output_path):
+        if not force_override and os.path.exists(EnJaDataset.get_processed_path(OPUS100.OUT_NAME)):
             print(
                 EnJaDataset.SKIPPED_MSG_FORMAT.format(
                     file=OPUS100.OUT_NAME
@@ -31,25 +32,18 @@ class OPUS100(EnJaDataset):
         if not os.path.exists(EnJaDataset.DATASET_PROCESSED_DIR):
             os.makedirs(EnJaDataset.DATASET_PROCESSED_DIR)
         
-        dataset = concatenate_datasets([dataset["train"], dataset["validation"], dataset["test"]])
-        
-        disable_progress_bar()
-        def rearrange(batch):
-            batch["en_sentence"] = batch["translation"]["en"]
-            batch["ja_sentence"] = batch["translation"]["ja"]
-            return batch
-        dataset = dataset.map(rearrange, remove_columns=["translation"], num_proc=EnJaDataset.NUM_PROC)
-        def remove_jank(batch):
-            # 1 -> remove jank, 2 -> remove more jank, 3 -> ???
-            # japanese has None or empty string...
-            # jank keeps increasing "n/a" in Japanese ("n/ a" in en) gets loaded as None
-            return len(batch["en_sentence"]) > 2 and len(batch["ja_sentence"]) > 0 \
-                and batch["ja_sentence"] not in ["n/a", "N/A", "なし"]
-        
-        dataset = dataset.filter(remove_jank)
-        
-        dataset.to_csv(output_path)
-        enable_progress_bar()
+        pairs = chain.from_iterable(
+            EnJaDataset._iter_translation_pairs(dataset[split]) 
+            for split in ["train", "validation", "test"]
+        )
+        # 1 -> remove jank, 2 -> remove more jank, 3 -> ???
+        # japanese has None or empty string...
+        # jank keeps increasing "n/a" in Japanese ("n/ a" in en) gets loaded as None
+        EnJaDataset._write_pairs(output_path, (
+            (en_s, ja_s) for en_s, ja_s in pairs
+            if len(en_s) > 2 and ja_s is not None and len(ja_s) > 0
+            and ja_s not in ["n/a", "N/A", "なし"]
+        ))
         return
         
 
@@ -60,15 +54,9 @@ class OPUS100(EnJaDataset):
     
     @staticmethod
     def load():
-        csv_path = (
-            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{OPUS100.OUT_NAME}"
-        )
-        if not os.path.exists(csv_path):
+        path = EnJaDataset.get_processed_path(OPUS100.OUT_NAME)
+        if not os.path.exists(path):
             print(EnJaDataset.MISSING_FILE_FORMAT.format(file=OPUS100.OUT_NAME))
             OPUS100.create_csv()
 
-        disable_progress_bar()
-        data = load_dataset("csv", data_files=csv_path, split="train")
-        enable_progress_bar()
-        
-        return data
\ No newline at end of file
+        return EnJaDataset.load_processed(path)
\ No newline at end of file
@@ -1,15 +1,16 @@
 # python libraries
+from itertools import chain
 import os
 
 # external libraries
-from datasets import load_dataset, enable_progress_bar, disable_progress_bar, concatenate_datasets
+from datasets import load_dataset
 
 # local libraries
 from .dataset_base import EnJaDataset
 
 
 class SnowSimplified(EnJaDataset):
-    OUT_NAME = r"snow_simplified.csv"
+    OUT_NAME = r"snow_simplified.arrow"
     INFO = (
         "Webpage: https://huggingface.co/datasets/snow_simplified_japanese_corpus\n"
         "Summary: Japanese-English sentence pairs, all Japanese sentences have\n"
@@ -19,7 +20,7 @@ class SnowSimplified(EnJaDataset):
     @staticmethod
     def create_csv(force_override=False):
         output_path = f"{EnJaDataset.DATASET_PROCESSED_DIR}/{SnowSimplified.OUT_NAME}"
-        if not force_override and os.path.exists(output_path):
+        if not force_override and os.path.exists(EnJaDataset.get_processed_path(SnowSimplified.OUT_NAME)):
             print(
                 EnJaDataset.SKIPPED_MSG_FORMAT.format(
                     file=SnowSimplified.OUT_NAME
@@ -32,28 +33,11 @@ class SnowSimplified(EnJaDataset):
         if not os.path.exists(EnJaDataset.DATASET_PROCESSED_DIR):
             os.makedirs(EnJaDataset.DATASET_PROCESSED_DIR)
         
-        disable_progress_bar()
-        def ogify(batch):
-            batch["en_sentence"] = batch["original_en"]
-            batch["ja_sentence"] = batch["original_ja"]
-            return batch
-
-        def simpfy(batch):
-            batch["en_sentence"] = batch["original_en"]
-            batch["ja_sentence"] = batch["simplified_ja"]
-            return batch
-
-        dataset_og = dataset.map(
-            ogify, batch_size=1, 
-            remove_columns=["ID", "original_ja", "original_en", "simplified_ja"]
-        )
-        dataset_simp = dataset.map(
-            simpfy, batch_size=1, 
-            remove_columns=["ID", "original_ja", "original_en", "simplified_ja"]
-        )
-        dataset = concatenate_datasets([dataset_og["train"], dataset_simp["train"]])
-        dataset.to_csv(output_path)
-        enable_progress_bar()
+        # original pairs first, then the simplified ones
+        EnJaDataset._write_pairs(output_path, chain(
+            SnowSimplified._iter_pairs(dataset["train"], "original_ja"),
+            SnowSimplified._iter_pairs(dataset["train"], "simplified_ja"),
+        ))
         return
 
     @staticmethod
@@ -63,15 +47,14 @@ class SnowSimplified(EnJaDataset):
     
     @staticmethod
     def load():
-        csv_path = (
-            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{SnowSimplified.OUT_NAME}"
-        )
-        if not os.path.exists(csv_path):
+        path = EnJaDataset.get_processed_path(SnowSimplified.OUT_NAME)
+        if not os.path.exists(path):
             print(EnJaDataset.MISSING_FILE_FORMAT.format(file=SnowSimplified.OUT_NAME))
             SnowSimplified.create_csv()
 
-        disable_progress_bar()
-        data = load_dataset("csv", data_files=csv_path, split="train")
-        enable_progress_bar()
-        
-        return data
+        return EnJaDataset.load_processed(path)
+
+    @staticmethod
+    def _iter_pairs(dataset, ja_column):
+        for batch in dataset.iter(batch_size=EnJaDataset.WRITE_BUFFER_SIZE):
+            yield from zip(batch["original_en"], batch[ja_column])
@@ -2,14 +2,14 @@
 import os
 
 # external libraries
-from datasets import load_dataset, enable_progress_bar, disable_progress_bar
+from datasets import load_dataset
 
 # local libraries
 from .dataset_base import EnJaDataset
 
 
 class Tatoeba(EnJaDataset):
-    OUT_NAME = r"tatoeba.csv"
+    OUT_NAME = r"tatoeba.arrow"
     INFO = (
         "Webpage    : https://opus.nlpl.eu/Tatoeba.php\nWebpage(HF):"
         " https://huggingface.co/datasets/tatoeba\nSummary    : a collection of"
@@ -22,7 +22,7 @@ class Tatoeba(EnJaDataset):
         output_path = (
             f"{EnJaDataset.DATASET_PROCESSED_DIR}/{Tatoeba.OUT_NAME}"
         )
-        if not force_override and os.path.exists(output_path):
+        if not force_override and os.path.exists(EnJaDataset.get_processed_path(Tatoeba.OUT_NAME)):
             print(
                 EnJaDataset.SKIPPED_MSG_FORMAT.format(
                     file=Tatoeba.OUT_NAME
@@ -35,20 +35,11 @@ class Tatoeba(EnJaDataset):
         if not os.path.exists(EnJaDataset.DATASET_PROCESSED_DIR):
             os.makedirs(EnJaDataset.DATASET_PROCESSED_DIR)
 
-        disable_progress_bar()
-        def rearrange(batch):
-            batch["en_sentence"] = batch["translation"]["en"]
-            batch["ja_sentence"] = batch["translation"]["ja"]
-            return batch
-        dataset = dataset.map(rearrange, remove_columns=["translation", "id"])
-        def remove_empty(batch):
-            # removes some empty sentence pairs from the dataset
-            return len(batch["en_sentence"]) > 0
-        
-        dataset = dataset.filter(remove_empty)
-        
-        dataset.to_csv(output_path)
-        enable_progress_bar()
+        # removes some empty sentence pairs from the dataset
+        EnJaDataset._write_pairs(output_path, (
+            (en_s, ja_s) for en_s, ja_s in EnJaDataset._iter_translation_pairs(dataset)
+            if len(en_s) > 0
+        ))
         return
 
     @staticmethod
@@ -58,15 +49,9 @@ class Tatoeba(EnJaDataset):
     
     @staticmethod
     def load():
-        csv_path = (
-            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{Tatoeba.OUT_NAME}"
-        )
-        if not os.path.exists(csv_path):
+        path = EnJaDataset.get_processed_path(Tatoeba.OUT_NAME)
+        if not os.path.exists(path):
             print(EnJaDataset.MISSING_FILE_FORMAT.format(file=Tatoeba.OUT_NAME))
             Tatoeba.create_csv()
 
-        disable_progress_bar()
-        data = load_dataset("csv", data_files=csv_path, split="train")
-        enable_progress_bar()
-        
-        return data
+        return EnJaDataset.load_processed(path)
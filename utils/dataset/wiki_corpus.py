@@ -3,10 +3,10 @@ from typing import Tuple, List
 import warnings, os, re
 from urllib.request import urlretrieve
 from zipfile import ZipFile
-from xml.etree.ElementTree import ParseError, parse as xml_parse
+from xml.etree.ElementTree import ParseError, iterparse
+from multiprocessing import Pool
 
 # external libraries
-from datasets import load_dataset, enable_progress_bar, disable_progress_bar
 from tqdm import TqdmExperimentalWarning
 
 warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
@@ -17,7 +17,7 @@ from .dataset_base import EnJaDataset
 
 
 class WikiCorpus(EnJaDataset):
-    OUT_NAME = r"wiki_corpus.csv"
+    OUT_NAME = r"wiki_corpus.arrow"
     DOWNLOAD_URL = (
         r"https://github.com/venali/BilingualCorpus/archive/refs/heads/master.zip"
     )
@@ -27,11 +27,13 @@ class WikiCorpus(EnJaDataset):
         "          extracted from Wikipedia's Kyoto Articles (~500k sentences)"
     )
 
+    SHARD_SIZE = 64
+
     @staticmethod
-    def create_csv(force_override=False):
+    def create_csv(force_override=False, num_proc=EnJaDataset.NUM_PROC):
         # check processed file presence
         output_path = f"{EnJaDataset.DATASET_PROCESSED_DIR}/{WikiCorpus.OUT_NAME}"
-        if not force_override and os.path.exists(output_path):
+        if not force_override and os.path.exists(EnJaDataset.get_processed_path(WikiCorpus.OUT_NAME)):
             print(
                 EnJaDataset.SKIPPED_MSG_FORMAT.format(
                     file=WikiCorpus.OUT_NAME
@@ -41,37 +43,8 @@ class WikiCorpus(EnJaDataset):
         WikiCorpus._download_raw()
         if not os.path.exists(EnJaDataset.DATASET_PROCESSED_DIR):
             os.makedirs(EnJaDataset.DATASET_PROCESSED_DIR)
-        # create csv file
-        is_xml = re.compile(r"BilingualCorpus-master/wiki_corpus_2.01/[A-Z]{3}/.*\.xml")
-        with open(output_path, "wb+") as csv_file:
-            header_str = EnJaDataset.CSV_HEADER_STR
-            csv_file.write(header_str.encode("utf-8"))
-            with ZipFile(
-                f"{EnJaDataset.DATASET_RAW_DIR}/wiki_corpus/master.zip", mode="r"
-            ) as zhf:
-                file_list = zhf.namelist()
-                progress_bar = tqdm(desc="Parsing XML files", unit=" Files")
-                for file in file_list:
-                    if is_xml.match(file):
-                        with zhf.open(file, "r") as xml_fh:
-                            # if xml parse does not fail add title and sentences
-                            if (
-                                res := WikiCorpus._parse_wiki_corpus_xml(xml_fh)
-                            ) is not None:
-                                (ja_t, en_t), sentences, _ = res
-                                if not (en_t is None or len(en_t) < 2 or ja_t == "なし"):
-                                    en_t = en_t.replace('"', '""')
-                                    ja_t = ja_t.replace('"', "")
-                                    out_line = f'"{en_t}","{ja_t}"\n'
-                                    csv_file.write(out_line.encode("utf-8"))
-                                for ja_s, en_s in sentences:
-                                    if en_s is None or len(en_s) < 2 or ja_s == "なし":
-                                        continue
-                                    en_s = en_s.replace('"', '""')
-                                    ja_s = ja_s.replace('"', "")
-                                    out_line = f'"{en_s}","{ja_s}"\n'
-                                    csv_file.write(out_line.encode("utf-8"))
-                        progress_bar.update(1)
+        # create processed file
+        EnJaDataset._write_pairs(output_path, WikiCorpus._iter_raw_pairs(num_proc=num_proc))
         return
 
     @staticmethod
@@ -81,18 +54,57 @@ class WikiCorpus(EnJaDataset):
     
     @staticmethod
     def load():
-        csv_path = (
-            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{WikiCorpus.OUT_NAME}"
-        )
-        if not os.path.exists(csv_path):
+        path = EnJaDataset.get_processed_path(WikiCorpus.OUT_NAME)
+        if not os.path.exists(path):
             print(EnJaDataset.MISSING_FILE_FORMAT.format(file=WikiCorpus.OUT_NAME))
             WikiCorpus.create_csv()
 
-        disable_progress_bar()
-        data = load_dataset("csv", data_files=csv_path, split="train")
-        enable_progress_bar()
-        
-        return data
+        return EnJaDataset.load_processed(path)
+
+    @staticmethod
+    def _iter_raw_pairs(num_proc=1):
+        zip_path = f"{EnJaDataset.DATASET_RAW_DIR}/wiki_corpus/master.zip"
+        is_xml = re.compile(r"BilingualCorpus-master/wiki_corpus_2.01/[A-Z]{3}/.*\.xml")
+        with ZipFile(zip_path, mode="r") as zhf:
+            file_list = [file for file in zhf.namelist() if is_xml.match(file)]
+        # shards of consecutive files, merged back in file order
+        shards = [
+            (zip_path, file_list[i : i + WikiCorpus.SHARD_SIZE])
+            for i in range(0, len(file_list), WikiCorpus.SHARD_SIZE)
+        ]
+        progress_bar = tqdm(desc="Parsing XML files", unit=" Files", total=len(file_list))
+        if num_proc > 1:
+            with Pool(num_proc) as pool:
+                for nfiles, pairs in pool.imap(WikiCorpus._parse_shard, shards):
+                    yield from pairs
+                    progress_bar.update(nfiles)
+        else:
+            for shard in shards:
+                nfiles, pairs = WikiCorpus._parse_shard(shard)
+                yield from pairs
+                progress_bar.update(nfiles)
+        progress_bar.close()
+
+    @staticmethod
+    def _parse_shard(shard):
+        # each worker opens its own handle, ZipFile objects are not shareable
+        zip_path, files = shard
+        pairs = []
+        with ZipFile(zip_path, mode="r") as zhf:
+            for file in files:
+                with zhf.open(file, "r") as xml_fh:
+                    # if xml parse does not fail add title and sentences
+                    if (res := WikiCorpus._parse_wiki_corpus_xml(xml_fh)) is not None:
+                        (ja_t, en_t), sentences, _ = res
+                        pairs.extend(WikiCorpus._filter_pairs([(ja_t, en_t), *sentences]))
+        return len(files), pairs
+
+    @staticmethod
+    def _filter_pairs(pairs):
+        for ja_s, en_s in pairs:
+            if en_s is None or ja_s is None or len(en_s) < 2 or ja_s == "なし":
+                continue
+            yield en_s, ja_s.replace('"', "")
 
     @staticmethod
     def _download_raw(force_download=False):
@@ -141,31 +153,38 @@ class WikiCorpus(EnJaDataset):
             ((ja_title, en_title), [(ja_sentence_1, en_sentence_1),...], id)
         """
         try:
-            tree = xml_parse(xml_file_path)
-            root = tree.getroot()
-            assert root.get("orl") == "ja" and root.get("trl") == "en"
-            file_id = root.find("inf").text
-            title_data = root.find("tit")
-            title_ja = title_data.find("j").text
-            title_en_data = title_data.findall("e")[-1]
-            assert title_en_data.attrib["type"] == "check"
-            title_en = title_en_data.text
-
-            sentences = root.findall(".//*[@id]")
-            parallel_corpus = []
-            for s in sentences:
+            # incremental parse, sentences are released as soon as they are read
+            depth, title, file_id, parallel_corpus = 0, None, None, []
+            for event, elem in iterparse(xml_file_path, events=("start", "end")):
+                if event == "start":
+                    root = elem if depth == 0 else root
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1 and elem.tag == "inf" and file_id is None:
+                    file_id = elem.text
+                elif depth == 1 and elem.tag == "tit" and title is None:
+                    title_ja = elem.find("j").text
+                    title_en_data = elem.findall("e")[-1]
+                    assert title_en_data.attrib["type"] == "check"
+                    title = (title_ja, title_en_data.text)
+                if depth == 0 or "id" not in elem.attrib:
+                    continue
                 # sec (section) and tit (title) are excluded
-                if s.tag in ["par", "sec", "tit"]:
+                if elem.tag in ["par", "sec", "tit"]:
+                    elem.clear()
                     continue
-                assert s.tag == "sen", f"{s.tag}"
-                source_s = s.find("j").text
-                target_s_data = s.findall("e")[-1]
+                assert elem.tag == "sen", f"{elem.tag}"
+                source_s = elem.find("j").text
+                target_s_data = elem.findall("e")[-1]
                 assert target_s_data.attrib["type"] == "check"
                 target_s = target_s_data.text
+                elem.clear()
                 if source_s is None or target_s is None:
                     continue
                 parallel_corpus.append((source_s, target_s))
-            return (title_ja, title_en), parallel_corpus, file_id
+            assert root.get("orl") == "ja" and root.get("trl") == "en"
+            return title, parallel_corpus, file_id
 
         except ParseError as e:
             if debug:
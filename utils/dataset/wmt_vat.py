@@ -3,7 +3,6 @@ import tarfile, os, warnings
 from urllib.request import urlretrieve
 
 # external libraries
-from datasets import load_dataset, enable_progress_bar, disable_progress_bar, Dataset
 from tqdm import TqdmExperimentalWarning
 
 warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
@@ -24,7 +23,7 @@ class WMTvat(EnJaDataset):
             "ref": r"https://raw.githubusercontent.com/NLP2CT/Variance-Aware-MT-Test-Sets/main/VAT_data/wmt20/vat_newstest2020-jaen-ref.en.txt"
         }
     }
-    OUT_NAMES = (r"wmt_vat.en.ja.csv", r"wmt_vat.ja.en.csv")
+    OUT_NAMES = (r"wmt_vat.en.ja.arrow", r"wmt_vat.ja.en.arrow")
     INFO = (
         "Webpage    : https://huggingface.co/datasets/gsarti/wmt_vat\n"
         "Paper      : https://openreview.net/forum?id=hhKA5k0oVy5"
@@ -41,7 +40,7 @@ class WMTvat(EnJaDataset):
         output_path_jaen = (
             f"{EnJaDataset.DATASET_PROCESSED_DIR}/{WMTvat.OUT_NAMES[1]}"
         )
-        if not force_override and os.path.exists(output_path_jaen) and os.path.exists(output_path_enja):
+        if not force_override and all(os.path.exists(EnJaDataset.get_processed_path(name)) for name in WMTvat.OUT_NAMES):
             print(
                 EnJaDataset.SKIPPED_MSG_FORMAT.format(
                     file=WMTvat.OUT_NAMES
@@ -56,21 +55,15 @@ class WMTvat(EnJaDataset):
         
         csv_dir = f"{EnJaDataset.DATASET_RAW_DIR}/WMT_vat"
         opt = dict(mode="r", encoding="utf-8")
-        # create csv file
-        enja_list = []
+        # create processed file
         with open(f"{csv_dir}/enja-src.en.txt", **opt) as src, open(f"{csv_dir}/enja-ref.ja.txt", **opt) as ref:
-            for en_l, ja_l in zip(src.readlines(), ref.readlines()):
-                enja_list.append({"ja": ja_l[:-1], "en": en_l[:-1]})
-        jaen_list = []
+            EnJaDataset._write_pairs(output_path_enja, (
+                (en_l[:-1], ja_l[:-1]) for en_l, ja_l in zip(src, ref)
+            ))
         with open(f"{csv_dir}/jaen-src.ja.txt", **opt) as src, open(f"{csv_dir}/jaen-ref.en.txt", **opt) as ref:
-            for ja_l, en_l in zip(src.readlines(), ref.readlines()):
-                jaen_list.append({"ja": ja_l[:-1], "en": en_l[:-1]})
-
-        enja = Dataset.from_list(enja_list).rename_columns({"en": "en_sentence", "ja": "ja_sentence"})
-        enja.to_csv(output_path_enja)
-        
-        jaen = Dataset.from_list(jaen_list).rename_columns({"en": "en_sentence", "ja": "ja_sentence"})
-        jaen.to_csv(output_path_jaen)
+            EnJaDataset._write_pairs(output_path_jaen, (
+                (en_l[:-1], ja_l[:-1]) for ja_l, en_l in zip(src, ref)
+            ))
         return
 
     @staticmethod
@@ -82,18 +75,12 @@ class WMTvat(EnJaDataset):
     def load(which):
         assert which in ["en-ja", "ja-en"], "Invalid sub-dataset"
         outname = WMTvat.OUT_NAMES[0] if which == "ja-en" else WMTvat.OUT_NAMES[1]
-        csv_path = (
-            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{outname}"
-        )
-        if not os.path.exists(csv_path):
+        path = EnJaDataset.get_processed_path(outname)
+        if not os.path.exists(path):
             print(EnJaDataset.MISSING_FILE_FORMAT.format(file=outname))
             WMTvat.create_csv()
             
-        disable_progress_bar()
-        data = load_dataset("csv", data_files=csv_path, split="train")
-        enable_progress_bar()
-        
-        return data
+        return EnJaDataset.load_processed(path)
 
 
     @staticmethod
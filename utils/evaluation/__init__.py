@@ -0,0 +1,3 @@
+from .checkpoint_evaluator import EnJaCheckpointEvaluator
+
+__all__ = ["EnJaCheckpointEvaluator"]
@@ -0,0 +1,259 @@
+# python libraries
+from typing import Dict, List, Optional
+import os, json, time, warnings
+
+# external libraries
+import torch
+from datasets import Dataset
+from peft import PeftModel
+from transformers import DataCollatorForSeq2Seq, Seq2SeqTrainer, Seq2SeqTrainingArguments
+from transformers.trainer_utils import speed_metrics
+from tqdm import TqdmExperimentalWarning
+
+warnings.filterwarnings("ignore", category=TqdmExperimentalWarning)
+from tqdm.autonotebook import tqdm
+
+# local libraries
+from ..dataset import Flores, WMTvat, EnJaDatasetMaker, EnJaTokenizationCache, EnJaTokenBudgetBatchSampler
+from ..dataset.dataset_base import EnJaDataset
+from ..metric import SacreBleu, BleuAccumulator
+from ..model import EnJaModelLoader
+
+
+class EnJaCheckpointEvaluator:
+    """Scores every checkpoint of a training run on an evaluation dataset.
+
+    Tokenizers and the base model are loaded once per evaluator, LoRA checkpoints
+    are evaluated by swapping the adapter weights in place, and evaluation
+    datasets are tokenized once and kept in `EnJaTokenizationCache`. A sweep over
+    N checkpoints then costs N generation passes. Scores are saved after each
+    checkpoint to `EVAL_DIR/<run>/<dataset>.json` (keyed by step), already
+    scored checkpoints are skipped.
+
+    With `streaming=True` predictions are scored batch by batch by a
+    `BleuAccumulator` and discarded, memory does not grow with the dataset
+    (e.g. the test split of a dataset of `EnJaDatasetMaker`, see `evaluate_dataset`).
+
+    Parameters
+    ----------
+    model_type : str
+        one of `EnJaModelLoader.MODEL_TYPES`
+    source_language : str
+        the source language (either "en" or "ja")
+    gen_config : dict, optional
+        generation config, by default `EnJaCheckpointEvaluator.GEN_CONFIG`
+    max_batch_tokens : int, optional
+        token budget of a generation batch (see `EnJaTokenBudgetBatchSampler`),
+        by default 8192. If None batches have `per_device_eval_batch_size` rows
+    """
+
+    EVAL_DIR = r"./.eval"
+    EVAL_DATASETS = ["flores_dev", "flores_devtest", "wmt_vat"]
+    GEN_CONFIG = {
+        "max_length" : 256,
+        "early_stopping" : True,
+        "no_repeat_ngram_size" : 4,
+        "length_penalty" : 1.0,
+        "num_beams" : 5
+    }
+
+    def __init__(self, model_type : str, source_language : str, *, gen_config : Optional[dict] = None, max_batch_tokens : Optional[int] = 8192):
+        assert model_type in EnJaModelLoader.MODEL_TYPES, "Invalid model type."
+        assert source_language in ["en", "ja"], "Invalid language."
+        assert max_batch_tokens is None or max_batch_tokens > 0, "Invalid token budget."
+        self.model_type = model_type
+        self.source_language = source_language
+        self.target_language = "ja" if source_language == "en" else "en"
+        self.gen_config = dict(EnJaCheckpointEvaluator.GEN_CONFIG if gen_config is None else gen_config)
+        self.max_batch_tokens = max_batch_tokens
+
+        self.tokenizers = EnJaModelLoader.get_tokenizers(model_type, source_language)
+        self.base_model = EnJaModelLoader.get_base_model(model_type, source_language)
+        self.model, self.trainer = None, None
+
+    def evaluate(self, run : str, dataset_name : str, *, checkpoints : Optional[List[int]] = None, last_only : bool = False, streaming : bool = False) -> Dict[str, dict]:
+        """Scores the checkpoints of `run` on an evaluation dataset.
+
+        Parameters
+        ----------
+        run : str
+            name of the training run (a directory of `EnJaModelLoader.CHECKPOINT_DIR`)
+        dataset_name : str
+            one of `EnJaCheckpointEvaluator.EVAL_DATASETS`
+        checkpoints : List[int], optional
+            steps to evaluate, by default all the checkpoints of the run
+        last_only : bool, optional
+            whenever to evaluate the last checkpoint only, by default False
+        streaming : bool, optional
+            whenever to score predictions batch by batch, by default False
+
+        Returns
+        -------
+        Dict[str, dict]
+            the metrics of each evaluated step (previous results included)
+        """
+        assert dataset_name in EnJaCheckpointEvaluator.EVAL_DATASETS, "Invalid dataset."
+        available = EnJaModelLoader.get_checkpoints(run)
+        checkpoints = available if checkpoints is None else sorted(checkpoints)
+        assert all(step in available for step in checkpoints), "Invalid checkpoints."
+        if last_only:
+            checkpoints = checkpoints[-1:]
+
+        save_dir = f"{EnJaCheckpointEvaluator.EVAL_DIR}/{run}"
+        save_path = f"{save_dir}/{dataset_name}.json"
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        scores = {}
+        if os.path.isfile(save_path): # if exists resume
+            with open(save_path, "r") as fp:
+                scores = json.load(fp)
+
+        dataset = None
+        for step in checkpoints:
+            if str(step) in scores:
+                continue
+            # tokenized (or loaded from cache) only if something is left to score
+            dataset = self.get_eval_dataset(dataset_name) if dataset is None else dataset
+            self._load_checkpoint(run, step)
+            scores[str(step)] = self._predict(dataset, streaming=streaming)
+
+            with open(save_path, "w") as fp:
+                fp.write(json.dumps(scores))
+        return scores
+
+    def evaluate_dataset(self, run : str, step : int, data : Dataset, *, streaming : bool = True) -> dict:
+        """Scores a checkpoint of `run` on a tokenized dataset.
+
+        Parameters
+        ----------
+        run : str
+            name of the training run (a directory of `EnJaModelLoader.CHECKPOINT_DIR`)
+        step : int
+            step of the checkpoint
+        data : Dataset
+            a dataset tokenized by `EnJaDatasetMaker` (e.g. `EnJaDatasetMaker.load_dataset(...)["test"]`)
+        streaming : bool, optional
+            whenever to score predictions batch by batch, by default True
+
+        Returns
+        -------
+        dict
+            the metrics (with the "test_" prefix of `trainer.predict`)
+        """
+        assert step in EnJaModelLoader.get_checkpoints(run), "Invalid checkpoint."
+        self._load_checkpoint(run, step)
+        return self._predict(data, streaming=streaming)
+
+    def get_eval_dataset(self, dataset_name : str) -> Dataset:
+        """Returns the tokenized evaluation dataset, tokenizing it only the first time."""
+        assert dataset_name in EnJaCheckpointEvaluator.EVAL_DATASETS, "Invalid dataset."
+        if dataset_name == "flores_dev":
+            data, out_name = Flores.load("dev"), Flores.OUT_NAMES[0]
+        elif dataset_name == "flores_devtest":
+            data, out_name = Flores.load("devtest"), Flores.OUT_NAMES[1]
+        else: # dataset_name == "wmt_vat"
+            which = f"{self.source_language}-{self.target_language}"
+            data = WMTvat.load(which)
+            out_name = WMTvat.OUT_NAMES[0] if which == "ja-en" else WMTvat.OUT_NAMES[1]
+        path = EnJaDataset.get_processed_path(out_name)
+        data = data.rename_columns({
+            f"{self.source_language}_sentence": "source",
+            f"{self.target_language}_sentence": "target"
+        })
+
+        model_type = "mBART" if self.model_type.startswith("mBART") else "BERT-GPT2"
+        if model_type == "mBART":
+            tokenizers = dict(tokenizer=self.tokenizers["encoder_tokenizer"], encoder_tokenizer=None, decoder_tokenizer=None)
+        else:
+            tokenizers = dict(tokenizer=None, **self.tokenizers)
+        cache_key = EnJaTokenizationCache.get_key(
+            path, model_type=model_type, source_language=self.source_language,
+            tokenizers=[tokenizer for tokenizer in tokenizers.values() if tokenizer is not None]
+        )
+        tokenized = EnJaTokenizationCache.load(cache_key)
+        if tokenized is None:
+            tokenized = EnJaTokenizationCache.store(cache_key, EnJaDatasetMaker._tokenize(
+                data, None, model_type=model_type, **tokenizers,
+                num_proc=1, batched=True, batch_size=1000
+            ), dataset=path)
+        return tokenized
+
+    def _load_checkpoint(self, run, step):
+        path = EnJaModelLoader.get_checkpoint_path(run, step)
+        if self.base_model is None:
+            # whole model checkpoints, nothing to reuse
+            self.model = EnJaModelLoader.get_checkpoint_model(run, step)
+            self.trainer = None
+        elif self.model is None:
+            self.model = PeftModel.from_pretrained(model=self.base_model, model_id=path)
+        else:
+            # same adapter layout, only the LoRA weights change
+            current = self.model.peft_config["default"]
+            config = type(current).from_pretrained(path)
+            assert (config.r, set(config.target_modules)) == (current.r, set(current.target_modules)), f"Invalid checkpoint: {path} has a different LoRA configuration"
+            self.model.load_adapter(path, adapter_name="default")
+        self.model.eval()
+
+        if self.trainer is None:
+            self.trainer = self._get_trainer(self.model)
+        return
+
+    def _predict(self, data, *, streaming):
+        if streaming:
+            return self._predict_streaming(data)
+        if self.max_batch_tokens is None:
+            return self.trainer.predict(data, **self.gen_config).metrics
+        return EnJaTokenBudgetBatchSampler.predict(
+            self.trainer, data, max_tokens=self.max_batch_tokens, **self.gen_config
+        ).metrics
+
+    def _predict_streaming(self, data):
+        assert len(data) > 0, "Invalid data: empty evaluation set."
+        if self.max_batch_tokens is None:
+            dataloader = self.trainer.get_test_dataloader(data)
+        else:
+            sampler = EnJaTokenBudgetBatchSampler(
+                data["length"], self.max_batch_tokens,
+                num_beams=EnJaTokenBudgetBatchSampler.get_num_beams(self.trainer, self.gen_config)
+            )
+            dataloader = EnJaTokenBudgetBatchSampler.get_test_dataloader(self.trainer, data, sampler)
+        accumulator = BleuAccumulator(
+            tokenizer=self.tokenizers["decoder_tokenizer"], target_language=self.target_language
+        )
+
+        start, loss = time.time(), 0.0
+        progress_bar = tqdm(desc="Evaluating", unit=" Sentences", total=len(data))
+        for inputs in dataloader:
+            # the same generation step as trainer.predict, predictions are dropped once scored
+            batch_loss, preds_ids, labels_ids = self.trainer.prediction_step(
+                self.trainer.model, inputs, prediction_loss_only=False, **self.gen_config
+            )
+            accumulator.add_batch(preds_ids.cpu().numpy(), labels_ids.cpu().numpy())
+            loss += batch_loss.item() * len(preds_ids) if batch_loss is not None else 0.0
+            progress_bar.update(len(preds_ids))
+            progress_bar.set_postfix(bleu=f"{accumulator.compute()['score']:.2f}")
+        progress_bar.close()
+
+        metrics = {f"test_{key}": value for key, value in accumulator.compute().items()}
+        metrics["test_loss"] = loss / accumulator.nrows
+        metrics.update(speed_metrics("test", start, num_samples=accumulator.nrows, num_steps=len(dataloader)))
+        return metrics
+
+    def _get_trainer(self, model):
+        tokenizer = self.tokenizers["decoder_tokenizer"]
+        train_args = Seq2SeqTrainingArguments(
+            report_to="none",
+            prediction_loss_only=False,
+            predict_with_generate=True,
+            bf16=torch.cuda.is_available() and torch.cuda.is_bf16_supported(),
+            output_dir=EnJaModelLoader.CHECKPOINT_DIR,
+            length_column_name="length",
+            label_smoothing_factor=0.2,
+            per_device_eval_batch_size=8
+        )
+        return Seq2SeqTrainer(
+            model,
+            args=train_args,
+            data_collator=DataCollatorForSeq2Seq(tokenizer, model=model),
+            compute_metrics=SacreBleu.get_mBART_metric(tokenizer=tokenizer, target_language=self.target_language),
+        )
@@ -0,0 +1,5 @@
+from .memory import EnJaTranslationMemory
+from .translator import EnJaTranslator
+from .server import EnJaTranslationServer
+
+__all__ = ["EnJaTranslationMemory", "EnJaTranslator", "EnJaTranslationServer"]
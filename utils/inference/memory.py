@@ -0,0 +1,178 @@
+# python libraries
+from typing import Callable, Dict, List, Optional, Sequence
+from collections import OrderedDict
+from threading import Lock
+import os, re, json, sqlite3, hashlib, unicodedata
+
+# local libraries
+from ..dataset import EnJaTokenizationCache
+from ..model import EnJaModelLoader
+
+
+class EnJaTranslationMemory:
+    """Translations already generated, looked up before generating again.
+
+    Entries are keyed by a namespace (the model or adapter weights, direction,
+    tokenizers and generation config, see `get_namespace`) and by the source
+    sentence normalised with `normalize` (NFKC, collapsed whitespace), so
+    repeated sentences and sentences differing only in width or spacing share
+    the same translation. The last `capacity` entries used are kept in memory
+    (least recently used are evicted), all entries are kept on disk in a
+    SQLite database if `path` is given. Lookups are counted for `get_report`.
+
+    Parameters
+    ----------
+    path : str, optional
+        SQLite database of the on-disk tier (created if missing), by default
+        None (memory only)
+    capacity : int, optional
+        number of entries of the in-memory tier, by default 100_000
+    """
+
+    # checkpoint files that define the weights, optimizer and trainer states are left out
+    WEIGHT_FILES = re.compile(r"((adapter_)?model|pytorch_model)(-\d+-of-\d+)?\.(bin|safetensors)$|(adapter_)?config\.json$")
+    SQLITE_BATCH_SIZE = 500
+
+    def __init__(self, path : Optional[str] = None, *, capacity : int = 100_000):
+        assert capacity >= 0, "Invalid capacity."
+        self.path = path
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.connection = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # used from the worker thread of `EnJaTranslationServer` as well, access goes through `lock`
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS memory (namespace TEXT, source TEXT, translation TEXT, "
+                "PRIMARY KEY (namespace, source)) WITHOUT ROWID"
+            )
+            self.connection.commit()
+        self.reset_stats()
+
+    @staticmethod
+    def normalize(text : str) -> str:
+        """NFKC normalisation and whitespace collapsing (case is kept, it changes translations)."""
+        return " ".join(unicodedata.normalize("NFKC", text).split())
+
+    @staticmethod
+    def get_namespace(model_type : str, source_language : str, run : Optional[str] = None, step : Optional[int] = None, *, gen_config : dict, tokenizers : List[Callable]) -> str:
+        """Returns the namespace of the translations of a checkpoint.
+
+        Parameters
+        ----------
+        model_type : str
+            one of `EnJaModelLoader.MODEL_TYPES`
+        source_language : str
+            the source language (either "en" or "ja")
+        run : str, optional
+            name of the training run, by default None (the base model)
+        step : int, optional
+            step of the checkpoint, by default the last one of `run`
+        gen_config : dict
+            the generation config
+        tokenizers : List[Callable]
+            the encoder and decoder tokenizers, in order
+
+        Returns
+        -------
+        str
+            a hex digest of the content of the checkpoint weights, the direction,
+            the tokenizers and the generation config
+        """
+        namespace = hashlib.blake2b(digest_size=16)
+        namespace.update(json.dumps({
+            "model_type": model_type,
+            "source_language": source_language,
+            "gen_config": gen_config,
+        }, sort_keys=True, default=str).encode())
+        if run is not None:
+            step = EnJaModelLoader.get_checkpoints(run)[-1] if step is None else step
+            checkpoint = EnJaModelLoader.get_checkpoint_path(run, step)
+            for name in sorted(os.listdir(checkpoint)):
+                if EnJaTranslationMemory.WEIGHT_FILES.match(name):
+                    namespace.update(name.encode())
+                    namespace.update(EnJaTokenizationCache.get_file_hash(f"{checkpoint}/{name}").encode())
+        for tokenizer in tokenizers:
+            namespace.update(EnJaTokenizationCache.get_tokenizer_fingerprint(tokenizer).encode())
+        return namespace.hexdigest()
+
+    def get_many(self, namespace : str, sentences : Sequence[str]) -> List[Optional[str]]:
+        """Returns the known translations of `sentences` (None where missing)."""
+        keys = [EnJaTranslationMemory.normalize(sentence) for sentence in sentences]
+        translations = [None] * len(keys)
+        with self.lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                if (namespace, key) in self.entries:
+                    self.entries.move_to_end((namespace, key))
+                    translations[i] = self.entries[(namespace, key)]
+                    self.nhits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+            if self.connection is not None and len(missing) > 0:
+                found = self._select(namespace, list(missing.keys()))
+                for key, translation in found.items():
+                    for i in missing.pop(key):
+                        translations[i] = translation
+                        self.ndisk_hits += 1
+                    self._remember(namespace, key, translation)
+            self.nmisses += sum(len(indices) for indices in missing.values())
+        return translations
+
+    def put_many(self, namespace : str, sentences : Sequence[str], translations : Sequence[str]) -> None:
+        """Stores the translations of `sentences` (in memory and on disk)."""
+        assert len(sentences) == len(translations), "Invalid translations: lengths differ."
+        rows = {EnJaTranslationMemory.normalize(sentence): translation for sentence, translation in zip(sentences, translations)}
+        with self.lock:
+            for key, translation in rows.items():
+                self._remember(namespace, key, translation)
+            if self.connection is not None and len(rows) > 0:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO memory VALUES (?, ?, ?)",
+                    ((namespace, key, translation) for key, translation in rows.items())
+                )
+                self.connection.commit()
+
+    def get_report(self) -> Dict[str, float]:
+        """Lookups, in-memory hits, on-disk hits, misses, hit rate and in-memory entries."""
+        lookups = self.nhits + self.ndisk_hits + self.nmisses
+        return {
+            "lookups": lookups,
+            "hits": self.nhits,
+            "disk_hits": self.ndisk_hits,
+            "misses": self.nmisses,
+            "hit_rate": (self.nhits + self.ndisk_hits) / max(lookups, 1),
+            "entries": len(self.entries),
+        }
+
+    def reset_stats(self) -> None:
+        """Drops the counters of `get_report`."""
+        self.nhits, self.ndisk_hits, self.nmisses = 0, 0, 0
+
+    def close(self) -> None:
+        """Closes the on-disk tier."""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def _remember(self, namespace, key, translation):
+        if self.capacity == 0:
+            return
+        self.entries[(namespace, key)] = translation
+        self.entries.move_to_end((namespace, key))
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def _select(self, namespace, keys):
+        found = {}
+        for start in range(0, len(keys), EnJaTranslationMemory.SQLITE_BATCH_SIZE):
+            batch = keys[start:start + EnJaTranslationMemory.SQLITE_BATCH_SIZE]
+            found.update(self.connection.execute(
+                f"SELECT source, translation FROM memory WHERE namespace = ? AND source IN ({', '.join('?' * len(batch))})",
+                [namespace, *batch]
+            ).fetchall())
+        return found
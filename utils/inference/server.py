@@ -0,0 +1,285 @@
+# python libraries
+from typing import Dict, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import sys, json, time, asyncio
+
+# external libraries
+import numpy as np
+from aiohttp import web
+
+# local libraries
+from .translator import EnJaTranslator
+
+
+@dataclass
+class EnJaTranslationRequest:
+    """A queued request: its sentences, the future of its translations and its arrival time."""
+    sentences : List[str]
+    future : asyncio.Future
+    arrival : float = field(default_factory=time.perf_counter)
+
+
+class EnJaTranslationServer:
+    """Serves an `EnJaTranslator` to concurrent clients (HTTP or stdio).
+
+    Requests wait in a queue of at most `max_queue_size` requests. A single
+    batching loop takes the first waiting request, then keeps coalescing the
+    following ones while they fit in `max_batch_size` sentences and within
+    `max_wait_ms` milliseconds (a request that does not fit opens the next
+    batch), and translates the whole batch at once (in a worker thread, the
+    event loop keeps accepting requests). When the queue is full, HTTP clients
+    get a 503 response and in-process callers wait for a free slot, stdio
+    reads at most `max_queue_size` lines ahead.
+
+    Latency (arrival to response) of the last `LATENCY_WINDOW` requests is kept
+    for the p50/p95/p99 of `get_report`, exposed by `GET /stats`.
+
+    Parameters
+    ----------
+    translator : EnJaTranslator
+        the loaded translator
+    max_wait_ms : float, optional
+        time a batch waits for more requests after its first one, by default 5
+    max_batch_size : int, optional
+        maximum number of sentences of a batch (a larger request is translated
+        alone), by default 64
+    max_queue_size : int, optional
+        number of requests waiting before new ones are refused, by default 1024
+    """
+
+    LATENCY_WINDOW = 10_000
+
+    def __init__(self, translator : EnJaTranslator, *, max_wait_ms : float = 5.0, max_batch_size : int = 64, max_queue_size : int = 1024):
+        assert max_wait_ms >= 0, "Invalid wait window."
+        assert max_batch_size > 0, "Invalid batch size."
+        assert max_queue_size > 0, "Invalid queue size."
+        self.translator = translator
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.max_queue_size = max_queue_size
+        self.queue, self.worker, self.executor, self.held = None, None, None, None
+        self.reset_stats()
+
+    async def start(self) -> None:
+        """Starts the batching loop (in the running event loop)."""
+        if self.worker is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        # one model, one generation at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.worker = asyncio.create_task(self._batch_loop())
+
+    async def stop(self) -> None:
+        """Stops the batching loop, waiting requests are cancelled."""
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        if self.held is not None:
+            self.held.future.cancel()
+        while not self.queue.empty():
+            self.queue.get_nowait().future.cancel()
+        self.executor.shutdown(wait=True)
+        self.queue, self.worker, self.executor, self.held = None, None, None, None
+
+    async def translate(self, sentences : List[str], *, block : bool = True) -> List[str]:
+        """Queues a request and waits for its translations.
+
+        Parameters
+        ----------
+        sentences : List[str]
+            sentences in the source language of the translator
+        block : bool, optional
+            whenever to wait for a free slot when the queue is full, by default
+            True. If False `asyncio.QueueFull` is raised instead
+
+        Returns
+        -------
+        List[str]
+            the translations, in the same order
+        """
+        assert self.worker is not None, "Server not started."
+        request = EnJaTranslationRequest(list(sentences), asyncio.get_running_loop().create_future())
+        if block:
+            await self.queue.put(request)
+        else:
+            self.queue.put_nowait(request)
+        return await request.future
+
+    def get_report(self) -> Dict[str, float]:
+        """Requests, sentences and batches served, sentences/sec since the first
+        request, mean batch size, queued requests, latency (p50, p95, p99, max)
+        in milliseconds of the last `LATENCY_WINDOW` requests and, if the
+        translator has one, the translation memory counters (prefixed "memory_")."""
+        report = {
+            "requests": self.nrequests,
+            "sentences": self.nsentences,
+            "batches": self.nbatches,
+            "rejected": self.nrejected,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "mean_batch_size": self.nsentences / max(self.nbatches, 1),
+            "sentences_per_sec": self.nsentences / max(time.perf_counter() - self.start_time, 1e-9) if self.start_time is not None else 0.0,
+        }
+        if len(self.latency) > 0:
+            latency = np.array(self.latency) * 1000
+            report.update({
+                "latency_p50_ms": np.percentile(latency, 50),
+                "latency_p95_ms": np.percentile(latency, 95),
+                "latency_p99_ms": np.percentile(latency, 99),
+                "latency_max_ms": latency.max(),
+            })
+        if self.translator.memory is not None:
+            report.update({f"memory_{name}": value for name, value in self.translator.memory.get_report().items()})
+        return report
+
+    def reset_stats(self) -> None:
+        """Drops the counters and latencies of `get_report`."""
+        self.nrequests, self.nsentences, self.nbatches, self.nrejected = 0, 0, 0, 0
+        self.latency = deque(maxlen=EnJaTranslationServer.LATENCY_WINDOW)
+        self.start_time = None
+
+    def get_http_app(self) -> web.Application:
+        """The aiohttp application: `POST /translate` with {"sentences": [...]} (or
+        {"text": "..."}) answers {"translations": [...]} (or {"translation": "..."}),
+        `GET /stats` answers `get_report()`. The batching loop runs with the app."""
+        app = web.Application()
+        app.router.add_post("/translate", self._handle_translate)
+        app.router.add_get("/stats", self._handle_stats)
+
+        async def on_startup(app):
+            await self.start()
+
+        async def on_cleanup(app):
+            await self.stop()
+
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+        return app
+
+    async def serve_http(self, host : str = "127.0.0.1", port : int = 8080) -> None:
+        """Serves HTTP requests until cancelled."""
+        runner = web.AppRunner(self.get_http_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        print(f"serving: http://{host}:{port} (POST /translate, GET /stats)", file=sys.stderr)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    async def serve_stdio(self) -> None:
+        """Serves json lines from stdin until it is closed: each line {"id": ...,
+        "sentences": [...]} (or "text") is answered on stdout by {"id": ...,
+        "translations": [...]} (or "translation"), in completion order."""
+        await self.start()
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        async def answer(line):
+            try:
+                request = json.loads(line)
+                response = {"id": request.get("id"), **await self._answer(request, block=True)}
+            except (ValueError, AttributeError) as e:
+                response = {"error": str(e)}
+            sys.stdout.write(json.dumps(response, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+
+        # a line is read once a slot is free, at most `max_queue_size` lines are pending
+        slots, tasks = asyncio.Semaphore(self.max_queue_size), set()
+        try:
+            while True:
+                await slots.acquire()
+                if not (line := await reader.readline()):
+                    break
+                if not line.strip():
+                    slots.release()
+                    continue
+                task = asyncio.create_task(answer(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: slots.release())
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            await self.stop()
+
+    async def _answer(self, request : dict, *, block : bool) -> dict:
+        if not isinstance(request, dict) or ("text" in request) == ("sentences" in request):
+            raise ValueError('Invalid request: expected {"sentences": [...]} or {"text": "..."}.')
+        if "text" in request:
+            if not isinstance(request["text"], str):
+                raise ValueError('Invalid request: "text" must be a string.')
+            return {"translation": (await self.translate([request["text"]], block=block))[0]}
+        if not isinstance(request["sentences"], list) or not all(isinstance(s, str) for s in request["sentences"]):
+            raise ValueError('Invalid request: "sentences" must be a list of strings.')
+        return {"translations": await self.translate(request["sentences"], block=block)}
+
+    async def _handle_translate(self, http_request : web.Request) -> web.Response:
+        try:
+            request = await http_request.json()
+            return web.json_response(await self._answer(request, block=False), dumps=EnJaTranslationServer._dumps)
+        except asyncio.QueueFull:
+            self.nrejected += 1
+            return web.json_response({"error": "queue full"}, status=503, headers={"Retry-After": "1"})
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+
+    async def _handle_stats(self, http_request : web.Request) -> web.Response:
+        return web.json_response(self.get_report())
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # a request held back by the previous batch opens this one
+            batch = [self.held if self.held is not None else await self.queue.get()]
+            self.held = None
+            nsentences = len(batch[0].sentences)
+            # coalesce the requests arriving within the wait window
+            deadline = loop.time() + self.max_wait
+            while nsentences < self.max_batch_size:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        request = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    request = self.queue.get_nowait()
+                if nsentences + len(request.sentences) > self.max_batch_size:
+                    # the queue may be full again, the request waits here for the next batch
+                    self.held = request
+                    break
+                batch.append(request)
+                nsentences += len(request.sentences)
+
+            sentences = [sentence for request in batch for sentence in request.sentences]
+            try:
+                translations = await loop.run_in_executor(self.executor, self.translator.translate, sentences)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                continue
+
+            end, offset = time.perf_counter(), 0
+            self.start_time = batch[0].arrival if self.start_time is None else self.start_time
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_result(translations[offset : offset + len(request.sentences)])
+                offset += len(request.sentences)
+                self.latency.append(end - request.arrival)
+            self.nrequests += len(batch)
+            self.nsentences += len(sentences)
+            self.nbatches += 1
+
+    @staticmethod
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False)
@@ -0,0 +1,186 @@
+# python libraries
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from itertools import islice
+import os, time
+
+# external libraries
+import numpy as np
+import torch
+from peft import PeftModel
+
+# local libraries
+from ..dataset import EnJaTokenBudgetBatchSampler
+from ..evaluation import EnJaCheckpointEvaluator
+from ..model import EnJaModelLoader
+from .memory import EnJaTranslationMemory
+
+
+class EnJaTranslator:
+    """Translates sentences with a trained checkpoint, outside of a trainer.
+
+    Tokenizers, the base model and the checkpoint (LoRA adapters or a whole
+    model) are loaded once, a checkpoint exported with merged adapters (see
+    `EnJaModelLoader.save_merged_checkpoint`) is used instead if there is one. Each call tokenizes the sentences, groups them in
+    length-sorted micro-batches of at most `max_batch_tokens` padded tokens (beams
+    included, see `EnJaTokenBudgetBatchSampler`) and generates batch by batch
+    with `model.generate`. Translations are returned in input order. Rows, tokens
+    and latency of each batch are kept in `stats` (see `get_report`). With a
+    `memory`, sentences translated before (by the same checkpoint and generation
+    config) are looked up instead of generated, and repeated sentences of a call
+    are generated once.
+
+    Runs on the GPU if there is one (in bfloat16 when supported), otherwise on
+    the CPU in float32.
+
+    Parameters
+    ----------
+    model_type : str
+        one of `EnJaModelLoader.MODEL_TYPES`
+    source_language : str
+        the source language (either "en" or "ja")
+    run : str, optional
+        name of the training run (a directory of `EnJaModelLoader.CHECKPOINT_DIR`),
+        by default None (the base model, mBART types only)
+    step : int, optional
+        step of the checkpoint, by default the last one of `run`
+    gen_config : dict, optional
+        generation config, by default `EnJaCheckpointEvaluator.GEN_CONFIG`
+    max_batch_tokens : int, optional
+        token budget of a batch, beams included, by default 8192
+    max_batch_size : int, optional
+        upper bound on the number of rows of a batch, by default 64
+    device : str, optional
+        torch device, by default "cuda" if available else "cpu"
+    memory : EnJaTranslationMemory, optional
+        translation memory, by default None
+    """
+
+    def __init__(self, model_type : str, source_language : str, run : Optional[str] = None, step : Optional[int] = None, *, gen_config : Optional[dict] = None, max_batch_tokens : int = 8192, max_batch_size : Optional[int] = 64, device : Optional[str] = None, memory : Optional[EnJaTranslationMemory] = None):
+        assert model_type in EnJaModelLoader.MODEL_TYPES, "Invalid model type."
+        assert source_language in ["en", "ja"], "Invalid language."
+        assert run is not None or model_type.startswith("mBART"), "Invalid run: BERT-GPT2 models need a checkpoint."
+        assert max_batch_tokens > 0, "Invalid token budget."
+        self.model_type = model_type
+        self.source_language = source_language
+        self.target_language = "ja" if source_language == "en" else "en"
+        self.gen_config = dict(EnJaCheckpointEvaluator.GEN_CONFIG if gen_config is None else gen_config)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+
+        tokenizers = EnJaModelLoader.get_tokenizers(model_type, source_language)
+        self.encoder_tokenizer = tokenizers["encoder_tokenizer"]
+        self.decoder_tokenizer = tokenizers["decoder_tokenizer"]
+        self.model = EnJaTranslator._load_model(model_type, source_language, run, step)
+        if self.device.type == "cuda" and torch.cuda.is_bf16_supported():
+            self.model = self.model.to(torch.bfloat16)
+        self.model = self.model.to(self.device).eval()
+        self.stats = []
+        self.memory = memory
+        self.namespace = EnJaTranslationMemory.get_namespace(
+            model_type, source_language, run, step,
+            gen_config=self.gen_config, tokenizers=[self.encoder_tokenizer, self.decoder_tokenizer]
+        ) if memory is not None else None
+
+    def translate(self, sentences : Sequence[str]) -> List[str]:
+        """Translates a list of sentences, the batches are recorded in `stats`.
+
+        Parameters
+        ----------
+        sentences : Sequence[str]
+            sentences in the source language
+
+        Returns
+        -------
+        List[str]
+            the translations, in the same order
+        """
+        self.stats = []
+        return self._translate(sentences)
+
+    def translate_iter(self, sentences : Iterable[str], *, chunk_size : int = 512) -> Iterator[str]:
+        """Translates a stream of sentences (e.g. the lines of a file) `chunk_size`
+        at a time, translations are yielded in input order as soon as their chunk
+        is done. The batches are recorded in `stats`."""
+        assert chunk_size > 0, "Invalid chunk size."
+        self.stats = []
+        sentences = iter(sentences)
+        while chunk := list(islice(sentences, chunk_size)):
+            yield from self._translate(chunk)
+
+    def get_report(self) -> Dict[str, float]:
+        """Summary of the batches in `stats`: sentences, batches, time spent in the
+        batches, sentences/sec and batch latency (mean, p50, p95, max) in milliseconds."""
+        assert len(self.stats) > 0, "Nothing was translated."
+        latency = np.array([batch["latency"] for batch in self.stats]) * 1000
+        nrows = sum(batch["rows"] for batch in self.stats)
+        return {
+            "sentences": nrows,
+            "batches": len(self.stats),
+            "time": latency.sum() / 1000,
+            "sentences_per_sec": nrows / max(latency.sum() / 1000, 1e-9),
+            "latency_mean_ms": latency.mean(),
+            "latency_p50_ms": np.percentile(latency, 50),
+            "latency_p95_ms": np.percentile(latency, 95),
+            "latency_max_ms": latency.max(),
+        }
+
+    def _translate(self, sentences):
+        if self.memory is None:
+            return self._generate(sentences)
+        translations = self.memory.get_many(self.namespace, sentences)
+        # sentences missing from the memory, repeated ones are generated once
+        missing = {}
+        for i, translation in enumerate(translations):
+            if translation is None:
+                missing.setdefault(EnJaTranslationMemory.normalize(sentences[i]), []).append(i)
+        sources = [sentences[indices[0]] for indices in missing.values()]
+        generated = self._generate(sources)
+        self.memory.put_many(self.namespace, sources, generated)
+        for indices, translation in zip(missing.values(), generated):
+            for i in indices:
+                translations[i] = translation
+        return translations
+
+    def _generate(self, sentences):
+        if len(sentences) == 0:
+            return []
+        input_ids = self.encoder_tokenizer(
+            list(sentences), truncation=True, return_attention_mask=False, return_token_type_ids=False
+        )["input_ids"]
+        sampler = EnJaTokenBudgetBatchSampler(
+            [len(ids) for ids in input_ids], self.max_batch_tokens,
+            num_beams=self.gen_config.get("num_beams", 1), max_batch_size=self.max_batch_size
+        )
+        translations = [None] * len(sentences)
+        for batch in sampler:
+            start = time.perf_counter()
+            inputs = self.encoder_tokenizer.pad(
+                {"input_ids": [input_ids[i] for i in batch]}, return_tensors="pt"
+            ).to(self.device)
+            with torch.inference_mode():
+                outputs = self.model.generate(**inputs, **self.gen_config)
+            decoded = self.decoder_tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            self.stats.append({
+                "rows": len(batch),
+                "tokens": int(inputs["attention_mask"].sum()),
+                "latency": time.perf_counter() - start,
+            })
+            for i, translation in zip(batch, decoded):
+                translations[i] = translation
+        return translations
+
+    @staticmethod
+    def _load_model(model_type, source_language, run, step):
+        if run is not None:
+            step = EnJaModelLoader.get_checkpoints(run)[-1] if step is None else step
+            if os.path.isdir(EnJaModelLoader.get_merged_path(run, step)):
+                # adapters already merged into the base model (see merge_lora.py)
+                return EnJaModelLoader.get_merged_model(run, step)
+        base_model = EnJaModelLoader.get_base_model(model_type, source_language)
+        if run is None:
+            return base_model
+        if base_model is None:
+            # whole model checkpoints
+            return EnJaModelLoader.get_checkpoint_model(run, step)
+        return PeftModel.from_pretrained(model=base_model, model_id=EnJaModelLoader.get_checkpoint_path(run, step))
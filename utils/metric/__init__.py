@@ -1,3 +1,5 @@
 from .sacrebleu import SacreBleu
+from .bleu_accumulator import BleuAccumulator
+from .ngram_metrics import NgramMetrics
 
-__all__ = ["SacreBleu"]
\ No newline at end of file
+__all__ = ["SacreBleu", "BleuAccumulator", "NgramMetrics"]
\ No newline at end of file
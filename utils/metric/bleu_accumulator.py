@@ -0,0 +1,55 @@
+# python libraries
+from typing import Dict, List, Union
+
+# external libraries
+import numpy as np
+
+# local libraries
+from .sacrebleu import SacreBleu
+
+
+class BleuAccumulator:
+    """Corpus BLEU accumulated batch by batch from sufficient statistics.
+
+    Each batch of predictions is decoded, tokenized (segmented with MeCab for
+    japanese) and reduced to its n-gram match statistics (sys_len, ref_len,
+    matches and totals per order), then the text is discarded. Memory does not
+    depend on the number of evaluated rows and the running score is available at
+    any time. The final score equals `SacreBleu` on all the rows at once.
+
+    Parameters
+    ----------
+    tokenizer : Callable
+        the huggingface tokenizer used to decode predictions and labels
+    target_language : str
+        the target language (either "en" or "ja")
+    num_proc : int, optional
+        number of MeCab workers for japanese batches, by default `SacreBleu.NUM_PROC`
+    """
+
+    def __init__(self, *, tokenizer=None, target_language: str = None, num_proc: int = SacreBleu.NUM_PROC):
+        self.metric = SacreBleu(tokenizer=tokenizer, target_language=target_language, num_proc=num_proc)
+        self.reset()
+
+    def add_batch(self, preds_ids: np.ndarray, labels_ids: np.ndarray) -> None:
+        """Adds the statistics of a batch of generated and reference token ids (-100 is padding)."""
+        assert len(preds_ids) == len(labels_ids), "Predictions and labels have different sizes."
+        if len(preds_ids) == 0:
+            return
+        predictions, references = self.metric.decode(preds_ids), self.metric.decode(labels_ids)
+        if self.metric.segmenter is not None:
+            predictions, references = self.metric.segment(predictions), self.metric.segment(references)
+        stats = self.metric.bleu._extract_corpus_statistics(predictions, [references])
+        self.stats += np.sum(stats, axis=0, dtype=np.int64)
+        self.nrows += len(predictions)
+
+    def compute(self) -> Dict[str, Union[float, List]]:
+        """Returns the BLEU of the rows added so far, with the same keys as `SacreBleu`."""
+        assert self.nrows > 0, "No batch was added."
+        return SacreBleu._to_dict(self.metric.bleu._compute_score_from_stats(self.stats.tolist()))
+
+    def reset(self) -> None:
+        """Drops the accumulated statistics."""
+        # [sys_len, ref_len, matches per order..., totals per order...]
+        self.stats = np.zeros(2 + 2 * self.metric.bleu.max_ngram_order, dtype=np.int64)
+        self.nrows = 0
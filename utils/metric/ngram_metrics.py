@@ -0,0 +1,161 @@
+# python libraries
+from typing import Dict, List, Tuple, Union
+
+# external libraries
+import numpy as np
+import xxhash
+from sacrebleu.metrics import CHRF
+
+# local libraries
+from .sacrebleu import SacreBleu
+
+
+class NgramMetrics:
+    """BLEU, chrF and chrF++ of generated token ids from a single n-gram counting pass,
+    usable as `compute_metrics` of a huggingface trainer (a drop-in replacement of
+    `SacreBleu.get_mBART_metric`, with "chrf" and "chrf++" in the output).
+
+    Sentences are turned into arrays of units (BLEU tokens, characters and chrF++
+    words), n-grams of every order are hashed with a rolling 64-bit hash salted by
+    the sentence index, and counted for the whole corpus at once with `np.unique`.
+    Matches are clipped counts of the keys shared by hypotheses and references.
+    Statistics, and therefore scores, are the ones of sacrebleu's `BLEU` ("13a",
+    "ja-mecab" for japanese), `CHRF()` and `CHRF(word_order=2)` (up to 64-bit hash
+    collisions). References are decoded, tokenized and counted once per evaluation
+    set, keyed by a hash of the label ids.
+
+    Parameters
+    ----------
+    tokenizer : Callable
+        the huggingface tokenizer used to decode predictions and labels
+    target_language : str
+        the target language (either "en" or "ja")
+    num_proc : int, optional
+        number of MeCab workers for japanese hypotheses, by default `SacreBleu.NUM_PROC`
+    """
+
+    CHAR_ORDER = 6
+    WORD_ORDER = 2
+    HASH_MULT = np.uint64(0x9E3779B97F4A7C15)
+    HASH_SALT = np.uint64(0x632BE59BD9B4E019)
+
+    def __init__(self, *, tokenizer=None, target_language: str = None, num_proc: int = SacreBleu.NUM_PROC):
+        # decoding, BLEU tokenization (or MeCab segmentation) and the BLEU formula
+        self.metric = SacreBleu(tokenizer=tokenizer, target_language=target_language, num_proc=num_proc)
+        self.bleu_order = self.metric.bleu.max_ngram_order
+        # chrF formulas only, statistics are computed here
+        self.chrf = CHRF(char_order=NgramMetrics.CHAR_ORDER, word_order=0)
+        self.chrf_pp = CHRF(char_order=NgramMetrics.CHAR_ORDER, word_order=NgramMetrics.WORD_ORDER)
+        self.reference_cache = {}
+
+    @staticmethod
+    def get_mBART_metric(*, tokenizer=None, target_language: str = None) -> "NgramMetrics":
+        """Returns the BLEU/chrF/chrF++ `compute_metrics` of a seq2seq trainer (`predict_with_generate=True`)."""
+        return NgramMetrics(tokenizer=tokenizer, target_language=target_language)
+
+    def __call__(self, preds: Tuple[np.ndarray, np.ndarray]) -> Dict[str, Union[float, List]]:
+        """Computes BLEU, chrF and chrF++ of an `EvalPrediction` (or a (predictions, label_ids) tuple).
+
+        Returns
+        -------
+        Dict[str, Union[float, List]]
+            the keys of `SacreBleu` (score is BLEU), "chrf" and "chrf++"
+        """
+        preds_ids, labels_ids = preds
+        hypotheses = self.metric.decode(preds_ids)
+        if self.metric.segmenter is not None:
+            tokenized = self.metric.segment(hypotheses)
+        else:
+            tokenized = [self.metric.bleu._preprocess_segment(hypothesis) for hypothesis in hypotheses]
+        hyp = self._get_ngrams(hypotheses, tokenized)
+        ref = self._get_reference_ngrams(labels_ids)
+
+        # BLEU, [sys_len, ref_len, matches per order..., totals per order...]
+        bleu_stats = [int(hyp["bleu"][0].sum()), int(ref["bleu"][0].sum())]
+        bleu_stats += NgramMetrics._count_matches(hyp["bleu"], ref["bleu"])
+        bleu_stats += [int(np.maximum(hyp["bleu"][0] - n + 1, 0).sum()) for n in range(1, self.bleu_order + 1)]
+        # chrF, [hyp, ref, matches] per order, character orders first
+        chrf_stats = NgramMetrics._get_chrf_statistics(hyp["char"], ref["char"])
+        word_stats = NgramMetrics._get_chrf_statistics(hyp["word"], ref["word"])
+
+        output = SacreBleu._to_dict(self.metric.bleu._compute_score_from_stats(bleu_stats))
+        output["chrf"] = self.chrf._compute_score_from_stats(chrf_stats).score
+        output["chrf++"] = self.chrf_pp._compute_score_from_stats(chrf_stats + word_stats).score
+        return output
+
+    def _get_reference_ngrams(self, labels_ids):
+        labels_ids = np.ascontiguousarray(labels_ids)
+        key = (labels_ids.dtype.str, labels_ids.shape, xxhash.xxh3_128_hexdigest(labels_ids))
+        if key not in self.reference_cache:
+            references = self.metric.decode(labels_ids)
+            if self.metric.segmenter is not None:
+                tokenized = self.metric._get_segmented_references(references)
+            else:
+                tokenized = [self.metric.bleu._preprocess_segment(reference) for reference in references]
+            self.reference_cache[key] = self._get_ngrams(references, tokenized)
+        return self.reference_cache[key]
+
+    def _get_ngrams(self, sentences, tokenized):
+        # sacrebleu's chrF drops whitespace and splits punctuation off chrF++ words
+        chars = ["".join(sentence.split()) for sentence in sentences]
+        words = [self.chrf_pp._remove_punctuation(sentence) for sentence in sentences]
+        tokens = [sentence.split() for sentence in tokenized]
+        return {
+            "bleu": NgramMetrics._count_ngrams(*NgramMetrics._get_word_units(tokens), self.bleu_order),
+            "char": NgramMetrics._count_ngrams(*NgramMetrics._get_char_units(chars), NgramMetrics.CHAR_ORDER),
+            "word": NgramMetrics._count_ngrams(*NgramMetrics._get_word_units(words), NgramMetrics.WORD_ORDER),
+        }
+
+    @staticmethod
+    def _get_char_units(chars):
+        lengths = np.fromiter(map(len, chars), dtype=np.int64, count=len(chars))
+        units = np.frombuffer("".join(chars).encode("utf-32-le"), dtype=np.uint32)
+        return units.astype(np.uint64), lengths
+
+    @staticmethod
+    def _get_word_units(words):
+        lengths = np.fromiter(map(len, words), dtype=np.int64, count=len(words))
+        units = np.fromiter(
+            (hash(word) for sentence in words for word in sentence), dtype=np.int64, count=int(lengths.sum())
+        )
+        return units.view(np.uint64), lengths
+
+    @staticmethod
+    def _count_ngrams(units, lengths, max_order):
+        """Returns the units per sentence and, for each order, the sorted n-gram keys
+        (n-gram hash salted by the sentence index) with their counts."""
+        sentence = np.repeat(np.arange(len(lengths), dtype=np.uint64), lengths)
+        end = np.cumsum(lengths)[sentence.astype(np.int64)]
+        start = np.arange(len(units))
+        units = units * NgramMetrics.HASH_MULT + NgramMetrics.HASH_SALT
+        ngrams, hashes = [], np.zeros(len(units), dtype=np.uint64)
+        for n in range(1, max_order + 1):
+            size = max(len(units) - n + 1, 0)
+            # hash of units[i : i + n], kept only if it does not cross a sentence end
+            hashes = hashes[:size] * NgramMetrics.HASH_MULT + units[n - 1 :]
+            inside = start[:size] + n <= end[:size]
+            keys = (hashes[inside] ^ sentence[:size][inside]) * NgramMetrics.HASH_MULT
+            ngrams.append(np.unique(keys, return_counts=True))
+        return lengths, ngrams
+
+    @staticmethod
+    def _count_matches(hyp, ref):
+        matches = []
+        for (hyp_keys, hyp_counts), (ref_keys, ref_counts) in zip(hyp[1], ref[1]):
+            if len(ref_keys) == 0 or len(hyp_keys) == 0:
+                matches.append(0)
+                continue
+            index = np.minimum(np.searchsorted(ref_keys, hyp_keys), len(ref_keys) - 1)
+            found = ref_keys[index] == hyp_keys
+            matches.append(int(np.minimum(hyp_counts[found], ref_counts[index[found]]).sum()))
+        return matches
+
+    @staticmethod
+    def _get_chrf_statistics(hyp, ref):
+        stats = []
+        matches = NgramMetrics._count_matches(hyp, ref)
+        for n, match in enumerate(matches, start=1):
+            hyp_total, ref_total = np.maximum(hyp[0] - n + 1, 0), np.maximum(ref[0] - n + 1, 0)
+            # as sacrebleu, hypothesis n-grams are not counted if the reference has none
+            stats += [int(hyp_total[ref_total > 0].sum()), int(ref_total.sum()), match]
+        return stats
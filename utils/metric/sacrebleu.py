@@ -1,44 +1,177 @@
-import evaluate
+# python libraries
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+import os, json
+from multiprocessing import Pool
+
+# external libraries
+import numpy as np
+import xxhash
+from sacrebleu.metrics import BLEU
+
 
 class SacreBleu:
-    
-    def get_mBART_metric(*, tokenizer=None, target_language: str=None):
+    """Corpus BLEU of generated token ids, usable as `compute_metrics` of a huggingface trainer.
+
+    The sacrebleu tokenizer ("ja-mecab" for japanese, "13a" otherwise) is built
+    once. Decoded references and their n-grams are cached per evaluation set (keyed
+    by a hash of the label ids), so repeated evaluations of the same set only decode
+    and tokenize the predictions. Arrays passed by the trainer are never modified.
+
+    Japanese text is segmented with MeCab before scoring (as sacrebleu's "ja-mecab"
+    does): references are segmented once per evaluation set and memoized in memory
+    and in `SEGMENTATION_CACHE_DIR` (keyed by a hash of their content), hypotheses
+    are segmented by a pool of `num_proc` workers when there are at least
+    `PARALLEL_MIN_ROWS` of them.
+
+    Parameters
+    ----------
+    tokenizer : Callable
+        the huggingface tokenizer used to decode predictions and labels
+    target_language : str
+        the target language (either "en" or "ja")
+    num_proc : int, optional
+        number of MeCab workers for japanese hypotheses, by default `SacreBleu.NUM_PROC`
+    """
+
+    TOKENIZE = {"en": "13a", "ja": "ja-mecab"}
+    NUM_PROC = 4
+    PARALLEL_MIN_ROWS = 4096
+    SEGMENTATION_CACHE_DIR = r"./.cache/mecab"
+    # content hash : segmented references, shared by all the metric objects of a process
+    _segmentation_memo = {}
+    _worker_segmenter = None
+
+    def __init__(self, *, tokenizer=None, target_language: str = None, num_proc: int = NUM_PROC):
         assert tokenizer is not None and hasattr(tokenizer, "__call__"), "Object passed is not a valid tokenizer!"
         assert target_language is not None and target_language in ["en", "ja"], "Invalid language."
-        metric = evaluate.load("sacrebleu")
-        
+        assert num_proc > 0, "Invalid number of workers."
+        self.tokenizer = tokenizer
+        self.target_language = target_language
+        self.num_proc = num_proc
         if target_language == "ja":
-            def compute_metrics(preds):
-                preds_ids, labels_ids = preds
-                
-                preds_ids[preds_ids == -100] = tokenizer.pad_token_id
-                labels_ids[labels_ids == -100] = tokenizer.pad_token_id
-                references = tokenizer.batch_decode(labels_ids, skip_special_tokens=True)
-                references = [[reference] for reference in references]
-
-                predictions = tokenizer.batch_decode(preds_ids, skip_special_tokens=True)
-
-                bleu_output = metric.compute(
-                    references=references, 
-                    predictions=predictions, 
-                    tokenize="ja-mecab"
-                )
-                return bleu_output
-            return compute_metrics
+            # segmented here (and in the workers), sacrebleu only splits on whitespace
+            self.segmenter = SacreBleu._get_segmenter()
+            self.bleu = BLEU(tokenize="none", force=True)
+        else:
+            self.segmenter = None
+            self.bleu = BLEU(tokenize=SacreBleu.TOKENIZE[target_language])
+        self.reference_cache = {}
+
+    @staticmethod
+    def get_mBART_metric(*, tokenizer=None, target_language: str = None) -> "SacreBleu":
+        """Returns the BLEU `compute_metrics` of a seq2seq trainer (`predict_with_generate=True`)."""
+        return SacreBleu(tokenizer=tokenizer, target_language=target_language)
+
+    def __call__(self, preds: Tuple[np.ndarray, np.ndarray]) -> Dict[str, Union[float, List]]:
+        """Computes corpus BLEU of an `EvalPrediction` (or a (predictions, label_ids) tuple).
+
+        Returns
+        -------
+        Dict[str, Union[float, List]]
+            score, counts, totals, precisions, bp, sys_len and ref_len. The sufficient
+            statistics (counts, totals, sys_len, ref_len) of disjoint sets can be
+            merged with `SacreBleu.aggregate`
+        """
+        preds_ids, labels_ids = preds
+        predictions = self.decode(preds_ids)
+        if self.segmenter is not None:
+            predictions = self.segment(predictions)
+        # sacrebleu scores hypotheses against its reference cache when references is None
+        self.bleu._ref_cache = self._get_reference_cache(labels_ids)
+        return SacreBleu._to_dict(self.bleu.corpus_score(predictions, None))
+
+    @staticmethod
+    def aggregate(outputs: Sequence[Dict[str, Union[float, List]]]) -> Dict[str, Union[float, List]]:
+        """Corpus BLEU of the union of disjoint sets, from the outputs of each set.
+
+        Parameters
+        ----------
+        outputs : Sequence[Dict[str, Union[float, List]]]
+            outputs of `SacreBleu.__call__` (at least counts, totals, sys_len and ref_len)
+
+        Returns
+        -------
+        Dict[str, Union[float, List]]
+            the same keys as `SacreBleu.__call__`
+        """
+        assert len(outputs) > 0, "Nothing to aggregate."
+        counts = np.sum([output["counts"] for output in outputs], axis=0).tolist()
+        totals = np.sum([output["totals"] for output in outputs], axis=0).tolist()
+        score = BLEU.compute_bleu(
+            correct=counts, total=totals,
+            sys_len=sum(output["sys_len"] for output in outputs),
+            ref_len=sum(output["ref_len"] for output in outputs),
+            smooth_method="exp",
+        )
+        return SacreBleu._to_dict(score)
+
+    def decode(self, ids: np.ndarray) -> List[str]:
+        """Decodes a (batch, length) array of token ids, -100 is treated as padding."""
+        # masked copy, the caller's array is left untouched
+        ids = np.where(ids == -100, self.tokenizer.pad_token_id, ids)
+        return self.tokenizer.batch_decode(ids, skip_special_tokens=True)
+
+    def segment(self, sentences: List[str]) -> List[str]:
+        """MeCab segmentation (space separated words) of japanese sentences."""
+        if self.num_proc == 1 or len(sentences) < SacreBleu.PARALLEL_MIN_ROWS:
+            return [self.segmenter(sentence.rstrip()) for sentence in sentences]
+        chunk_size = -(-len(sentences) // self.num_proc)
+        chunks = [sentences[i : i + chunk_size] for i in range(0, len(sentences), chunk_size)]
+        with Pool(len(chunks), initializer=SacreBleu._init_worker) as pool:
+            return [sentence for chunk in pool.map(SacreBleu._segment_chunk, chunks) for sentence in chunk]
+
+    def _get_reference_cache(self, labels_ids):
+        labels_ids = np.ascontiguousarray(labels_ids)
+        key = (labels_ids.dtype.str, labels_ids.shape, xxhash.xxh3_128_hexdigest(labels_ids))
+        if key not in self.reference_cache:
+            references = self.decode(labels_ids)
+            if self.segmenter is not None:
+                references = self._get_segmented_references(references)
+            self.reference_cache[key] = self.bleu._cache_references([references])
+        return self.reference_cache[key]
+
+    def _get_segmented_references(self, references):
+        # MeCab version and dictionary are part of the key
+        key = xxhash.xxh3_128_hexdigest("\n".join([self.segmenter.signature(), *references]).encode("utf-8"))
+        if key in SacreBleu._segmentation_memo:
+            return SacreBleu._segmentation_memo[key]
+        path = f"{SacreBleu.SEGMENTATION_CACHE_DIR}/{key}.json"
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as fp:
+                segmented = json.load(fp)
         else:
-            def compute_metrics(preds):
-                preds_ids, labels_ids = preds
-
-                preds_ids[preds_ids == -100] = tokenizer.pad_token_id
-                labels_ids[labels_ids == -100] = tokenizer.pad_token_id
-                references = tokenizer.batch_decode(labels_ids, skip_special_tokens=True)
-                references = [[reference] for reference in references]
-
-                predictions = tokenizer.batch_decode(preds_ids, skip_special_tokens=True)
-                
-                bleu_output = metric.compute(
-                    references=references, 
-                    predictions=predictions
-                )
-                return bleu_output  
-            return compute_metrics
\ No newline at end of file
+            segmented = self.segment(references)
+            if not os.path.exists(SacreBleu.SEGMENTATION_CACHE_DIR):
+                os.makedirs(SacreBleu.SEGMENTATION_CACHE_DIR)
+            # written aside and renamed, an interrupted write leaves no partial cache
+            with open(f"{path}.tmp", "w", encoding="utf-8") as fp:
+                json.dump(segmented, fp, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+        SacreBleu._segmentation_memo[key] = segmented
+        return segmented
+
+    @staticmethod
+    def _get_segmenter() -> Callable[[str], str]:
+        # sacrebleu's "ja-mecab" tokenizer (MeCab + ipadic), imported only for japanese
+        from sacrebleu.tokenizers.tokenizer_ja_mecab import TokenizerJaMecab
+        return TokenizerJaMecab()
+
+    @staticmethod
+    def _init_worker():
+        SacreBleu._worker_segmenter = SacreBleu._get_segmenter()
+
+    @staticmethod
+    def _segment_chunk(sentences):
+        return [SacreBleu._worker_segmenter(sentence.rstrip()) for sentence in sentences]
+
+    @staticmethod
+    def _to_dict(score):
+        return {
+            "score": score.score,
+            "counts": score.counts,
+            "totals": score.totals,
+            "precisions": score.precisions,
+            "bp": score.bp,
+            "sys_len": score.sys_len,
+            "ref_len": score.ref_len,
+        }
@@ -0,0 +1,4 @@
+from .model_loader import EnJaModelLoader
+from .vocabulary_trimmer import EnJaVocabularyTrimmer
+
+__all__ = ["EnJaModelLoader", "EnJaVocabularyTrimmer"]
@@ -0,0 +1,204 @@
+# python libraries
+from typing import Callable, Dict, List, Optional
+import os, re, shutil
+
+# external libraries
+from torch import nn
+from transformers import (
+    AutoModelForSeq2SeqLM, AutoTokenizer, EncoderDecoderModel, MBart50TokenizerFast, MBartForConditionalGeneration, PreTrainedModel
+)
+from tokenizers import processors
+from peft import PeftModel
+from peft.tuners.lora import LoraLayer
+
+
+class EnJaModelLoader:
+    """Loads the tokenizers, base models and checkpoints of the trained models."""
+
+    MODEL_TYPES = ["mBART", "mBART-trimmed", "BERT-GPT2-xattn", "BERT-GPT2-xattn-LoRA"]
+    CHECKPOINT_DIR = r"./.ckp"
+    MBART_MODEL = r"facebook/mbart-large-50"
+    # mBART-50 with the en/ja vocabulary only (see `EnJaVocabularyTrimmer`)
+    MBART_TRIMMED_MODEL = r"./.models/mbart-large-50-en-ja"
+    BERT_GPT2_MODELS = {
+        # source language : (encoder, decoder)
+        "en" : ("bert-base-uncased", "rinna/japanese-gpt2-small"),
+        "ja" : ("cl-tohoku/bert-base-japanese-v3", "gpt2"),
+    }
+    # cross attention checkpoint used as base model of "BERT-GPT2-xattn-LoRA"
+    BERT_GPT2_XATTN_STEP = 25000
+    # suffix of the checkpoint directories with the LoRA adapters merged in
+    MERGED_SUFFIX = r"-merged"
+
+    @staticmethod
+    def get_tokenizers(model_type : str, source_language : str) -> Dict[str, Callable]:
+        """Returns the encoder and decoder tokenizers of a model type.
+
+        Parameters
+        ----------
+        model_type : str
+            one of `EnJaModelLoader.MODEL_TYPES`
+        source_language : str
+            the source language (either "en" or "ja")
+
+        Returns
+        -------
+        Dict[str, Callable]
+            {"encoder_tokenizer": ..., "decoder_tokenizer": ...}, the same mBART
+            tokenizer for both if model_type is "mBART" or "mBART-trimmed"
+        """
+        assert model_type in EnJaModelLoader.MODEL_TYPES, "Invalid model type."
+        assert source_language in ["en", "ja"], "Invalid language."
+        target_language = "ja" if source_language == "en" else "en"
+
+        if model_type in ["mBART", "mBART-trimmed"]:
+            tokenizer = MBart50TokenizerFast.from_pretrained(
+                EnJaModelLoader._get_mBART_model(model_type), src_lang=f"{source_language}_XX", tgt_lang=f"{target_language}_XX"
+            )
+            return {"encoder_tokenizer": tokenizer, "decoder_tokenizer": tokenizer}
+
+        encoder, decoder = EnJaModelLoader.BERT_GPT2_MODELS[source_language]
+        encoder_tokenizer = AutoTokenizer.from_pretrained(encoder, use_fast=True)
+        decoder_tokenizer = AutoTokenizer.from_pretrained(decoder, use_fast=True)
+        if decoder_tokenizer.pad_token_id is None:
+            decoder_tokenizer.pad_token_id = decoder_tokenizer.eos_token_id
+        # add EOS token at the end of each sentence
+        decoder_tokenizer._tokenizer.post_processor = processors.TemplateProcessing(
+            single="$A " + decoder_tokenizer.eos_token,
+            special_tokens=[(decoder_tokenizer.eos_token, decoder_tokenizer.eos_token_id)],
+        )
+        return {"encoder_tokenizer": encoder_tokenizer, "decoder_tokenizer": decoder_tokenizer}
+
+    @staticmethod
+    def get_base_model(model_type : str, source_language : str) -> Optional[PreTrainedModel]:
+        """Returns the model LoRA adapters are applied to, or None if checkpoints
+        of `model_type` are whole models ("BERT-GPT2-xattn")."""
+        assert model_type in EnJaModelLoader.MODEL_TYPES, "Invalid model type."
+        assert source_language in ["en", "ja"], "Invalid language."
+        target_language = "ja" if source_language == "en" else "en"
+
+        if model_type in ["mBART", "mBART-trimmed"]:
+            return MBartForConditionalGeneration.from_pretrained(EnJaModelLoader._get_mBART_model(model_type))
+        elif model_type == "BERT-GPT2-xattn-LoRA":
+            return EnJaModelLoader.get_checkpoint_model(
+                f"{source_language}-{target_language}-BERT-GPT2-xattn", EnJaModelLoader.BERT_GPT2_XATTN_STEP
+            )
+        return None # model_type == "BERT-GPT2-xattn"
+
+    @staticmethod
+    def get_checkpoint_model(run : str, step : int) -> PreTrainedModel:
+        """Returns the whole (encoder-decoder) model saved at a checkpoint."""
+        return EncoderDecoderModel.from_pretrained(
+            EnJaModelLoader.get_checkpoint_path(run, step), local_files_only=True
+        )
+
+    @staticmethod
+    def get_checkpoint_path(run : str, step : int) -> str:
+        """Returns the directory of the checkpoint of `run` at a given step."""
+        return f"{EnJaModelLoader.CHECKPOINT_DIR}/{run}/checkpoint-{step}"
+
+    @staticmethod
+    def get_checkpoints(run : str) -> List[int]:
+        """Returns the sorted steps of the checkpoints saved by `run`."""
+        run_dir = f"{EnJaModelLoader.CHECKPOINT_DIR}/{run}"
+        assert os.path.exists(run_dir), f"Invalid run: {run_dir} not found"
+        pattern = re.compile(r"checkpoint-(\d+)$")
+        return sorted(
+            int(match.groups()[0]) for name in os.listdir(run_dir) if (match := pattern.match(name))
+        )
+
+    @staticmethod
+    def get_merged_path(run : str, step : int) -> str:
+        """Returns the directory of the checkpoint of `run` at a given step with
+        the LoRA adapters merged into the base model (see `save_merged_checkpoint`)."""
+        return f"{EnJaModelLoader.get_checkpoint_path(run, step)}{EnJaModelLoader.MERGED_SUFFIX}"
+
+    @staticmethod
+    def get_merged_model(run : str, step : int) -> PreTrainedModel:
+        """Returns the model saved by `save_merged_checkpoint`."""
+        return AutoModelForSeq2SeqLM.from_pretrained(
+            EnJaModelLoader.get_merged_path(run, step), local_files_only=True
+        )
+
+    @staticmethod
+    def merge_adapters(model : PeftModel) -> PreTrainedModel:
+        """Folds the LoRA adapters of `model` into the base weights and returns the
+        plain base model (`model` is modified in place).
+
+        Output embeddings tied to the input embeddings (mBART and GPT2 "lm_head")
+        get their own weights first and `tie_word_embeddings` is turned off,
+        otherwise the adapters of both would be added to the same matrix. Adapters
+        of an embedding module the forward pass does not go through (mBART
+        "shared": encoder and decoder look tokens up with their "embed_tokens",
+        which hold the same weights) change no output and are dropped.
+
+        Parameters
+        ----------
+        model : PeftModel
+            a model with LoRA adapters, e.g. from `PeftModel.from_pretrained`
+
+        Returns
+        -------
+        PreTrainedModel
+            the base model with the merged weights
+        """
+        assert isinstance(model, PeftModel), "Invalid model: LoRA adapters expected."
+        base_model = model.get_base_model()
+        for submodel in [module for module in base_model.modules() if isinstance(module, PreTrainedModel)]:
+            output_embeddings = submodel.get_output_embeddings()
+            if output_embeddings is not None and output_embeddings.weight is submodel.get_input_embeddings().weight:
+                output_embeddings.weight = nn.Parameter(output_embeddings.weight.detach().clone())
+                submodel.config.tie_word_embeddings = False
+
+        embeddings = [module for module in base_model.modules() if isinstance(module, nn.Embedding) and not isinstance(module, LoraLayer)]
+        for module in base_model.modules():
+            if isinstance(module, LoraLayer) and isinstance(module, nn.Embedding):
+                if any(embedding.weight is module.weight for embedding in embeddings):
+                    # rank 0 adapters are skipped by the merge
+                    module.r[module.active_adapter] = 0
+        return model.merge_and_unload()
+
+    @staticmethod
+    def save_merged_checkpoint(model_type : str, source_language : str, run : str, step : Optional[int] = None) -> str:
+        """Merges the LoRA adapters of a checkpoint into the base model (see
+        `merge_adapters`) and saves the result as a plain model.
+
+        Parameters
+        ----------
+        model_type : str
+            one of `EnJaModelLoader.MODEL_TYPES` trained with LoRA adapters
+        source_language : str
+            the source language (either "en" or "ja")
+        run : str
+            name of the training run
+        step : int, optional
+            step of the checkpoint, by default the last one of `run`
+
+        Returns
+        -------
+        str
+            the directory of the merged model (`get_merged_path`), replaced if it exists
+        """
+        step = EnJaModelLoader.get_checkpoints(run)[-1] if step is None else step
+        base_model = EnJaModelLoader.get_base_model(model_type, source_language)
+        assert base_model is not None, f"Invalid model type: {model_type} checkpoints are whole models."
+        model = PeftModel.from_pretrained(model=base_model, model_id=EnJaModelLoader.get_checkpoint_path(run, step))
+        merged_model = EnJaModelLoader.merge_adapters(model)
+
+        # written aside and renamed, an interrupted export leaves no partial model
+        path = EnJaModelLoader.get_merged_path(run, step)
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        merged_model.save_pretrained(tmp_path)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    def _get_mBART_model(model_type):
+        if model_type == "mBART":
+            return EnJaModelLoader.MBART_MODEL
+        assert os.path.isdir(EnJaModelLoader.MBART_TRIMMED_MODEL), f"Invalid model type: {EnJaModelLoader.MBART_TRIMMED_MODEL} not found, see trim_vocabulary.py"
+        return EnJaModelLoader.MBART_TRIMMED_MODEL
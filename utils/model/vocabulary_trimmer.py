@@ -0,0 +1,287 @@
+# python libraries
+from typing import Dict, List, Optional
+import os, json, shutil
+
+# external libraries
+import numpy as np
+import torch
+from torch import nn
+from datasets import load_from_disk, DatasetDict
+from transformers import MBart50TokenizerFast, MBartForConditionalGeneration, PreTrainedModel
+
+# local libraries
+from ..dataset.dataset_base import EnJaDataset
+from ..dataset.dataset_combiner import EnJaDatasetMaker
+from .model_loader import EnJaModelLoader
+
+
+class EnJaVocabularyTrimmer:
+    """Trims the mBART-50 vocabulary to the tokens of English and Japanese.
+
+    Our corpora and evaluation sets are tokenized with the mBART-50 tokenizer
+    and the ids used are counted (`count_tokens`). The kept ids (`get_kept_ids`)
+    are the ones used, the special tokens (language codes included) and the
+    single character pieces of latin-1 and JIS X 0208 (the characters of
+    Shift_JIS: kana, common kanji, full width forms), so unseen en/ja text can
+    still be segmented. Kept ids are renumbered in order, the special tokens
+    keep ids 0-3.
+
+    The trimmed tokenizer keeps the Unigram pieces (and scores) of the kept ids
+    only: text made of the scanned pieces is segmented as before, with the new
+    ids, so `EnJaDatasetMaker` tokenization with it emits the remapped ids. The
+    trimmed model keeps the matching rows of the embeddings, "lm_head" and
+    "final_logits_bias". Both are saved together (as a huggingface model
+    directory) under `EnJaModelLoader.MBART_TRIMMED_MODEL`, loaded with the
+    "mBART-trimmed" model type of `EnJaModelLoader`. Datasets made by
+    `EnJaDatasetMaker.prepare_dataset` with the mBART-50 tokenizer are tokenized
+    again with the trimmed one by `save_trimmed_dataset`.
+    """
+
+    VOCABULARY_NAME = r"vocabulary.json"
+    DATASET_SUFFIX = r"-trimmed"
+    # character sets of the single character pieces always kept
+    KEEP_ENCODINGS = ["latin-1", "shift_jis"]
+    SPACE_PIECE = "▁"
+
+    @staticmethod
+    def get_processed_datasets() -> List[str]:
+        """Returns the processed files (corpora and evaluation sets) of `EnJaDataset.DATASET_PROCESSED_DIR`."""
+        return sorted(
+            f"{EnJaDataset.DATASET_PROCESSED_DIR}/{name}" for name in os.listdir(EnJaDataset.DATASET_PROCESSED_DIR)
+            if name.endswith((".csv", ".arrow")) and not name.startswith("cache-")
+        )
+
+    @staticmethod
+    def count_tokens(tokenizer : MBart50TokenizerFast, datasets : List[str]) -> np.ndarray:
+        """Counts the ids of the tokenized english and japanese sentences of `datasets`.
+
+        Parameters
+        ----------
+        tokenizer : MBart50TokenizerFast
+            the mBART-50 tokenizer
+        datasets : List[str]
+            processed files (.arrow or .csv) with ["en_sentence", "ja_sentence"] columns
+
+        Returns
+        -------
+        np.ndarray
+            the number of occurrences of each id (special tokens added by the
+            tokenizer excluded)
+        """
+        counts = np.zeros(len(tokenizer), dtype=np.int64)
+        for path in datasets:
+            nrows = 0
+            for _, batch in EnJaDataset.iter_processed(path):
+                for column in ["en_sentence", "ja_sentence"]:
+                    sentences = [sentence or "" for sentence in batch.column(column).to_pylist()]
+                    ids = tokenizer(sentences, add_special_tokens=False)["input_ids"]
+                    counts += np.bincount(np.fromiter((i for row in ids for i in row), dtype=np.int64), minlength=len(counts))
+                nrows += batch.num_rows
+            print(f"counted: {path} ({nrows:,} rows)")
+        return counts
+
+    @staticmethod
+    def get_kept_ids(tokenizer : MBart50TokenizerFast, counts : np.ndarray, *, min_count : int = 1) -> np.ndarray:
+        """Returns the sorted ids of the trimmed vocabulary: ids seen at least
+        `min_count` times, special tokens and single characters of `KEEP_ENCODINGS`."""
+        assert min_count > 0, "Invalid minimum count."
+        keep = counts >= min_count
+        keep[tokenizer.all_special_ids] = True
+        for piece, i in tokenizer.get_vocab().items():
+            character = piece[1:] if piece.startswith(EnJaVocabularyTrimmer.SPACE_PIECE) and len(piece) > 1 else piece
+            if len(character) == 1 and any(EnJaVocabularyTrimmer._can_encode(character, encoding) for encoding in EnJaVocabularyTrimmer.KEEP_ENCODINGS):
+                keep[i] = True
+        return np.flatnonzero(keep)
+
+    @staticmethod
+    def trim_model(model : PreTrainedModel, kept_ids : np.ndarray) -> PreTrainedModel:
+        """Keeps the rows of `kept_ids` of the embeddings, output embeddings and
+        "final_logits_bias" of an mBART model and renumbers the special token ids
+        of its config and generation config. `model` is modified in place."""
+        kept = torch.as_tensor(kept_ids, dtype=torch.long)
+        new_ids = EnJaVocabularyTrimmer._get_new_ids(model.config.vocab_size, kept_ids)
+
+        input_embeddings, output_embeddings = model.get_input_embeddings(), model.get_output_embeddings()
+        tied = output_embeddings.weight is input_embeddings.weight
+        padding_idx = input_embeddings.padding_idx
+        embeddings = nn.Embedding(
+            len(kept), input_embeddings.embedding_dim, padding_idx=int(new_ids[padding_idx]) if padding_idx is not None else None
+        )
+        embeddings.weight.data = input_embeddings.weight.data[kept].clone()
+        model.set_input_embeddings(embeddings)
+        if not tied:
+            # e.g. adapters merged with `EnJaModelLoader.merge_adapters`
+            head = nn.Linear(output_embeddings.in_features, len(kept), bias=output_embeddings.bias is not None)
+            head.weight.data = output_embeddings.weight.data[kept].clone()
+            if output_embeddings.bias is not None:
+                head.bias.data = output_embeddings.bias.data[kept].clone()
+            model.set_output_embeddings(head)
+        if hasattr(model, "final_logits_bias"):
+            model.register_buffer("final_logits_bias", model.final_logits_bias[:, kept].clone())
+        model.config.vocab_size = len(kept)
+        if tied:
+            model.tie_weights()
+
+        for config in [model.config, model.generation_config]:
+            for name in ["pad_token_id", "bos_token_id", "eos_token_id", "decoder_start_token_id", "forced_bos_token_id", "forced_eos_token_id"]:
+                if getattr(config, name, None) is not None:
+                    assert new_ids[getattr(config, name)] >= 0, f"Invalid vocabulary: {name} is not kept"
+                    setattr(config, name, int(new_ids[getattr(config, name)]))
+        return model
+
+    @staticmethod
+    def save_tokenizer(tokenizer : MBart50TokenizerFast, kept_ids : np.ndarray, path : str) -> None:
+        """Saves the mBART-50 tokenizer with the Unigram pieces of `kept_ids` only
+        (renumbered in order) to `path`."""
+        state = json.loads(tokenizer.backend_tokenizer.to_str())
+        assert state["model"]["type"] == "Unigram", "Invalid tokenizer: Unigram model expected."
+        assert len(state["model"]["vocab"]) == len(tokenizer), "Invalid tokenizer: added tokens outside of the vocabulary."
+        new_ids = EnJaVocabularyTrimmer._get_new_ids(len(tokenizer), kept_ids)
+        state["model"]["vocab"] = [state["model"]["vocab"][i] for i in kept_ids]
+        state["model"]["unk_id"] = int(new_ids[state["model"]["unk_id"]])
+        state["added_tokens"] = [
+            {**token, "id": int(new_ids[token["id"]])} for token in state["added_tokens"] if new_ids[token["id"]] >= 0
+        ]
+        if state.get("post_processor") is not None and "special_tokens" in state["post_processor"]:
+            for token in state["post_processor"]["special_tokens"].values():
+                token["ids"] = [int(new_ids[i]) for i in token["ids"]]
+
+        tokenizer.save_pretrained(path)
+        # the sentencepiece model of the slow tokenizer has the whole vocabulary
+        for name in MBart50TokenizerFast.vocab_files_names.values():
+            if os.path.exists(f"{path}/{name}"):
+                os.remove(f"{path}/{name}")
+        with open(f"{path}/tokenizer.json", "w", encoding="utf-8") as fp:
+            json.dump(state, fp, ensure_ascii=False)
+        return
+
+    @staticmethod
+    def save_trimmed_model(datasets : Optional[List[str]] = None, path : str = EnJaModelLoader.MBART_TRIMMED_MODEL, *, min_count : int = 1) -> Dict[str, int]:
+        """Counts the tokens of `datasets`, trims the mBART-50 model and tokenizer
+        to the kept ids and saves both to `path`.
+
+        Parameters
+        ----------
+        datasets : List[str], optional
+            processed files to scan, by default all of `get_processed_datasets`
+        path : str, optional
+            output directory (replaced if it exists), by default
+            `EnJaModelLoader.MBART_TRIMMED_MODEL`
+        min_count : int, optional
+            occurrences for an id to be kept, by default 1
+
+        Returns
+        -------
+        Dict[str, int]
+            vocabulary size, parameters and embedding bytes, before and after trimming
+        """
+        datasets = EnJaVocabularyTrimmer.get_processed_datasets() if datasets is None else datasets
+        assert len(datasets) > 0, "Invalid datasets: nothing to scan."
+        tokenizer = MBart50TokenizerFast.from_pretrained(EnJaModelLoader.MBART_MODEL)
+        model = MBartForConditionalGeneration.from_pretrained(EnJaModelLoader.MBART_MODEL)
+        report = {"vocab_size": model.config.vocab_size, **EnJaVocabularyTrimmer._get_sizes(model)}
+
+        kept_ids = EnJaVocabularyTrimmer.get_kept_ids(tokenizer, EnJaVocabularyTrimmer.count_tokens(tokenizer, datasets), min_count=min_count)
+        model = EnJaVocabularyTrimmer.trim_model(model, kept_ids)
+        report.update({"trimmed_vocab_size": model.config.vocab_size, **{
+            f"trimmed_{name}": value for name, value in EnJaVocabularyTrimmer._get_sizes(model).items()
+        }})
+
+        # written aside and renamed, an interrupted run leaves no partial model
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        model.save_pretrained(tmp_path)
+        EnJaVocabularyTrimmer.save_tokenizer(tokenizer, kept_ids, tmp_path)
+        with open(f"{tmp_path}/{EnJaVocabularyTrimmer.VOCABULARY_NAME}", "w") as fp:
+            json.dump({
+                "base_model": EnJaModelLoader.MBART_MODEL,
+                "datasets": datasets,
+                "min_count": min_count,
+                "kept_ids": kept_ids.tolist(),
+            }, fp)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        return report
+
+    @staticmethod
+    def save_trimmed_dataset(dataset_id : str, source_language : str, *, num_proc : int = 4, batch_size : int = 1000) -> str:
+        """Tokenizes the mBART dataset `dataset_id` again with the trimmed tokenizer
+        and saves it as `dataset_id` + `DATASET_SUFFIX`.
+
+        Rows, splits and order are the ones of `dataset_id`, only the "length",
+        "input_ids", "attention_mask" and "labels" columns are computed again
+        from the "source" and "target" sentences (as `EnJaDatasetMaker` does).
+
+        Parameters
+        ----------
+        dataset_id : str
+            id of a dataset of `EnJaDataset.DATASET_FINAL_DIR` made with
+            model_type="mBART" (not `packed` only, the sentences are needed)
+        source_language : str
+            the source language of the dataset (either "en" or "ja")
+        num_proc : int, optional
+            number of workers, by default 4
+        batch_size : int, optional
+            number of rows tokenized at once, by default 1000
+
+        Returns
+        -------
+        str
+            the id of the trimmed dataset
+        """
+        save_dir = f"{EnJaDataset.DATASET_FINAL_DIR}/{dataset_id}"
+        trimmed_id = f"{dataset_id}{EnJaVocabularyTrimmer.DATASET_SUFFIX}"
+        trimmed_dir = f"{EnJaDataset.DATASET_FINAL_DIR}/{trimmed_id}"
+        if os.path.exists(trimmed_dir):
+            print(EnJaDataset.LOAD_FROM_CACHE_FORMAT.format(id=trimmed_id))
+            return trimmed_id
+        assert os.path.exists(save_dir), EnJaDataset.LOAD_INVALID_ID_FORMAT.format(id=dataset_id)
+        tokenizer = EnJaModelLoader.get_tokenizers("mBART-trimmed", source_language)["encoder_tokenizer"]
+
+        tokenize = lambda data: EnJaDatasetMaker._tokenize(
+            data.with_format(None).select_columns(["source", "target"]), None, model_type="mBART",
+            tokenizer=tokenizer, encoder_tokenizer=None, decoder_tokenizer=None,
+            num_proc=num_proc, batched=True, batch_size=batch_size
+        )
+        dataset = load_from_disk(save_dir)
+        if isinstance(dataset, DatasetDict):
+            dataset = DatasetDict({split: tokenize(data) for split, data in dataset.items()})
+        else:
+            dataset = tokenize(dataset)
+        dataset.set_format(type="torch")
+        dataset.save_to_disk(trimmed_dir)
+        return trimmed_id
+
+    @staticmethod
+    def load_kept_ids(path : str = EnJaModelLoader.MBART_TRIMMED_MODEL) -> np.ndarray:
+        """Returns the ids of the mBART-50 vocabulary kept by the trimmed model at `path`
+        (new id i is old id `kept_ids[i]`)."""
+        with open(f"{path}/{EnJaVocabularyTrimmer.VOCABULARY_NAME}", "r") as fp:
+            return np.array(json.load(fp)["kept_ids"], dtype=np.int64)
+
+    @staticmethod
+    def _can_encode(character, encoding):
+        try:
+            character.encode(encoding)
+            return True
+        except UnicodeEncodeError:
+            return False
+
+    @staticmethod
+    def _get_new_ids(vocab_size, kept_ids):
+        # old id -> new id, -1 if dropped
+        new_ids = np.full(vocab_size, -1, dtype=np.int64)
+        new_ids[kept_ids] = np.arange(len(kept_ids))
+        return new_ids
+
+    @staticmethod
+    def _get_sizes(model):
+        embeddings = [model.get_input_embeddings().weight]
+        if model.get_output_embeddings().weight is not embeddings[0]:
+            embeddings.append(model.get_output_embeddings().weight)
+        return {
+            "parameters": sum(param.numel() for param in model.parameters()),
+            "embedding_bytes": sum(weight.numel() * weight.element_size() for weight in embeddings),
+        }